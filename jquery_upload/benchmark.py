@@ -0,0 +1,310 @@
+import Queue
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+import timeit
+import django
+from django.db import connection
+from django.test.client import RequestFactory
+from django.core.files.uploadedfile import SimpleUploadedFile
+from jquery_upload.headers import parse_content_disposition_filename, parse_content_range
+from jquery_upload.storage import UploadTempStorageFileSystem
+from jquery_upload.views import SIZE_REPLY_TEMPLATE, BaseUploadContentView, PartialUploadCacheMixin
+
+# Get an instance of a logger
+logger = logging.getLogger()
+
+# what an uploader that failed outright reports: no requests timed, one error, and no memory figure
+FAILED_UPLOADER_RESULT = ([], 1, None)
+
+
+class _BenchmarkSession(object):
+    """
+    Just enough of a session for PartialUploadCacheMixin, which only needs a key to keep uploads apart.
+    """
+
+    def __init__(self, session_key):
+        self.session_key = session_key
+
+
+def make_benchmark_view(model, file_field_name, temp_storage, partial):
+    """
+    Build the view function for an upload view like the ones sites define.
+
+    @param model: The model to save uploads to
+    @type model: Model class
+    @param file_field_name: Name of its file field
+    @type file_field_name: str
+    @param temp_storage: Temp storage for the uploads
+    @type temp_storage: BaseUploadTempStorage
+    @param partial: Whether to use PartialUploadCacheMixin, for chunked uploads
+    @type partial: bool
+    @rtype: callable
+    """
+    if partial:
+        bases = (PartialUploadCacheMixin, BaseUploadContentView)
+    else:
+        bases = (BaseUploadContentView,)
+    view_class = type('BenchmarkUploadView', bases, {
+        'model': model,
+        'file_field_name': file_field_name,
+        'temp_storage': temp_storage,
+    })
+    return view_class.as_view()
+
+
+def percentile(sorted_values, fraction):
+    """
+    @param sorted_values: Values in ascending order
+    @type sorted_values: list
+    @param fraction: Which percentile, as a fraction, so 0.99 for p99
+    @type fraction: float
+    @return: The nearest value at that percentile, or None if there aren't any.
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[int(round(fraction * (len(sorted_values) - 1)))]
+
+
+def peak_rss_bytes():
+    """
+    @return: The most memory this process has ever had resident, in bytes.
+    @rtype: int
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports it in kilobytes, OS X in bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def cpu_seconds(who=resource.RUSAGE_SELF):
+    """
+    @param who: RUSAGE_SELF for this process, or RUSAGE_CHILDREN for the child processes that have been waited for
+    @return: The user and system CPU time used so far, in seconds.
+    @rtype: float
+    """
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def time_request_overhead(iterations=100000):
+    """
+    Time the work done for every chunk whatever its size: parsing its Content-Range and Content-Disposition, and
+    replying with the size uploaded so far.
+
+    @param iterations: How many times to do each
+    @type iterations: int
+    @return: Microseconds each took, along with the Python and Django versions.
+    @rtype: dict
+    """
+    content_range = 'bytes 1048576-2097151/5242880'
+    content_disposition = 'attachment; filename="benchmark.bin"; filename*=UTF-8\'\'benchmark.bin'
+    steps = {
+        'parse_content_range': lambda: parse_content_range(content_range),
+        'parse_content_disposition': lambda: parse_content_disposition_filename(content_disposition),
+        'size_reply': lambda: SIZE_REPLY_TEMPLATE % 2097152,
+    }
+    result = {
+        'iterations': iterations,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+    }
+    for name, step in steps.items():
+        result['%s_us' % name] = min(timeit.repeat(step, number=iterations, repeat=3)) / iterations * 10 ** 6
+    return result
+
+
+class UploadBenchmark(object):
+    """
+    Uploads files through an upload view in this process, timing every request, as a repeatable benchmark.
+
+    Requests are built with RequestFactory and passed straight to the view, so the numbers cover the view, the cache,
+    the temp storage and saving the model, without a web server or network in the way. Use a local cache (such as
+    locmem) and put the temp folder on the disk or tmpfs you're interested in.
+    """
+
+    def __init__(self, model, file_field_name, temp_file_folder='benchmark-uploads', temp_roots=None):
+        """
+        @param model: The model to save uploads to. Instances made during a run are deleted afterwards, with their
+        files.
+        @type model: Model class
+        @param file_field_name: Name of its file field
+        @type file_field_name: str
+        @param temp_file_folder: Folder for the temp files, within MEDIA_ROOT (or each of temp_roots).
+        @type temp_file_folder: str
+        @param temp_roots: Optional, folders to keep temp files in instead of MEDIA_ROOT, such as a tmpfs.
+        @type temp_roots: list
+        """
+        self.model = model
+        self.file_field_name = file_field_name
+        self.temp_storage = UploadTempStorageFileSystem(temp_file_folder, temp_roots=temp_roots)
+        self.request_factory = RequestFactory()
+
+    def run(self, file_size, chunk_size=None, uploaders=1, files_per_uploader=1, use_processes=False):
+        """
+        Upload files through the view and report how it went.
+
+        @param file_size: Bytes in each file
+        @type file_size: int
+        @param chunk_size: Bytes in each chunk, through PartialUploadCacheMixin. None uploads each file whole, through a
+        view without it.
+        @type chunk_size: int or None
+        @param uploaders: How many uploaders to run at once
+        @type uploaders: int
+        @param files_per_uploader: How many files each uploader sends, one after another
+        @type files_per_uploader: int
+        @param use_processes: Run each uploader in its own process, rather than a thread of this one
+        @type use_processes: bool
+        @return: The settings for the run, and its requests_per_second, megabytes_per_second, p50_latency,
+        p99_latency (in seconds), cpu_seconds_per_request, errors and peak_rss_bytes. An uploader that fails outright
+        counts as one error.
+        @rtype: dict
+        """
+        view = make_benchmark_view(self.model, self.file_field_name, self.temp_storage, chunk_size is not None)
+        data = os.urandom(file_size)
+        last_pk = self._last_pk()
+
+        started = time.time()
+        cpu_started = cpu_seconds(resource.RUSAGE_CHILDREN if use_processes else resource.RUSAGE_SELF)
+        if use_processes:
+            results = self._run_processes(view, data, chunk_size, uploaders, files_per_uploader)
+        else:
+            results = self._run_threads(view, data, chunk_size, uploaders, files_per_uploader)
+        seconds = time.time() - started
+        cpu_used = cpu_seconds(resource.RUSAGE_CHILDREN if use_processes else resource.RUSAGE_SELF) - cpu_started
+
+        self._delete_uploads(last_pk)
+
+        latencies = sorted(sum([latencies for latencies, errors, max_rss in results], []))
+        # uploaders that failed outright don't know theirs
+        peak_rss = [result[2] for result in results if result[2] is not None]
+        return {
+            'file_size': file_size,
+            'chunk_size': chunk_size,
+            'partial': chunk_size is not None,
+            'uploaders': uploaders,
+            'files_per_uploader': files_per_uploader,
+            'concurrency': 'processes' if use_processes else 'threads',
+            'requests': len(latencies),
+            'errors': sum(errors for latencies, errors, max_rss in results),
+            'seconds': seconds,
+            'requests_per_second': len(latencies) / seconds,
+            'megabytes_per_second': file_size * uploaders * files_per_uploader / seconds / 2 ** 20,
+            'p50_latency': percentile(latencies, 0.5),
+            'p99_latency': percentile(latencies, 0.99),
+            'cpu_seconds_per_request': cpu_used / len(latencies) if latencies else None,
+            'peak_rss_bytes': max(peak_rss) if peak_rss else None,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        }
+
+    def upload(self, view, data, name, chunk_size, session_key):
+        """
+        Upload one file through the view, a chunk at a time if chunk_size is given, as jQuery file upload would.
+
+        @return: The seconds each request took, and how many of them failed.
+        @rtype: (list, int)
+        """
+        latencies = []
+        errors = 0
+        offsets = range(0, len(data), chunk_size) if chunk_size else [None]
+        for offset in offsets:
+            if offset is None:
+                request = self._make_request(data, name, session_key)
+            else:
+                chunk = data[offset:offset + chunk_size]
+                request = self._make_request(chunk, 'blob', session_key, {
+                    'HTTP_CONTENT_RANGE': 'bytes %d-%d/%d' % (offset, offset + len(chunk) - 1, len(data)),
+                    'HTTP_CONTENT_DISPOSITION': 'attachment; filename="%s"' % name,
+                })
+
+            request_started = time.time()
+            response = view(request)
+            latencies.append(time.time() - request_started)
+            if response.status_code != 200 or '"error"' in response.content:
+                errors += 1
+        return latencies, errors
+
+    def _run_threads(self, view, data, chunk_size, uploaders, files_per_uploader):
+        results = []
+
+        def uploader(index):
+            try:
+                latencies, errors = self._upload_files(view, data, chunk_size, index, files_per_uploader)
+                results.append((latencies, errors, peak_rss_bytes()))
+            except Exception:
+                logger.exception('Benchmark uploader %s failed' % index)
+                results.append(FAILED_UPLOADER_RESULT)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=uploader, args=(i,)) for i in range(uploaders)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _run_processes(self, view, data, chunk_size, uploaders, files_per_uploader):
+        queue = multiprocessing.Queue()
+
+        def uploader(index):
+            result = FAILED_UPLOADER_RESULT
+            try:
+                latencies, errors = self._upload_files(view, data, chunk_size, index, files_per_uploader)
+                result = (latencies, errors, peak_rss_bytes())
+            except Exception:
+                logger.exception('Benchmark uploader %s failed' % index)
+            finally:
+                # whatever happened, so the parent isn't left waiting for it
+                queue.put(result)
+                connection.close()
+
+        # each process needs its own database connection
+        connection.close()
+        processes = [multiprocessing.Process(target=uploader, args=(i,)) for i in range(uploaders)]
+        for process in processes:
+            process.start()
+        results = []
+        while len(results) < len(processes):
+            try:
+                results.append(queue.get(timeout=1))
+            except Queue.Empty:
+                # a process killed before it could report never will; what processes put is sent before they exit
+                if not any(process.is_alive() for process in processes) and queue.empty():
+                    results.extend([FAILED_UPLOADER_RESULT] * (len(processes) - len(results)))
+        for process in processes:
+            process.join()
+        return results
+
+    def _upload_files(self, view, data, chunk_size, index, files_per_uploader):
+        latencies = []
+        errors = 0
+        for file_index in range(files_per_uploader):
+            file_latencies, file_errors = self.upload(
+                view, data, 'benchmark-%s-%s.bin' % (index, file_index), chunk_size,
+                'benchmark-%s-%s' % (os.getpid(), index))
+            latencies.extend(file_latencies)
+            errors += file_errors
+        return latencies, errors
+
+    def _make_request(self, data, name, session_key, meta=None):
+        request = self.request_factory.post('/', {'files': SimpleUploadedFile(name, data)}, **(meta or {}))
+        request.session = _BenchmarkSession(session_key)
+        return request
+
+    def _last_pk(self):
+        last = self.model._default_manager.order_by('-pk').values_list('pk', flat=True)[:1]
+        return last[0] if last else None
+
+    def _delete_uploads(self, last_pk):
+        uploads = self.model._default_manager.all()
+        if last_pk is not None:
+            uploads = uploads.filter(pk__gt=last_pk)
+        for instance in uploads:
+            getattr(instance, self.file_field_name).delete(save=False)
+            instance.delete()
@@ -0,0 +1,113 @@
+import hashlib
+import threading
+import zlib
+from jquery_upload.streams import RunningStreams
+
+# Checksums whose running value is a plain integer, so it can be carried from one request to the next
+ZLIB_CHECKSUMS = {
+    'adler32': (zlib.adler32, 1),
+    'crc32': (zlib.crc32, 0),
+}
+
+
+class RunningChecksum(object):
+    """
+    A checksum of a file, built up a piece at a time from the start of the file as its chunks are uploaded.
+
+    The algorithm is any of ZLIB_CHECKSUMS or anything hashlib.new accepts (md5, sha1, sha256 ...). Only the zlib
+    checksums have a state that can be stored between requests; hashlib's hash objects can't be saved, so they only
+    survive in the memory of the process computing them (see get_running_checksum).
+    """
+
+    def __init__(self, algorithm, offset=0, value=None):
+        """
+        @param algorithm: Name of the checksum algorithm
+        @type algorithm: str
+        @param offset: How far into the file the checksum has got, when resuming from a saved state.
+        @type offset: int
+        @param value: The running value of a zlib checksum, when resuming from a saved state.
+        @type value: int
+        """
+        self.algorithm = algorithm
+        self.offset = offset
+        # see RunningStreams
+        self.lock = threading.Lock()
+        if algorithm in ZLIB_CHECKSUMS:
+            self._hash = None
+            self._value = ZLIB_CHECKSUMS[algorithm][1] if value is None else value
+        else:
+            self._hash = hashlib.new(algorithm)
+
+    def update(self, data):
+        """
+        Add the next piece of the file to the checksum.
+
+        @param data: The bytes following on from offset.
+        @type data: str
+        """
+        if self._hash is None:
+            self._value = ZLIB_CHECKSUMS[self.algorithm][0](data, self._value)
+        else:
+            self._hash.update(data)
+        self.offset += len(data)
+
+    def hexdigest(self):
+        """
+        @return: The checksum of the file so far, as lower case hex.
+        @rtype: str
+        """
+        if self._hash is None:
+            return '%08x' % (self._value & 0xffffffff)
+        return self._hash.hexdigest()
+
+    def get_state(self):
+        """
+        @return: (offset, value) for a zlib checksum, which can be passed back to the constructor to carry on, or None
+        for a hashlib checksum.
+        @rtype: tuple or None
+        """
+        if self._hash is None:
+            return self.offset, self._value
+        return None
+
+
+# Most checksums to keep in a process for uploads that haven't finished
+MAX_RUNNING_CHECKSUMS = 1024
+_running_checksums = RunningStreams(MAX_RUNNING_CHECKSUMS)
+
+
+def get_running_checksum(algorithm, file_id, state=None):
+    """
+    Get the running checksum for an upload, as far through the file as we can get without reading it.
+
+    That's whichever is further along of the checksum kept in this process and the saved state, or a new checksum
+    starting from the beginning of the file if we have neither.
+
+    @param algorithm: Name of the checksum algorithm
+    @type algorithm: str
+    @param file_id: Unique ID of the file being uploaded
+    @type file_id: str
+    @param state: Optional, a saved state from RunningChecksum.get_state
+    @type state: tuple
+    @rtype: RunningChecksum
+    """
+    checksum = _running_checksums.get(file_id)
+    if checksum is not None and checksum.algorithm != algorithm:
+        checksum = None
+    if state is not None and (checksum is None or state[0] > checksum.offset):
+        checksum = RunningChecksum(algorithm, *state)
+    if checksum is None:
+        checksum = RunningChecksum(algorithm)
+    return checksum
+
+
+def keep_running_checksum(file_id, checksum):
+    """
+    Keep a running checksum in this process for the next chunk of the upload, dropping the least recently used
+    checksums if there are more than MAX_RUNNING_CHECKSUMS.
+    """
+    _running_checksums.keep(file_id, checksum)
+
+
+def forget_running_checksum(file_id):
+    _running_checksums.forget(file_id)
@@ -0,0 +1,71 @@
+import Queue
+import logging
+import threading
+
+# Get an instance of a logger
+logger = logging.getLogger()
+
+
+class LocalThreadExecutor(object):
+    """
+    A small pool of daemon threads in this process, for running work after the response has gone back.
+
+    It has the submit() method of the executors in concurrent.futures, so any of those (or anything else with the same
+    method) can be used in its place.
+    """
+
+    def __init__(self, max_workers=4):
+        """
+        @param max_workers: Most threads to run jobs on at once.
+        @type max_workers: int
+        """
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue up fn(*args, **kwargs) to be run on one of the pool's threads.
+
+        @param fn: The callable to run
+        @type fn: callable
+        """
+        self._start_workers()
+        self._queue.put((fn, args, kwargs))
+
+    def _start_workers(self):
+        # threads are started lazily, so importing this module never starts any
+        with self._lock:
+            while len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            fn, args, kwargs = self._queue.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                logger.exception('Background job %r failed' % fn)
+            finally:
+                self._queue.task_done()
+
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor():
+    """
+    Get the executor shared by every view in this process that doesn't bring its own.
+
+    @rtype: LocalThreadExecutor
+    """
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = LocalThreadExecutor()
+        return _default_executor
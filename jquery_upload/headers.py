@@ -0,0 +1,126 @@
+import re
+import urllib
+
+# Content-Range of a chunk, such as 'bytes 0-1048575/5242880'
+CONTENT_RANGE_RE = re.compile(r'^\s*bytes\s+(\d+)\s*-\s*(\d+)\s*/\s*(\d+)\s*$', re.IGNORECASE)
+# A parameter of a Content-Disposition, with its value quoted or not. Some clients leave out the type before it.
+DISPOSITION_PARAMETER_RE = re.compile(r'(?:^|;)\s*([^\s;=]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+QUOTED_PAIR_RE = re.compile(r'\\(.)')
+# A backslash in a quoted file name that's a Windows folder separator, not escaping a quote
+FOLDER_BACKSLASH_RE = re.compile(r'\\(?!")')
+# An RFC 5987 extended value, such as "UTF-8''na%C3%AFve.txt"
+EXTENDED_VALUE_RE = re.compile(r"^([^']*)'[^']*'(.*)$")
+# A client's ID for an upload, such as '1f0c2a7e-4d5b-4a8e-9c41-0b6e5a1d2f3c'
+UPLOAD_ID_RE = re.compile(r'^[\w-]{1,64}$')
+
+_parsed_dispositions = {}
+# Most Content-Dispositions to remember the file names of. Every chunk of an upload sends the same one.
+MAX_PARSED_DISPOSITIONS = 1024
+
+
+def parse_content_range(value):
+    """
+    Parse the Content-Range of a chunk.
+
+    @param value: The header's value, or None if there isn't one
+    @type value: str
+    @return: The positions of the first and last bytes of the chunk, and the size of the whole file. All of them are
+    None without a Content-Range.
+    @rtype: (int, int, int)
+    @raise ValueError: If the Content-Range can't be understood, or its positions don't make sense.
+    """
+    if not value:
+        return None, None, None
+    match = CONTENT_RANGE_RE.match(value)
+    if match is None:
+        raise ValueError('Bad Content-Range: %r' % value)
+    starting, ending, total = match.groups()
+    starting, ending, total = int(starting), int(ending), int(total)
+    if ending < starting or ending >= total:
+        raise ValueError('Bad Content-Range: %r' % value)
+    return starting, ending, total
+
+
+def parse_upload_id(value):
+    """
+    Check a client's ID for an upload, as sent with each of its chunks.
+
+    @param value: The header's value, or None if there isn't one
+    @type value: str
+    @return: The ID, or None without one
+    @rtype: str or None
+    @raise ValueError: If the ID isn't 1 to 64 letters, digits, underscores and dashes.
+    """
+    if not value:
+        return None
+    if UPLOAD_ID_RE.match(value) is None:
+        raise ValueError('Bad upload ID: %r' % value)
+    return value
+
+
+def parse_content_disposition_filename(value):
+    """
+    Get the file name from a Content-Disposition, preferring the RFC 5987 filename* (as in
+    filename*=UTF-8''na%C3%AFve.txt) to the plain filename when it has both. Any folders in the name are dropped. The
+    disposition type (attachment or inline) can be left out.
+
+    The names are remembered, so the same header isn't parsed again for the next chunk.
+
+    @param value: The header's value, or None if there isn't one
+    @type value: str
+    @return: The name of the file, or None if there isn't one
+    @rtype: str or unicode or None
+    """
+    if not value:
+        return None
+    try:
+        return _parsed_dispositions[value]
+    except KeyError:
+        pass
+
+    filename = extended_filename = None
+    for name, parameter in DISPOSITION_PARAMETER_RE.findall(value):
+        name = name.lower()
+        if name == 'filename':
+            filename = _plain_filename(parameter.strip())
+        elif name == 'filename*':
+            extended_filename = _base_name(_decode_extended_value(parameter.strip()))
+    filename = extended_filename or filename
+
+    if len(_parsed_dispositions) >= MAX_PARSED_DISPOSITIONS:
+        _parsed_dispositions.clear()
+    _parsed_dispositions[value] = filename
+    return filename
+
+
+def _plain_filename(value):
+    if len(value) > 1 and value[0] == value[-1] == '"':
+        # the folders are dropped before unescaping. A backslash before a quote escapes it, as a Windows path can't
+        # have quotes in it, and any other backslash ends a folder.
+        filename = FOLDER_BACKSLASH_RE.split(value[1:-1])[-1].rsplit('/', 1)[-1]
+        return filename.replace('\\"', '"').strip() or None
+    return _base_name(value)
+
+
+def _unquote(value):
+    if len(value) > 1 and value[0] == value[-1] == '"':
+        return QUOTED_PAIR_RE.sub(r'\1', value[1:-1])
+    return value
+
+
+def _decode_extended_value(value):
+    match = EXTENDED_VALUE_RE.match(_unquote(value))
+    if match is None:
+        return None
+    charset, encoded = match.groups()
+    try:
+        return urllib.unquote(encoded).decode(charset or 'utf-8')
+    except (LookupError, UnicodeDecodeError):
+        return None
+
+
+def _base_name(filename):
+    # as Django does for multipart uploads, so a name can't lead anywhere else
+    if not filename:
+        return None
+    return filename[filename.rfind('\\') + 1:].rsplit('/', 1)[-1].strip() or None
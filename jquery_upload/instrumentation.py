@@ -0,0 +1,232 @@
+import logging
+import socket
+import threading
+import time
+from django.dispatch import Signal
+
+# Get an instance of a logger
+logger = logging.getLogger()
+
+# Sent by SignalMetricsSink for every metric, with its kind ('timing', 'count', 'gauge' or 'histogram'), name and value
+upload_metric = Signal(providing_args=['kind', 'name', 'value'])
+
+
+class BaseMetricsSink(object):
+    """
+    Somewhere for an upload view's metrics to go. Set one as the view's metrics_sink to turn metrics on.
+
+    Timings are in seconds. Names are short and dotted, like 'phase.temp_write'; see the README for the full list.
+    """
+
+    def timing(self, name, seconds):
+        """
+        Record how long something took.
+
+        @param name: Name of the metric
+        @type name: str
+        @param seconds: How long it took
+        @type seconds: float
+        """
+        raise NotImplementedError()
+
+    def count(self, name, value=1):
+        """
+        Add to a running count.
+
+        @param name: Name of the metric
+        @type name: str
+        @param value: How much to add
+        @type value: int
+        """
+        raise NotImplementedError()
+
+    def gauge(self, name, value):
+        """
+        Record the current level of something.
+
+        @param name: Name of the metric
+        @type name: str
+        @param value: Its level now
+        @type value: int or float
+        """
+        raise NotImplementedError()
+
+    def histogram(self, name, value):
+        """
+        Record one value of something whose spread matters, like a chunk's size.
+
+        @param name: Name of the metric
+        @type name: str
+        @param value: The value
+        @type value: int or float
+        """
+        raise NotImplementedError()
+
+
+class MemoryMetricsSink(BaseMetricsSink):
+    """
+    Keeps a summary of every metric in this process's memory, for tests, benchmarks, or a status page.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def timing(self, name, seconds):
+        self._summarise(self.timings, name, seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def histogram(self, name, value):
+        self._summarise(self.histograms, name, value)
+
+    def reset(self):
+        """
+        Forget everything recorded so far.
+        """
+        with self._lock:
+            # name: {'count', 'total', 'min', 'max'}
+            self.timings = {}
+            self.histograms = {}
+            # name: value
+            self.counts = {}
+            self.gauges = {}
+
+    def get_stats(self):
+        """
+        @return: Copies of the timings, counts, gauges and histograms recorded, with a 'mean' for each summary.
+        @rtype: dict
+        """
+        with self._lock:
+            stats = {'counts': dict(self.counts), 'gauges': dict(self.gauges)}
+            for kind in ('timings', 'histograms'):
+                stats[kind] = dict(
+                    (name, dict(summary, mean=summary['total'] / float(summary['count'])))
+                    for name, summary in getattr(self, kind).items())
+        return stats
+
+    def _summarise(self, summaries, name, value):
+        with self._lock:
+            summary = summaries.get(name)
+            if summary is None:
+                summaries[name] = {'count': 1, 'total': value, 'min': value, 'max': value}
+            else:
+                summary['count'] += 1
+                summary['total'] += value
+                summary['min'] = min(summary['min'], value)
+                summary['max'] = max(summary['max'], value)
+
+
+class StatsdMetricsSink(BaseMetricsSink):
+    """
+    Sends every metric to a statsd server as a UDP packet, so recording one never waits on the network. Timings are
+    sent in milliseconds.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='jquery_upload'):
+        """
+        @param host: Host of the statsd server, normally a local agent.
+        @type host: str
+        @param port: Its UDP port
+        @type port: int
+        @param prefix: Put in front of every metric's name, with a dot.
+        @type prefix: str
+        """
+        self.address = (host, port)
+        self.prefix = '%s.' % prefix if prefix else ''
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def timing(self, name, seconds):
+        self._send(name, '%.3f|ms' % (seconds * 1000))
+
+    def count(self, name, value=1):
+        self._send(name, '%d|c' % value)
+
+    def gauge(self, name, value):
+        self._send(name, '%s|g' % value)
+
+    def histogram(self, name, value):
+        self._send(name, '%s|h' % value)
+
+    def _send(self, name, value):
+        try:
+            self._socket.sendto('%s%s:%s' % (self.prefix, name, value), self.address)
+        except socket.error, e:
+            # metrics are never worth failing an upload over
+            logger.debug('Sending metric %s failed: %s', name, e)
+
+
+class SignalMetricsSink(BaseMetricsSink):
+    """
+    Sends every metric as the upload_metric signal, for receivers to do as they like with.
+    """
+
+    def timing(self, name, seconds):
+        upload_metric.send(sender=self, kind='timing', name=name, value=seconds)
+
+    def count(self, name, value=1):
+        upload_metric.send(sender=self, kind='count', name=name, value=value)
+
+    def gauge(self, name, value):
+        upload_metric.send(sender=self, kind='gauge', name=name, value=value)
+
+    def histogram(self, name, value):
+        upload_metric.send(sender=self, kind='histogram', name=name, value=value)
+
+
+class PhaseTimer(object):
+    """
+    Times one phase of a request into a metrics sink, as a 'with' block.
+    """
+
+    def __init__(self, sink, name):
+        self.sink = sink
+        self.name = name
+        self.seconds = None
+
+    def __enter__(self):
+        self._started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.time() - self._started
+        self.sink.timing(self.name, self.seconds)
+        return False
+
+
+class _NullTimer(object):
+    """
+    Stands in for a PhaseTimer when metrics are off, so timing a phase costs next to nothing.
+    """
+    seconds = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class InFlightCounter(object):
+    """
+    Counts how many of something are under way in this process, reporting each change as a gauge.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, sink, name, delta):
+        with self._lock:
+            self.value += delta
+            value = self.value
+        sink.gauge(name, value)
@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from jquery_upload.models import UploadProgress
+
+# Get an instance of a logger
+logger = logging.getLogger()
+
+
+class TempFileJanitor(object):
+    """
+    Cleans up temp files left behind by uploads that were never finished.
+
+    Temp files not written to for max_age seconds are deleted. If min_free_bytes is given and the temp storage is
+    short of space, files are deleted from the longest abandoned onwards, until there's enough space again or only
+    files written to in the last min_age seconds are left.
+
+    Keep max_age at least as long as the progress timeout of your views (see PartialUploadCacheMixin). An upload whose
+    temp file has gone can't be resumed, and its next chunk is turned away. The UploadProgress rows (see
+    PartialUploadDatabaseMixin) of the uploads whose temp files are deleted are deleted with them.
+    """
+
+    def __init__(self, temp_storage, max_age=24 * 60 * 60, min_free_bytes=None, min_age=60 * 60, batch_size=500,
+                 batch_pause=0, reap_upload_progress=None):
+        """
+        @param temp_storage: The temp storage to clean up.
+        @type temp_storage: BaseUploadTempStorage
+        @param max_age: Seconds after which a temp file that isn't being written to is abandoned.
+        @type max_age: int
+        @param min_free_bytes: Optional, the space to keep free for temp files.
+        @type min_free_bytes: int
+        @param min_age: Seconds a temp file must have been left for before it's deleted to free up space.
+        @type min_age: int
+        @param batch_size: Number of files to delete between pauses.
+        @type batch_size: int
+        @param batch_pause: Seconds to pause between batches.
+        @type batch_pause: float
+        @param reap_upload_progress: Optional, whether to delete the UploadProgress rows of the temp files deleted.
+        Defaults to doing so when jquery_upload is in INSTALLED_APPS.
+        @type reap_upload_progress: bool
+        """
+        self.temp_storage = temp_storage
+        self.max_age = max_age
+        self.min_free_bytes = min_free_bytes
+        self.min_age = min_age
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        if reap_upload_progress is None:
+            reap_upload_progress = 'jquery_upload' in settings.INSTALLED_APPS
+        self.reap_upload_progress = reap_upload_progress
+        # totals across every run
+        self.runs = 0
+        self.files_reclaimed = 0
+        self.bytes_reclaimed = 0
+        self.progress_reclaimed = 0
+
+    def reap(self, now=None):
+        """
+        Delete abandoned temp files, once.
+
+        @param now: Optional, the time to treat as now (in seconds since the epoch).
+        @type now: float
+        @return: Dictionary of the files_reclaimed, bytes_reclaimed and progress_reclaimed (UploadProgress rows) by
+        this run, and how long it took in seconds.
+        @rtype: dict
+        """
+        started = time.time()
+        if now is None:
+            now = started
+
+        files_removed, bytes_freed, progress_removed = self._reap_before(now - self.max_age)
+
+        if self.min_free_bytes is not None:
+            # work forward through the activity index until there's room, or nothing old enough is left
+            for activity_time in self.temp_storage.get_activity_times():
+                free_bytes = self.temp_storage.get_free_bytes()
+                if free_bytes is None or free_bytes >= self.min_free_bytes:
+                    break
+                last_active_before = activity_time + getattr(self.temp_storage, 'activity_interval', 0)
+                if last_active_before > now - self.min_age:
+                    break
+                removed, freed, progress = self._reap_before(last_active_before)
+                files_removed += removed
+                bytes_freed += freed
+                progress_removed += progress
+
+        self.runs += 1
+        self.files_reclaimed += files_removed
+        self.bytes_reclaimed += bytes_freed
+        self.progress_reclaimed += progress_removed
+        result = {
+            'files_reclaimed': files_removed,
+            'bytes_reclaimed': bytes_freed,
+            'progress_reclaimed': progress_removed,
+            'seconds': time.time() - started,
+        }
+        logger.info('Reaped %(files_reclaimed)s abandoned temp files, %(bytes_reclaimed)s bytes, and '
+                    '%(progress_reclaimed)s upload progress rows, in %(seconds).2fs' % result)
+        return result
+
+    def run_periodically(self, interval=60 * 60):
+        """
+        Start a daemon thread in this process that reaps every interval seconds.
+
+        @param interval: Seconds between runs.
+        @type interval: int
+        @return: The thread that's been started.
+        @rtype: Thread
+        """
+        def run():
+            while True:
+                try:
+                    self.reap()
+                except Exception:
+                    logger.exception('Reaping abandoned temp files failed')
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _reap_before(self, last_active_before):
+        reaped_file_ids = []
+        files_removed, bytes_freed = self.temp_storage.reap_abandoned_temp_files(
+            last_active_before, self.batch_size, self.batch_pause, reaped_file_ids)
+        return files_removed, bytes_freed, self._reap_progress_of(reaped_file_ids)
+
+    def _reap_progress_of(self, file_ids):
+        # otherwise an upload whose temp file has gone would still be reported, and resumed, from its old byte count
+        if not self.reap_upload_progress:
+            return 0
+        count = 0
+        for i in range(0, len(file_ids), self.batch_size):
+            stale_progress = UploadProgress.objects.filter(file_id__in=file_ids[i:i + self.batch_size])
+            batch_count = stale_progress.count()
+            if batch_count:
+                stale_progress.delete()
+                count += batch_count
+        return count
@@ -0,0 +1,367 @@
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from django.core.cache import cache
+from django.core.cache.backends.base import BaseCache
+
+# Scopes limits can be set for, from the narrowest
+LIMIT_SCOPES = ('session', 'user', 'global')
+
+
+class LocalLimitStore(object):
+    """
+    Keeps the state of an UploadLimiter in this process's memory. It's the quickest, but each process has its own
+    limits, so divide them by the number of processes.
+    """
+    # Most buckets to keep before dropping the ones that have filled up again
+    max_buckets = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key: (tokens, time they were counted, rate, capacity)
+        self._buckets = {}
+        # key: number of slots taken
+        self._slots = {}
+
+    def take_tokens(self, key, amount, rate, capacity):
+        """
+        Take tokens from a token bucket, if it has enough. A request for more than the bucket holds is let through
+        once the bucket is full, leaving it in debt.
+
+        @param key: Key of the bucket
+        @type key: str
+        @param amount: Tokens to take
+        @type amount: int
+        @param rate: Tokens added to the bucket each second
+        @type rate: float
+        @param capacity: Most tokens the bucket holds
+        @type capacity: float
+        @return: 0 if the tokens were taken, otherwise the seconds until there will be enough.
+        @rtype: float
+        """
+        with self._lock:
+            now = time.time()
+            tokens, updated = self._buckets.get(key, (capacity, now))[:2]
+            tokens, wait = _take_tokens(tokens, now - updated, amount, rate, capacity)
+            self._buckets[key] = (tokens, now, rate, capacity)
+            if len(self._buckets) > self.max_buckets:
+                self._drop_full_buckets(now)
+            return wait
+
+    def return_tokens(self, key, amount, rate, capacity):
+        """
+        Put back tokens that were taken for a request which was turned away after all.
+        """
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key][:2]
+                self._buckets[key] = (min(capacity, tokens + amount), updated, rate, capacity)
+
+    def take_slot(self, key, limit, timeout):
+        """
+        Take one of a limited number of slots.
+
+        @param key: Key of the slots
+        @type key: str
+        @param limit: How many slots there are
+        @type limit: int
+        @param timeout: Seconds after which a slot that hasn't been given back is free again. Not needed here, where
+        slots can't be lost.
+        @type timeout: int
+        @return: An ID for the slot taken, to give back with give_back_slot, or None if they're all taken.
+        @rtype: str or None
+        """
+        with self._lock:
+            taken = self._slots.get(key, 0)
+            if taken >= limit:
+                return None
+            self._slots[key] = taken + 1
+            return key
+
+    def give_back_slot(self, key, slot_id):
+        with self._lock:
+            taken = self._slots.get(key, 0) - 1
+            if taken > 0:
+                self._slots[key] = taken
+            else:
+                self._slots.pop(key, None)
+
+    def _drop_full_buckets(self, now):
+        for key, (tokens, updated, rate, capacity) in self._buckets.items():
+            if tokens + (now - updated) * rate >= capacity:
+                del self._buckets[key]
+
+
+class CacheLimitStore(object):
+    """
+    Keeps the state of an UploadLimiter in the default cache, so its limits apply across every process using the cache.
+
+    Caches with a native incr (like memcached) are updated with incr and decr alone. A token bucket is kept as the
+    time, in milliseconds, at which it will be full again, and slots are counted for each period of the slot timeout
+    they were taken in. Other backends only emulate incr with a get and a set, so each change is made under a short
+    lock instead, held with cache.add.
+    """
+
+    def __init__(self, key_prefix='jquery_upload::limit', lock_timeout=5, bucket_timeout=3600):
+        """
+        @param key_prefix: Put in front of every cache key
+        @type key_prefix: str
+        @param lock_timeout: Seconds before a lock is given up as abandoned
+        @type lock_timeout: int
+        @param bucket_timeout: Seconds to keep a token bucket counted with incr, which can't have its timeout moved on
+        each time it's used
+        @type bucket_timeout: int
+        """
+        self.key_prefix = key_prefix
+        self.lock_timeout = lock_timeout
+        self.bucket_timeout = bucket_timeout
+
+    def take_tokens(self, key, amount, rate, capacity):
+        if cache_has_atomic_incr(cache):
+            return self._take_counted_tokens(key, amount, rate, capacity)
+        bucket_key = self._key('bucket', key)
+        with self._locked(bucket_key):
+            now = time.time()
+            tokens, updated = cache.get(bucket_key, (capacity, now))
+            tokens, wait = _take_tokens(tokens, now - updated, amount, rate, capacity)
+            # once it's had time to fill up again it can be forgotten
+            cache.set(bucket_key, (tokens, now), int((capacity - tokens) / rate) + 60)
+        return wait
+
+    def return_tokens(self, key, amount, rate, capacity):
+        if cache_has_atomic_incr(cache):
+            self._decr(self._key('full_at', key), _milliseconds(amount / float(rate)))
+            return
+        bucket_key = self._key('bucket', key)
+        with self._locked(bucket_key):
+            bucket = cache.get(bucket_key)
+            if bucket is not None:
+                tokens, updated = bucket
+                tokens = min(capacity, tokens + amount)
+                cache.set(bucket_key, (tokens, updated), int((capacity - tokens) / rate) + 60)
+
+    def take_slot(self, key, limit, timeout):
+        if cache_has_atomic_incr(cache):
+            return self._take_counted_slot(key, limit, timeout)
+        slots_key = self._key('slots', key)
+        with self._locked(slots_key):
+            now = time.time()
+            # slot ID: when it expires
+            slots = dict((slot_id, expires) for slot_id, expires in cache.get(slots_key, {}).items() if expires > now)
+            if len(slots) >= limit:
+                return None
+            slot_id = uuid.uuid4().hex
+            slots[slot_id] = now + timeout
+            cache.set(slots_key, slots, timeout)
+        return slot_id
+
+    def give_back_slot(self, key, slot_id):
+        if cache_has_atomic_incr(cache):
+            # the ID is the key of the count for the period the slot was taken in
+            self._decr(slot_id, 1)
+            return
+        slots_key = self._key('slots', key)
+        with self._locked(slots_key):
+            slots = cache.get(slots_key, {})
+            if slots.pop(slot_id, None) is not None:
+                cache.set(slots_key, slots, max([int(expires - time.time()) for expires in slots.values()] + [1]))
+
+    def _take_counted_tokens(self, key, amount, rate, capacity):
+        full_at_key = self._key('full_at', key)
+        now = _milliseconds(time.time())
+        rate = float(rate)
+        cost = _milliseconds(amount / rate)
+        full_at = self._incr(full_at_key, cost, now + cost, self.bucket_timeout)
+        if full_at - cost < now:
+            # the bucket had filled up already, so it starts again from now. Another request doing the same at the
+            # same time can be missed out, but only while the bucket is nearly full.
+            full_at = now + cost
+            cache.set(full_at_key, full_at, self.bucket_timeout)
+        # the same test as _take_tokens, in milliseconds of tokens
+        wait = full_at - cost - now - _milliseconds((capacity - min(amount, capacity)) / rate)
+        if wait > 0:
+            self._decr(full_at_key, cost)
+            return wait / 1000.0
+        return 0
+
+    def _take_counted_slot(self, key, limit, timeout):
+        # slots from before the last period are taken to have been abandoned
+        period = int(time.time() / timeout)
+        count_key = self._key('slots', '%s::%d' % (key, period))
+        taken = self._incr(count_key, 1, 1, timeout * 2)
+        if taken + (cache.get(self._key('slots', '%s::%d' % (key, period - 1))) or 0) > limit:
+            self._decr(count_key, 1)
+            return None
+        return count_key
+
+    def _incr(self, key, delta, initial, timeout):
+        while True:
+            try:
+                return cache.incr(key, delta)
+            except ValueError:
+                if cache.add(key, initial, timeout):
+                    return initial
+
+    def _decr(self, key, delta):
+        try:
+            cache.decr(key, delta)
+        except ValueError:
+            # it's expired, so there's nothing to give back to
+            pass
+
+    def _key(self, kind, key):
+        return ('%s::%s::%s' % (self.key_prefix, kind, key)).replace(' ', ':')
+
+    @contextmanager
+    def _locked(self, key):
+        lock_key = '%s::lock' % key
+        delay = 0.001
+        while not cache.add(lock_key, True, self.lock_timeout):
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        try:
+            yield
+        finally:
+            cache.delete(lock_key)
+
+
+def cache_has_atomic_incr(backend):
+    """
+    Check whether a cache implements incr itself (like memcached), rather than using BaseCache's version, which is just
+    a get followed by a set.
+
+    @type backend: BaseCache
+    @rtype: bool
+    """
+    for klass in type(backend).__mro__:
+        if klass is BaseCache:
+            return False
+        if 'incr' in klass.__dict__:
+            return True
+    return False
+
+
+def _milliseconds(seconds):
+    return int(math.ceil(seconds * 1000))
+
+
+def _take_tokens(tokens, elapsed, amount, rate, capacity):
+    tokens = min(capacity, tokens + elapsed * rate)
+    needed = min(amount, capacity)
+    if tokens < needed:
+        return tokens, (needed - tokens) / rate
+    return tokens - amount, 0
+
+
+class Admission(object):
+    """
+    Whether an UploadLimiter let a request in. If it did, release() must be called once the request is done.
+    """
+
+    def __init__(self, limiter, admitted, scope=None, reason=None, retry_after=None, slots=()):
+        self.limiter = limiter
+        self.admitted = admitted
+        # the scope of the limit that turned the request away, and whether it was for 'bandwidth' or 'concurrency'
+        self.scope = scope
+        self.reason = reason
+        # whole seconds to wait before trying again
+        self.retry_after = retry_after
+        self._slots = list(slots)
+
+    def release(self):
+        """
+        Give back the request's upload slots.
+        """
+        while self._slots:
+            self.limiter.store.give_back_slot(*self._slots.pop())
+
+
+class UploadLimiter(object):
+    """
+    Turns away upload requests over a limit on bandwidth (a token bucket of bytes per second) or on the number of
+    uploads going on at once. Limits can be set for each session, each logged in user, and for everyone together.
+
+    Requests are judged on their Content-Length before any of the body is read, so turning one away is quick.
+    """
+
+    def __init__(self, bytes_per_second=None, burst_seconds=1, concurrent_uploads=None, store=None, slot_timeout=300):
+        """
+        @param bytes_per_second: Bandwidth for each scope ('session', 'user' or 'global') that has a limit, such as
+        {'session': 2 ** 20, 'global': 50 * 2 ** 20}.
+        @type bytes_per_second: dict
+        @param burst_seconds: How many seconds' worth of bandwidth can be used at once after a quiet spell. Make it big
+        enough for a whole chunk.
+        @type burst_seconds: float
+        @param concurrent_uploads: Most upload requests at once for each scope that has a limit, such as
+        {'session': 4, 'global': 100}.
+        @type concurrent_uploads: dict
+        @param store: Where to keep track, a LocalLimitStore or CacheLimitStore. Defaults to a CacheLimitStore.
+        @param slot_timeout: Seconds after which an upload that never finished stops counting against the limits, in
+        case its process died.
+        @type slot_timeout: int
+        """
+        self.bytes_per_second = bytes_per_second or {}
+        self.burst_seconds = burst_seconds
+        self.concurrent_uploads = concurrent_uploads or {}
+        self.store = store if store is not None else CacheLimitStore()
+        self.slot_timeout = slot_timeout
+
+    def admit(self, request):
+        """
+        Decide whether to let an upload request in, taking its share of the limits if so.
+
+        @param request: The upload request, whose body hasn't been read yet
+        @type request: HttpRequest
+        @rtype: Admission
+        """
+        keys = self.get_limit_keys(request)
+        slots = []
+        for scope in LIMIT_SCOPES:
+            if scope not in keys or scope not in self.concurrent_uploads:
+                continue
+            slot_id = self.store.take_slot(keys[scope], self.concurrent_uploads[scope], self.slot_timeout)
+            if slot_id is None:
+                Admission(self, True, slots=slots).release()
+                return Admission(self, False, scope, 'concurrency', 1)
+            slots.append((keys[scope], slot_id))
+
+        try:
+            byte_count = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            byte_count = 0
+        taken = []
+        for scope in LIMIT_SCOPES:
+            if scope not in keys or scope not in self.bytes_per_second or not byte_count:
+                continue
+            rate = float(self.bytes_per_second[scope])
+            capacity = rate * self.burst_seconds
+            wait = self.store.take_tokens(keys[scope], byte_count, rate, capacity)
+            if wait:
+                for taken_key, taken_rate, taken_capacity in taken:
+                    self.store.return_tokens(taken_key, byte_count, taken_rate, taken_capacity)
+                Admission(self, True, slots=slots).release()
+                return Admission(self, False, scope, 'bandwidth', int(math.ceil(wait)))
+            taken.append((keys[scope], rate, capacity))
+
+        return Admission(self, True, slots=slots)
+
+    def get_limit_keys(self, request):
+        """
+        Work out who a request counts against.
+
+        @param request: The upload request
+        @type request: HttpRequest
+        @return: Key for each scope the request is in. Requests without a session or a logged in user are only in
+        'global'.
+        @rtype: dict
+        """
+        keys = {'global': 'global'}
+        session = getattr(request, 'session', None)
+        if session is not None and session.session_key:
+            keys['session'] = 'session::%s' % session.session_key
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated():
+            keys['user'] = 'user::%s' % user.pk
+        return keys
@@ -0,0 +1,66 @@
+import json
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import get_model
+from jquery_upload.benchmark import UploadBenchmark, time_request_overhead
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+class Command(BaseCommand):
+    args = '<app_label.Model> <file_field_name>'
+    help = 'Times uploads through an upload view, printing one line of JSON per combination of settings tried.'
+    option_list = BaseCommand.option_list + (
+        make_option('--file-sizes', dest='file_sizes', default='65536,1048576,16777216',
+                    help='Comma separated sizes of file to upload, in bytes.'),
+        make_option('--chunk-sizes', dest='chunk_sizes', default='0,1048576',
+                    help='Comma separated chunk sizes, in bytes. 0 uploads whole files without partial upload '
+                         'support.'),
+        make_option('--uploaders', dest='uploaders', default='1,4',
+                    help='Comma separated numbers of uploaders to run at once.'),
+        make_option('--files-per-uploader', type='int', dest='files_per_uploader', default=4,
+                    help='Number of files each uploader sends.'),
+        make_option('--concurrency', dest='concurrency', default='threads,processes',
+                    help='Comma separated ways to run the uploaders: threads, processes or both.'),
+        make_option('--temp-folder', dest='temp_file_folder', default='benchmark-uploads',
+                    help='Folder for temp files, within MEDIA_ROOT or the --temp-root.'),
+        make_option('--temp-root', dest='temp_root', default=None,
+                    help='Keep temp files here instead of MEDIA_ROOT, such as on a tmpfs.'),
+        make_option('--output', dest='output', default=None,
+                    help='Append the results to this file instead of printing them.'),
+        make_option('--request-overhead', action='store_true', dest='request_overhead', default=False,
+                    help='Only time parsing the headers of a chunk and replying to it, with no uploads.'),
+        make_option('--iterations', type='int', dest='iterations', default=100000,
+                    help='Times to repeat each step for --request-overhead.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['request_overhead']:
+            self.stdout.write(json.dumps(time_request_overhead(options['iterations']), sort_keys=True) + '\n')
+            return
+        if len(args) != 2:
+            raise CommandError('Give the model to save uploads to, as app_label.Model, and its file field.')
+        model = get_model(*args[0].split('.', 1))
+        if model is None:
+            raise CommandError('Unknown model %s' % args[0])
+        concurrency = options['concurrency'].split(',')
+        if set(concurrency) - set(['threads', 'processes']):
+            raise CommandError('--concurrency takes threads, processes, or both.')
+
+        benchmark = UploadBenchmark(model, args[1], options['temp_file_folder'],
+                                    [options['temp_root']] if options['temp_root'] else None)
+        output = open(options['output'], 'a') if options['output'] else self.stdout
+        try:
+            for file_size in _int_list(options['file_sizes']):
+                for chunk_size in _int_list(options['chunk_sizes']):
+                    for uploaders in _int_list(options['uploaders']):
+                        for way in concurrency:
+                            result = benchmark.run(file_size, chunk_size or None, uploaders,
+                                                   options['files_per_uploader'], way == 'processes')
+                            output.write(json.dumps(result, sort_keys=True) + '\n')
+                            output.flush()
+        finally:
+            if output is not self.stdout:
+                output.close()
@@ -0,0 +1,40 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from jquery_upload.janitor import TempFileJanitor
+from jquery_upload.storage import UploadTempStorageFileSystem
+
+
+class Command(BaseCommand):
+    args = '<temp_file_folder temp_file_folder ...>'
+    help = 'Deletes temp files left behind by uploads that were never finished, and their upload progress.'
+    option_list = BaseCommand.option_list + (
+        make_option('--max-age', type='int', dest='max_age', default=24 * 60 * 60,
+                    help='Seconds after which a temp file that is not being written to is abandoned.'),
+        make_option('--min-free-bytes', type='int', dest='min_free_bytes', default=None,
+                    help='Delete the longest abandoned temp files until this much space is free.'),
+        make_option('--min-age', type='int', dest='min_age', default=60 * 60,
+                    help='Seconds a temp file must have been left for before it is deleted to free up space.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=500,
+                    help='Number of files to delete between pauses.'),
+        make_option('--batch-pause', type='float', dest='batch_pause', default=0,
+                    help='Seconds to pause between batches.'),
+        make_option('--shard-depth', type='int', dest='shard_depth', default=0,
+                    help='The shard_depth the temp storage was given.'),
+        make_option('--temp-root', action='append', dest='temp_roots', default=None,
+                    help='One of the temp_roots the temp storage was given. Repeat for each root.'),
+    )
+
+    def handle(self, *temp_file_folders, **options):
+        if not temp_file_folders:
+            raise CommandError('Give the temp_file_folder of at least one temp storage.')
+
+        for temp_file_folder in temp_file_folders:
+            janitor = TempFileJanitor(UploadTempStorageFileSystem(temp_file_folder, options['shard_depth'],
+                                                                  options['temp_roots']),
+                                      options['max_age'],
+                                      options['min_free_bytes'], options['min_age'], options['batch_size'],
+                                      options['batch_pause'])
+            result = janitor.reap()
+            self.stdout.write('%s: %s files, %s bytes, %s upload progress rows reclaimed in %.2fs\n' % (
+                temp_file_folder, result['files_reclaimed'], result['bytes_reclaimed'], result['progress_reclaimed'],
+                result['seconds']))
@@ -1 +1,54 @@
 __author__ = 'shaun_stanworth'
+
+from django.db import models
+
+
+class UploadProgress(models.Model):
+    """
+    How far a partial upload has got, kept by PartialUploadDatabaseMixin. There's one row for each file being uploaded,
+    found by the session, model and name of the file, and the client's ID for the upload if it sent one.
+    """
+    session_key = models.CharField(max_length=40)
+    model_name = models.CharField(max_length=100)
+    file_name = models.CharField(max_length=255)
+    upload_id = models.CharField(max_length=64, blank=True, default='')
+    file_id = models.CharField(max_length=100, db_index=True)
+    expected_byte_count = models.BigIntegerField(null=True)
+    uploaded_byte_count = models.BigIntegerField(default=0)
+    # JSON list of the [start, end] byte ranges written so far, for positional writes
+    uploaded_byte_ranges = models.TextField(default='[]')
+    # JSON of the running checksum's state, for crc32 and adler32
+    checksum_state = models.TextField(null=True)
+    finalised = models.BooleanField(default=False)
+    # goes up with every change to uploaded_byte_ranges, so concurrent chunks can't overwrite each other's ranges
+    version = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        # this is also the index uploads are looked up with
+        unique_together = (('session_key', 'model_name', 'file_name', 'upload_id'),)
+
+    def __unicode__(self):
+        return u'%s (%s of %s bytes)' % (self.file_name, self.uploaded_byte_count, self.expected_byte_count)
+
+
+class StoredContent(models.Model):
+    """
+    Where some uploaded content was stored, by its checksum, so views with deduplicate_uploads set only store each
+    distinct file once.
+    """
+    model_name = models.CharField(max_length=100)
+    field_name = models.CharField(max_length=100)
+    algorithm = models.CharField(max_length=20)
+    checksum = models.CharField(max_length=128)
+    byte_count = models.BigIntegerField()
+    # name of the file in the field's storage
+    storage_name = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # this is also the index content is looked up with
+        unique_together = (('checksum', 'byte_count', 'algorithm', 'model_name', 'field_name'),)
+
+    def __unicode__(self):
+        return u'%s %s: %s' % (self.algorithm, self.checksum, self.storage_name)
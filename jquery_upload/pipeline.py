@@ -0,0 +1,205 @@
+import tempfile
+import threading
+import zlib
+from django.core.files.base import File
+from jquery_upload.streams import RunningStreams
+
+
+class BaseUploadStage(object):
+    """
+    A step of processing fed an upload's bytes in order as they're written to the temp file, so its result is ready
+    without reading the finished file again. Set a view's upload_stages to a list of stage classes; each upload gets
+    new instances of them.
+
+    Stages live in the memory of the process handling the upload. Any chunks a process didn't see (because they went to
+    another process, or arrived out of order) are read back from the temp file and fed in when the upload finishes.
+    """
+    # Key for the stage's result, and by default the model field it's stored in (see store_stage_results)
+    name = None
+    # Added to the upload's name when a File result is saved into a FileField
+    file_suffix = ''
+
+    def update(self, data):
+        """
+        Take the next piece of the file.
+
+        @param data: The bytes following on from the last piece
+        @type data: str
+        """
+        raise NotImplementedError()
+
+    def finish(self):
+        """
+        @return: The result of the stage, once it's been given the whole file.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Free anything the stage holds, when its upload is dropped before it's finished.
+        """
+        pass
+
+
+class ByteCountStage(BaseUploadStage):
+    """
+    Counts the bytes in the file.
+    """
+    name = 'byte_count'
+
+    def __init__(self):
+        self.byte_count = 0
+
+    def update(self, data):
+        self.byte_count += len(data)
+
+    def finish(self):
+        return self.byte_count
+
+
+class SniffTypeStage(BaseUploadStage):
+    """
+    Works out the content type of the file from its first few bytes, rather than trusting its name.
+    """
+    name = 'sniffed_type'
+    # (leading bytes, content type)
+    signatures = (
+        ('\x89PNG\r\n\x1a\n', 'image/png'),
+        ('\xff\xd8\xff', 'image/jpeg'),
+        ('GIF87a', 'image/gif'),
+        ('GIF89a', 'image/gif'),
+        ('%PDF-', 'application/pdf'),
+        ('PK\x03\x04', 'application/zip'),
+        ('\x1f\x8b', 'application/gzip'),
+    )
+    sniff_byte_count = 16
+
+    def __init__(self):
+        self.head = ''
+
+    def update(self, data):
+        if len(self.head) < self.sniff_byte_count:
+            self.head += data[:self.sniff_byte_count - len(self.head)]
+
+    def finish(self):
+        if self.head.startswith('RIFF') and self.head[8:12] == 'WEBP':
+            return 'image/webp'
+        for signature, content_type in self.signatures:
+            if self.head.startswith(signature):
+                return content_type
+        return None
+
+
+class GzipStage(BaseUploadStage):
+    """
+    Gzips the file as it arrives, into an anonymous temporary file. The result is a File of the gzipped content, ready
+    to save into a FileField.
+    """
+    name = 'gzipped'
+    file_suffix = '.gz'
+    compression_level = 6
+
+    def __init__(self):
+        # 16 + MAX_WBITS makes zlib write the gzip header and trailer
+        self._compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._output = tempfile.TemporaryFile()
+
+    def update(self, data):
+        self._output.write(self._compressor.compress(data))
+
+    def finish(self):
+        self._output.write(self._compressor.flush())
+        gzipped = File(self._output)
+        # an anonymous file has no path for File to find its size from
+        gzipped.size = self._output.tell()
+        self._output.seek(0)
+        return gzipped
+
+    def close(self):
+        self._output.close()
+
+
+class BaseFileStage(object):
+    """
+    A step of processing that needs the whole of a file at once, like making a thumbnail of an image. Set a view's
+    file_stages to a list of these classes; they're run on the finalisation executor after the upload is saved.
+    """
+    # Key for the stage's result, and by default the model field it's stored in (see store_file_stage_results)
+    name = None
+    # Added to the upload's name when a File result is saved into a FileField
+    file_suffix = ''
+
+    def process(self, instance, file_field):
+        """
+        @param instance: The saved instance of the model for the upload
+        @type instance: Model
+        @param file_field: Its file field, holding the upload
+        @type file_field: FieldFile
+        @return: The result of the stage
+        """
+        raise NotImplementedError()
+
+
+class RunningPipeline(object):
+    """
+    The streaming stages of an upload, and how far through the file they've got.
+    """
+
+    def __init__(self, stage_classes):
+        self.stages = [stage_class() for stage_class in stage_classes]
+        self.offset = 0
+        # see RunningStreams
+        self.lock = threading.Lock()
+
+    def update(self, data):
+        for stage in self.stages:
+            stage.update(data)
+        self.offset += len(data)
+
+    def finish(self):
+        """
+        @return: Each stage's result, by its name.
+        @rtype: dict
+        """
+        return dict((stage.name, stage.finish()) for stage in self.stages)
+
+    def close(self):
+        """
+        Free what the stages hold, for a pipeline that won't be finished.
+        """
+        for stage in self.stages:
+            stage.close()
+
+
+# Most pipelines to keep in a process for uploads that haven't finished
+MAX_RUNNING_PIPELINES = 256
+# the stages of a pipeline that's dropped to make room can hold temporary files
+_running_pipelines = RunningStreams(MAX_RUNNING_PIPELINES, on_drop=RunningPipeline.close)
+
+
+def get_running_pipeline(stage_classes, file_id):
+    """
+    Get the running pipeline for an upload kept in this process, or a new one starting from the beginning of the file.
+
+    @param stage_classes: The streaming stage classes to run
+    @type stage_classes: list
+    @param file_id: Unique ID of the file being uploaded
+    @type file_id: str
+    @rtype: RunningPipeline
+    """
+    pipeline = _running_pipelines.get(file_id)
+    if pipeline is None:
+        pipeline = RunningPipeline(stage_classes)
+    return pipeline
+
+
+def keep_running_pipeline(file_id, pipeline):
+    """
+    Keep a running pipeline in this process for the next chunk of the upload, dropping the least recently used
+    pipelines if there are more than MAX_RUNNING_PIPELINES.
+    """
+    _running_pipelines.keep(file_id, pipeline)
+
+
+def forget_running_pipeline(file_id):
+    _running_pipelines.forget(file_id)
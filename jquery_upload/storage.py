@@ -0,0 +1,654 @@
+import ctypes
+import errno
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.move import file_move_safe
+from django.utils._os import safe_join
+
+
+def _load_posix_fallocate():
+    """
+    Find the C library's posix_fallocate (the 64 bit offset version, so big files work on 32 bit systems too), which
+    Python 2's os module doesn't have.
+
+    @return: posix_fallocate(fd, offset, length), returning 0 or an errno, or None if the platform doesn't have it.
+    """
+    try:
+        posix_fallocate = ctypes.CDLL(None).posix_fallocate64
+    except (OSError, AttributeError):
+        return None
+    posix_fallocate.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    posix_fallocate.restype = ctypes.c_int
+    return posix_fallocate
+
+
+_posix_fallocate = _load_posix_fallocate()
+
+
+class BaseUploadTempStorage(object):
+    """
+    Somewhere to keep uploaded files up until they're 'complete'. Subclass this to keep them somewhere else.
+    """
+
+    def open_temp_file(self, file_id):
+        """
+        Open the temp uploaded file.
+
+        @param file_id: Unique ID of the uploaded file.
+        @type file_id: str
+        @return: Opened (as binary) File instance
+        @rtype: File
+        """
+        raise NotImplementedError()
+
+    def remove_temp_file(self, file_id):
+        """
+        Delete the temp uploaded file, if it's still there.
+
+        @param file_id: Unique ID of the uploaded file
+        @type file_id: str
+        """
+        raise NotImplementedError()
+
+    def temp_file_exists(self, file_id):
+        """
+        Check whether a temp uploaded file is still there, so a resumed upload whose file has been reaped can be
+        turned away. Storages that can't tell say it is.
+
+        @param file_id: Unique ID of the uploaded file
+        @type file_id: str
+        @rtype: bool
+        """
+        return True
+
+    def append_content_to_temp_file(self, file_id, file_contents):
+        """
+        Append additional content to a temporary upload file (or create the file if it doesn't exist).
+
+        @param file_id: Unique ID of the uploaded file.
+        @type file_id: str
+        @param file_contents: Contents to append to the temp file. If this is unicode, it's encoded in UTF-8.
+        @type file_contents: str or unicode
+        """
+        raise NotImplementedError()
+
+    def append_uploaded_file_to_temp_file(self, file_id, uploaded_file, chunk_callback=None):
+        """
+        Stream an uploaded file onto the end of a temporary upload file (or create the file if it doesn't exist).
+
+        @param file_id: Unique ID of the uploaded file.
+        @type file_id: str
+        @param uploaded_file: The file or blob being uploaded.
+        @type uploaded_file: UploadedFile
+        @param chunk_callback: Optional, called with each piece of the upload as it's written.
+        @type chunk_callback: callable
+        """
+        raise NotImplementedError()
+
+    def write_uploaded_file_to_temp_file(self, file_id, uploaded_file, offset, expected_byte_count=None,
+                                         chunk_callback=None):
+        """
+        Write an uploaded file into a temporary upload file at a given byte offset (or create the file if it doesn't
+        exist).
+
+        @param file_id: Unique ID of the uploaded file.
+        @type file_id: str
+        @param uploaded_file: The file or blob being uploaded.
+        @type uploaded_file: UploadedFile
+        @param offset: Position in the temp file to write the upload at.
+        @type offset: int
+        @param expected_byte_count: Optional, the final size of the file.
+        @type expected_byte_count: int
+        @param chunk_callback: Optional, called with each piece of the upload as it's written.
+        @type chunk_callback: callable
+        """
+        raise NotImplementedError()
+
+    def get_activity_times(self):
+        """
+        Get the times the temp files' activity has been recorded for, so a janitor can work through them oldest first.
+
+        @return: Sorted times (in seconds since the epoch), each the start of a period of recorded activity.
+        @rtype: list
+        """
+        raise NotImplementedError()
+
+    def reap_abandoned_temp_files(self, last_active_before, batch_size=500, batch_pause=0, reaped_file_ids=None):
+        """
+        Delete temp files that haven't been written to since a given time.
+
+        @param last_active_before: Time (in seconds since the epoch) before which the files were last written to.
+        @type last_active_before: float
+        @param batch_size: Number of files to delete between pauses.
+        @type batch_size: int
+        @param batch_pause: Seconds to pause between batches, to leave some disk I/O for uploads.
+        @type batch_pause: float
+        @param reaped_file_ids: Optional, a list to add the file ID of each file deleted to.
+        @type reaped_file_ids: list
+        @return: The number of files deleted, and the number of bytes that freed.
+        @rtype: (int, int)
+        """
+        raise NotImplementedError()
+
+    def get_free_bytes(self):
+        """
+        @return: The number of bytes free for temp files, or None if we can't tell.
+        @rtype: int or None
+        """
+        return None
+
+
+class UploadTempFile(File):
+    """
+    A completed temp upload file. Like Django's TemporaryUploadedFile it knows its path on disk, so saving it to a
+    FileSystemStorage moves it into place (an os.rename, or a streamed copy between filesystems) rather than reading
+    and rewriting every byte.
+    """
+
+    def __init__(self, file, name=None):
+        super(UploadTempFile, self).__init__(file, name)
+        # know the size up front, as FieldFile.save asks for it after the file has been moved
+        self.size = os.fstat(file.fileno()).st_size
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class UploadTempStorageFileSystem(BaseUploadTempStorage):
+    # Size of the buffers used when streaming an upload into a temp file
+    copy_buffer_size = 64 * 2 ** 10
+    # Size of the buffers used when copying an upload Django has already spooled to disk, with no chunk_callback
+    disk_copy_buffer_size = 2 ** 20
+    # Let completed files be moved into their final storage, instead of copied
+    move_on_finalise = True
+    # Seconds covered by each file of the activity index, which the janitor reads to find abandoned temp files
+    activity_interval = 60 * 60
+    activity_folder = '.activity'
+
+    def __init__(self, temp_file_folder, shard_depth=0, temp_roots=None):
+        """
+        Basic file system manager for handling uploaded files up until they're 'complete'
+
+        @param temp_file_folder: A folder (within MEDIA_ROOT) where the uploads will be saved.
+        @type temp_file_folder: str
+        @param shard_depth: Optional, levels of sub-folders to spread the temp files across, so no folder gets too big.
+        Each level has up to 256 folders, named by two hex digits of a hash of the file ID.
+        @type shard_depth: int
+        @param temp_roots: Optional, folders to use instead of MEDIA_ROOT, such as one on each disk. Each has its own
+        temp_file_folder, and each file ID always goes to the same one (by rendezvous hashing), whichever process is
+        asking. Adding a root only moves the uploads that hash to it.
+        @type temp_roots: list
+        """
+        self.temp_file_folder = temp_file_folder
+        self.shard_depth = shard_depth
+        self.temp_roots = temp_roots
+        # folders we've already seen or made, so they aren't checked for on every chunk
+        self._known_folders = set()
+        # (activity time, file_id) pairs this process has already recorded
+        self._recorded_activity = set()
+        self._recorded_activity_time = None
+
+    def open_temp_file(self, file_id):
+        """
+        Open the temp uploaded file.
+
+        @param file_id: Unique ID of the uploaded file.
+        @type file_id: str
+        @return: Opened (as binary) File instance. If move_on_finalise is set, it's an UploadTempFile that can be moved
+        into a FileSystemStorage.
+        @rtype: File
+        """
+        path = self._temp_file_path(file_id)
+        if self.move_on_finalise:
+            return UploadTempFile(open(path, 'rb'))
+        return File(open(path, 'rb'))
+
+    def remove_temp_file(self, file_id):
+        """
+        Delete the temp uploaded file, if it's still there (it won't be if it was moved into place).
+
+        @param file_id: Unique ID of the uploaded file
+        @type file_id: str
+        """
+        try:
+            os.remove(self._temp_file_path(file_id))
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def append_content_to_temp_file(self, file_id, file_contents):
+        """
+        Append additional content to a temporary upload file (or create the file if it doesn't exist).
+
+        @param file_id: Unique ID of the uploaded file.
+        @type file_id: str
+        @param file_contents: Contents to append to the temp file. If this is unicode, it's encoded in UTF-8.
+        @type file_contents: str or unicode
+        """
+        if isinstance(file_contents, unicode):
+            file_contents = file_contents.encode('utf-8')
+
+        self._record_activity(file_id)
+        with open(self._temp_file_path(file_id, create_folder=True), 'ab+') as f:
+            f.write(file_contents)
+
+    def append_uploaded_file_to_temp_file(self, file_id, uploaded_file, chunk_callback=None):
+        """
+        Stream an uploaded file onto the end of a temporary upload file (or create the file if it doesn't exist),
+        without reading the whole of the upload into memory.
+
+        If Django has already spooled the upload to disk (a TemporaryUploadedFile) it's moved into place when the temp
+        file doesn't exist yet, or otherwise appended in buffers of disk_copy_buffer_size bytes. Anything else, or
+        anything with a chunk_callback to see the bytes, is copied across in buffers of copy_buffer_size bytes.
+
+        @param file_id: Unique ID of the uploaded file.
+        @type file_id: str
+        @param uploaded_file: The file or blob being uploaded.
+        @type uploaded_file: UploadedFile
+        @param chunk_callback: Optional, called with each piece of the upload as it's written.
+        @type chunk_callback: callable
+        """
+        self._record_activity(file_id)
+        path = self._temp_file_path(file_id, create_folder=True)
+
+        if hasattr(uploaded_file, 'temporary_file_path') and chunk_callback is None and not os.path.exists(path):
+            file_move_safe(uploaded_file.temporary_file_path(), path)
+            # TemporaryUploadedFile.close() expects its file may have been moved away
+            uploaded_file.close()
+            return
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            os.lseek(fd, 0, os.SEEK_END)
+            self._copy_uploaded_file(uploaded_file, fd, chunk_callback)
+        finally:
+            os.close(fd)
+
+    def write_uploaded_file_to_temp_file(self, file_id, uploaded_file, offset, expected_byte_count=None,
+                                         chunk_callback=None):
+        """
+        Write an uploaded file into a temporary upload file at a given byte offset (or create the file if it doesn't
+        exist), so that the chunks of a file can arrive in any order, from any number of workers.
+
+        @param file_id: Unique ID of the uploaded file.
+        @type file_id: str
+        @param uploaded_file: The file or blob being uploaded.
+        @type uploaded_file: UploadedFile
+        @param offset: Position in the temp file to write the upload at.
+        @type offset: int
+        @param expected_byte_count: Optional, the final size of the file. A new temp file is extended (sparsely) to
+        this size so every chunk is written inside the file.
+        @type expected_byte_count: int
+        @param chunk_callback: Optional, called with each piece of the upload as it's written.
+        @type chunk_callback: callable
+        """
+        self._record_activity(file_id)
+        path = self._temp_file_path(file_id, create_folder=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if expected_byte_count and os.fstat(fd).st_size < expected_byte_count:
+                os.ftruncate(fd, expected_byte_count)
+            os.lseek(fd, offset, os.SEEK_SET)
+            self._copy_uploaded_file(uploaded_file, fd, chunk_callback)
+        finally:
+            os.close(fd)
+
+    def _copy_uploaded_file(self, uploaded_file, fd, chunk_callback=None):
+        """
+        Copy an uploaded file to the current position of an open file descriptor, in buffers of copy_buffer_size bytes
+        (which are passed to chunk_callback, if there is one). An upload Django has spooled to disk is read in the
+        larger disk_copy_buffer_size buffers when nothing needs to see its bytes.
+        """
+        buffer_size = self.copy_buffer_size
+        if hasattr(uploaded_file, 'temporary_file_path') and chunk_callback is None:
+            buffer_size = self.disk_copy_buffer_size
+        for chunk in uploaded_file.chunks(buffer_size):
+            if chunk_callback is not None:
+                chunk_callback(chunk)
+            while chunk:
+                written = os.write(fd, chunk)
+                chunk = chunk[written:]
+
+    def get_activity_times(self):
+        """
+        Get the times the temp files' activity has been recorded for, so a janitor can work through them oldest first.
+
+        @return: Sorted times (in seconds since the epoch), each the start of activity_interval seconds of activity.
+        @rtype: list
+        """
+        try:
+            names = os.listdir(self._activity_path())
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return []
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def reap_abandoned_temp_files(self, last_active_before, batch_size=500, batch_pause=0, reaped_file_ids=None):
+        """
+        Delete temp files that haven't been written to since a given time.
+
+        Rather than looking at every temp file, this reads the activity index: the IDs written to in each period are
+        listed in a small file for that period. Files listed only in periods that ended before last_active_before are
+        deleted, and those periods' index files with them.
+
+        @param last_active_before: Time (in seconds since the epoch) before which the files were last written to.
+        @type last_active_before: float
+        @param batch_size: Number of files to delete between pauses.
+        @type batch_size: int
+        @param batch_pause: Seconds to pause between batches, to leave some disk I/O for uploads.
+        @type batch_pause: float
+        @param reaped_file_ids: Optional, a list to add the file ID of each file deleted to.
+        @type reaped_file_ids: list
+        @return: The number of files deleted, and the number of bytes that freed.
+        @rtype: (int, int)
+        """
+        activity_times = self.get_activity_times()
+        old_times = [t for t in activity_times if t + self.activity_interval <= last_active_before]
+        if not old_times:
+            return 0, 0
+
+        still_active = set()
+        for activity_time in activity_times[len(old_times):]:
+            still_active.update(self._read_activity(activity_time))
+
+        abandoned = set()
+        for activity_time in old_times:
+            abandoned.update(self._read_activity(activity_time))
+        abandoned -= still_active
+
+        files_removed = bytes_freed = 0
+        for file_id in abandoned:
+            byte_count = self._reap_temp_file(file_id)
+            if byte_count is not None:
+                files_removed += 1
+                bytes_freed += byte_count
+                if reaped_file_ids is not None:
+                    reaped_file_ids.append(file_id)
+                if batch_pause and files_removed % batch_size == 0:
+                    time.sleep(batch_pause)
+
+        for activity_time in old_times:
+            try:
+                os.remove(os.path.join(self._activity_path(), str(activity_time)))
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return files_removed, bytes_freed
+
+    def get_free_bytes(self):
+        """
+        @return: The number of bytes free on the fullest file system holding temp files, or None if we can't tell.
+        @rtype: int or None
+        """
+        statvfs = getattr(os, 'statvfs', None)
+        if statvfs is None:
+            return None
+        free_bytes = []
+        for location in self._temp_locations():
+            try:
+                stats = statvfs(location)
+            except OSError:
+                continue
+            free_bytes.append(stats.f_bavail * stats.f_frsize)
+        return min(free_bytes) if free_bytes else None
+
+    def _record_activity(self, file_id):
+        """
+        Note in the activity index that a temp file is being written to. Each process only writes each file_id once per
+        activity_interval, as a single short append.
+        """
+        now = time.time()
+        activity_time = int(now - now % self.activity_interval)
+        if activity_time != self._recorded_activity_time:
+            self._recorded_activity = set()
+            self._recorded_activity_time = activity_time
+        if file_id in self._recorded_activity:
+            return
+
+        activity_path = self._activity_path()
+        if not os.path.isdir(activity_path):
+            try:
+                os.makedirs(activity_path)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        fd = os.open(os.path.join(activity_path, str(activity_time)), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        try:
+            os.write(fd, '%s\n' % file_id)
+        finally:
+            os.close(fd)
+        self._recorded_activity.add(file_id)
+
+    def _read_activity(self, activity_time):
+        try:
+            with open(os.path.join(self._activity_path(), str(activity_time)), 'rb') as f:
+                return set(line.strip() for line in f if line.strip())
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return set()
+
+    def temp_file_exists(self, file_id):
+        return os.path.exists(self._temp_file_path(file_id))
+
+    def _reap_temp_file(self, file_id):
+        """
+        Delete an abandoned temp file.
+
+        @return: The size of the file deleted, or None if it had already gone.
+        @rtype: int or None
+        """
+        path = self._temp_file_path(file_id)
+        try:
+            byte_count = os.stat(path).st_size
+            os.remove(path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        return byte_count
+
+    def _activity_path(self):
+        # the activity index for every root is kept in the first one
+        return os.path.join(self._temp_locations()[0], self.activity_folder)
+
+    def _file_path(self, file_id):
+        """
+        Path of a temp file within its temp folder: just the file ID, under shard_depth levels of sub-folders.
+        """
+        if not self.shard_depth:
+            return file_id
+        digest = self._file_id_hash(file_id)
+        return os.path.join(*[digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)] + [file_id])
+
+    def _temp_file_path(self, file_id, create_folder=False):
+        """
+        Full path of a temp file, in whichever of the temp folders its file ID belongs to.
+
+        @param create_folder: Make the file's folder if it doesn't exist yet.
+        @type create_folder: bool
+        """
+        locations = self._temp_locations()
+        if len(locations) == 1:
+            location = locations[0]
+        else:
+            # rendezvous hashing: each file ID goes to the location it hashes highest with
+            location = max(locations, key=lambda l: self._file_id_hash('%s:%s' % (l, file_id)))
+        path = os.path.join(location, self._file_path(file_id))
+
+        if create_folder:
+            folder = os.path.dirname(path)
+            if folder not in self._known_folders:
+                try:
+                    os.makedirs(folder)
+                except OSError, e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                self._known_folders.add(folder)
+        return path
+
+    def _file_id_hash(self, file_id):
+        if isinstance(file_id, unicode):
+            file_id = file_id.encode('utf-8')
+        return hashlib.md5(file_id).hexdigest()
+
+    def _temp_locations(self):
+        # work the folders out once, unless MEDIA_ROOT has changed since (as it can in tests)
+        if self.temp_roots:
+            return [os.path.join(root, self.temp_file_folder) for root in self.temp_roots]
+        # kept together, so another thread can't see the new MEDIA_ROOT before the folders worked out from it
+        media_root, locations = getattr(self, '_locations_for_media_root', (None, None))
+        if media_root != settings.MEDIA_ROOT:
+            locations = [safe_join(settings.MEDIA_ROOT, self.temp_file_folder)]
+            self._locations_for_media_root = (settings.MEDIA_ROOT, locations)
+        return locations
+
+
+class _OpenTempFile(object):
+    """
+    A temp file held open by UploadTempStoragePreallocated, with a lock to hold while using it. Once it's been closed,
+    fd is None.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+
+class UploadTempStoragePreallocated(UploadTempStorageFileSystem):
+    """
+    Temp storage for chunked uploads that keeps temp files open between chunks.
+
+    Each process keeps up to max_open_files file descriptors open, closing the least recently used. A new temp file is
+    given all of its expected_byte_count up front, so chunks written at their offsets never have to grow it. Where the
+    C library has posix_fallocate the blocks are reserved then, so a full disk fails the upload's first chunk rather
+    than one part way through; elsewhere the file is only made sparse, and a chunk can still fail with ENOSPC. Chunks
+    for the same file are written one at a time within a process; chunks for different files are written in parallel.
+    A temp file deleted by another process, such as the janitor's, is opened afresh rather than written to after it's
+    gone.
+    """
+
+    def __init__(self, temp_file_folder, max_open_files=64, shard_depth=0, temp_roots=None):
+        """
+        @param temp_file_folder: A folder (within MEDIA_ROOT) where the uploads will be saved.
+        @type temp_file_folder: str
+        @param max_open_files: Most temp files to keep open at once.
+        @type max_open_files: int
+        @param shard_depth: Optional, levels of sub-folders to spread the temp files across.
+        @type shard_depth: int
+        @param temp_roots: Optional, folders to use instead of MEDIA_ROOT, such as one on each disk.
+        @type temp_roots: list
+        """
+        super(UploadTempStoragePreallocated, self).__init__(temp_file_folder, shard_depth, temp_roots)
+        self.max_open_files = max_open_files
+        self._open_files = OrderedDict()
+        self._open_files_lock = threading.Lock()
+
+    def open_temp_file(self, file_id):
+        self._close_temp_file(file_id)
+        return super(UploadTempStoragePreallocated, self).open_temp_file(file_id)
+
+    def remove_temp_file(self, file_id):
+        self._close_temp_file(file_id)
+        super(UploadTempStoragePreallocated, self).remove_temp_file(file_id)
+
+    def append_uploaded_file_to_temp_file(self, file_id, uploaded_file, chunk_callback=None):
+        self._write_to_open_file(file_id, uploaded_file, None, None, chunk_callback)
+
+    def write_uploaded_file_to_temp_file(self, file_id, uploaded_file, offset, expected_byte_count=None,
+                                         chunk_callback=None):
+        self._write_to_open_file(file_id, uploaded_file, offset, expected_byte_count, chunk_callback)
+
+    def _write_to_open_file(self, file_id, uploaded_file, offset, expected_byte_count=None, chunk_callback=None):
+        self._record_activity(file_id)
+        while True:
+            open_file = self._get_open_file(file_id, expected_byte_count)
+            with open_file.lock:
+                if open_file.fd is None:
+                    # closed to make room for another file while we waited for it, so open it again
+                    continue
+                if os.fstat(open_file.fd).st_nlink == 0:
+                    # deleted since we opened it, such as by a janitor in another process, so writing to it would
+                    # only keep the space from being freed
+                    self._forget_open_file(file_id, open_file)
+                    os.close(open_file.fd)
+                    open_file.fd = None
+                    continue
+                if offset is None:
+                    os.lseek(open_file.fd, 0, os.SEEK_END)
+                else:
+                    os.lseek(open_file.fd, offset, os.SEEK_SET)
+                self._copy_uploaded_file(uploaded_file, open_file.fd, chunk_callback)
+                return
+
+    def _get_open_file(self, file_id, expected_byte_count=None):
+        """
+        Get a temp file that's held open, opening (and preallocating) it if need be.
+
+        @rtype: _OpenTempFile
+        """
+        with self._open_files_lock:
+            open_file = self._open_files.pop(file_id, None)
+            if open_file is not None:
+                # most recently used goes to the end
+                self._open_files[file_id] = open_file
+                return open_file
+
+        path = self._temp_file_path(file_id, create_folder=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        if expected_byte_count and os.fstat(fd).st_size < expected_byte_count:
+            self._preallocate(fd, expected_byte_count)
+        new_file = _OpenTempFile(fd)
+
+        to_close = []
+        with self._open_files_lock:
+            open_file = self._open_files.get(file_id)
+            if open_file is None:
+                open_file = self._open_files[file_id] = new_file
+            else:
+                # another thread opened it at the same time
+                to_close.append(new_file)
+            while len(self._open_files) > self.max_open_files:
+                to_close.append(self._open_files.popitem(last=False)[1])
+
+        for closing_file in to_close:
+            closing_file.close()
+        return open_file
+
+    def _reap_temp_file(self, file_id):
+        self._close_temp_file(file_id)
+        return super(UploadTempStoragePreallocated, self)._reap_temp_file(file_id)
+
+    def _close_temp_file(self, file_id):
+        with self._open_files_lock:
+            open_file = self._open_files.pop(file_id, None)
+        if open_file is not None:
+            open_file.close()
+
+    def _forget_open_file(self, file_id, open_file):
+        # another thread may have opened the file again already
+        with self._open_files_lock:
+            if self._open_files.get(file_id) is open_file:
+                del self._open_files[file_id]
+
+    def _preallocate(self, fd, byte_count):
+        if _posix_fallocate is not None:
+            error = _posix_fallocate(fd, 0, byte_count)
+            if not error:
+                return
+            if error not in (errno.EINVAL, errno.EOPNOTSUPP):
+                raise OSError(error, os.strerror(error))
+        # no fallocate for this file system, so make a sparse file of the right size instead
+        os.ftruncate(fd, byte_count)
@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+
+
+class RunningStreams(object):
+    """
+    Running checksums or pipelines of uploads that haven't finished, kept in this process's memory by file ID so the
+    next chunk of an upload can carry on from where the last one got to. Each stream needs an offset (how far through
+    the file it's got) and a lock, held while a chunk is being added, so two requests can't add to it at once.
+    """
+
+    def __init__(self, max_streams, on_drop=None):
+        """
+        @param max_streams: Most streams to keep before dropping the least recently used
+        @type max_streams: int
+        @param on_drop: Called with each stream dropped to make room, to free anything it holds
+        @type on_drop: callable
+        """
+        self.max_streams = max_streams
+        self.on_drop = on_drop
+        self._streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_id):
+        """
+        @return: The stream kept for an upload, or None.
+        """
+        with self._lock:
+            return self._streams.get(file_id)
+
+    def keep(self, file_id, stream):
+        """
+        Keep a stream for the next chunk of an upload, dropping the least recently used streams if there are more than
+        max_streams.
+        """
+        dropped = []
+        with self._lock:
+            self._streams.pop(file_id, None)
+            self._streams[file_id] = stream
+            while len(self._streams) > self.max_streams:
+                dropped.append(self._streams.popitem(last=False)[1])
+        if self.on_drop is not None:
+            for stream in dropped:
+                # a stream that a request is still adding a chunk to is kept again once it's done
+                if stream.lock.acquire(False):
+                    try:
+                        self.on_drop(stream)
+                    finally:
+                        stream.lock.release()
+
+    def forget(self, file_id):
+        with self._lock:
+            self._streams.pop(file_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._streams.clear()
+
+    def __len__(self):
+        return len(self._streams)
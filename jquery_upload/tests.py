@@ -0,0 +1,984 @@
+import gzip
+import hashlib
+import json
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from StringIO import StringIO
+from datetime import datetime, timedelta
+from django.core.files.storage import FileSystemStorage
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, models
+from django.test import TestCase, TransactionTestCase
+from django.test.client import RequestFactory
+from django.utils import unittest
+from jquery_upload.benchmark import UploadBenchmark
+from jquery_upload.headers import parse_content_disposition_filename, parse_content_range
+from jquery_upload.instrumentation import MemoryMetricsSink, SignalMetricsSink, StatsdMetricsSink, upload_metric
+from jquery_upload.models import StoredContent, UploadProgress
+from jquery_upload.pipeline import ByteCountStage, GzipStage, RunningPipeline
+from jquery_upload.janitor import TempFileJanitor
+from jquery_upload.limits import CacheLimitStore, UploadLimiter
+from jquery_upload.storage import BaseUploadTempStorage, UploadTempStoragePreallocated, UploadTempStorageFileSystem
+from jquery_upload.streams import RunningStreams
+from jquery_upload import limits, pipeline, views
+from jquery_upload.views import BaseUploadContentView, CooperativeUploadMixin, PartialUploadCacheMixin, \
+    PartialUploadDatabaseMixin
+
+# pointed at a new folder by each test
+test_storage = FileSystemStorage()
+
+
+class UploadedDocument(models.Model):
+    content = models.FileField(upload_to='documents', storage=test_storage)
+
+    class Meta:
+        app_label = 'jquery_upload'
+
+
+class StagedDocument(models.Model):
+    content = models.FileField(upload_to='documents', storage=test_storage)
+    gzipped = models.FileField(upload_to='gzipped', storage=test_storage)
+    byte_count = models.IntegerField(null=True)
+
+    class Meta:
+        app_label = 'jquery_upload'
+
+
+class FakeSession(dict):
+    def __init__(self, session_key):
+        super(FakeSession, self).__init__()
+        self.session_key = session_key
+
+
+class DocumentUploadView(BaseUploadContentView):
+    model = UploadedDocument
+    file_field_name = 'content'
+
+
+class CacheDocumentUploadView(PartialUploadCacheMixin, DocumentUploadView):
+    pass
+
+
+class DatabaseDocumentUploadView(PartialUploadDatabaseMixin, DocumentUploadView):
+    pass
+
+
+class RecordingThreadPool(object):
+    """
+    Stands in for gevent's ThreadPool, running each call straight away and remembering its name.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def apply(self, func, args=(), kwds=None):
+        self.calls.append(args[0].__name__)
+        return func(*args, **(kwds or {}))
+
+
+class UnsaveableDocumentUploadView(CacheDocumentUploadView):
+    def pre_save(self, instance):
+        raise IOError('No space left on device')
+
+
+class ManualExecutor(object):
+    """
+    Stands in for a finalisation executor, keeping each job until run_all is called.
+    """
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.jobs.append((fn, args, kwargs))
+
+    def run_all(self):
+        while self.jobs:
+            fn, args, kwargs = self.jobs.pop(0)
+            fn(*args, **kwargs)
+
+
+class StagedDocumentUploadView(CacheDocumentUploadView):
+    model = StagedDocument
+    upload_stages = (ByteCountStage, GzipStage)
+
+
+class CooperativeDocumentUploadView(CooperativeUploadMixin, CacheDocumentUploadView):
+    pass
+
+
+class UploadTestMixin(object):
+    """
+    Posts chunks to view_class, with a temp storage and a storage for the model's files in a new folder for each test,
+    and a new session.
+    """
+    view_class = None
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        test_storage.location = test_storage.base_location = os.path.join(self.folder, 'media')
+        self.temp_storage = self.make_temp_storage()
+        self.session_key = uuid.uuid4().hex
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def make_temp_storage(self):
+        return UploadTempStorageFileSystem('uploads', temp_roots=[os.path.join(self.folder, 'temp')])
+
+    def post_chunk(self, data, start, total, name='same.jpg', upload_id=None, **view_kwargs):
+        meta = {
+            'HTTP_CONTENT_RANGE': 'bytes %d-%d/%d' % (start, start + len(data) - 1, total),
+            'HTTP_CONTENT_DISPOSITION': 'attachment; filename="%s"' % name,
+        }
+        if upload_id is not None:
+            meta['HTTP_X_UPLOAD_ID'] = upload_id
+        request = self.factory.post('/', {'files': SimpleUploadedFile('blob', data)}, **meta)
+        request.session = FakeSession(self.session_key)
+        view_kwargs.setdefault('temp_storage', self.temp_storage)
+        response = self.view_class.as_view(**view_kwargs)(request)
+        return response.status_code, json.loads(response.content)
+
+    def post_files(self, files, **view_kwargs):
+        request = self.factory.post('/', {'files': [SimpleUploadedFile(name, data) for name, data in files]})
+        request.session = FakeSession(self.session_key)
+        view_kwargs.setdefault('temp_storage', self.temp_storage)
+        response = self.view_class.as_view(**view_kwargs)(request)
+        return response.status_code, json.loads(response.content)
+
+    def make_view(self, view_class=None):
+        # a view to call methods of directly, as for a request in this session
+        view = (view_class or self.view_class)(temp_storage=self.temp_storage)
+        view.request = self.factory.post('/')
+        view.request.session = FakeSession(self.session_key)
+        return view
+
+    def get(self, params, upload_id=None, method='get', **view_kwargs):
+        meta = {}
+        if upload_id is not None:
+            meta['HTTP_X_UPLOAD_ID'] = upload_id
+        request = getattr(self.factory, method)('/', params, **meta)
+        request.session = FakeSession(self.session_key)
+        view_kwargs.setdefault('temp_storage', self.temp_storage)
+        return self.view_class.as_view(**view_kwargs)(request)
+
+    def saved_contents(self):
+        return [document.content.read() for document in UploadedDocument.objects.order_by('pk')]
+
+
+class AbandonedUploadTestMixin(UploadTestMixin):
+    """
+    A new upload of a file mustn't pick up the bytes of an earlier, abandoned upload of a file with the same name.
+    """
+
+    def test_same_size_upload_with_new_id(self):
+        # half of one upload, abandoned
+        self.assertEqual(self.post_chunk('A' * 100000, 0, 200000, upload_id='first', positional_writes=True)[0], 200)
+        # a new upload of the same name and size, last chunk first
+        status, reply = self.post_chunk('B' * 100000, 100000, 200000, upload_id='second', positional_writes=True)
+        # only this upload's bytes count towards it
+        self.assertEqual((status, reply), (200, {'size': 100000}))
+        self.assertEqual(self.saved_contents(), [])
+        status, reply = self.post_chunk('B' * 100000, 0, 200000, upload_id='second', positional_writes=True)
+        self.assertEqual(reply['files'][0]['size'], 200000)
+        self.assertEqual(self.saved_contents(), ['B' * 200000])
+
+    def test_different_size_restarts_upload(self):
+        # the end of a 100000 byte upload, abandoned
+        self.post_chunk('A' * 60000, 40000, 100000, upload_id='same', positional_writes=True)
+        # the start of a 60000 byte upload, which the old ranges would cover
+        status, reply = self.post_chunk('B' * 30000, 0, 60000, upload_id='same', positional_writes=True)
+        self.assertEqual((status, reply), (200, {'size': 30000}))
+        status, reply = self.post_chunk('B' * 30000, 30000, 60000, upload_id='same', positional_writes=True)
+        self.assertEqual(reply['files'][0]['size'], 60000)
+        self.assertEqual(self.saved_contents(), ['B' * 60000])
+
+    def test_positional_writes_need_upload_id(self):
+        status, reply = self.post_chunk('A' * 10, 0, 20, positional_writes=True)
+        self.assertEqual((status, reply), (400, {'error': 'NO UPLOAD ID'}))
+        status, reply = self.post_chunk('A' * 10, 0, 20, upload_id='not an id', positional_writes=True)
+        self.assertEqual((status, reply), (400, {'error': 'BAD UPLOAD ID'}))
+
+    def test_reaped_upload_isnt_finalised(self):
+        self.post_chunk('A' * 100000, 0, 200000)
+        # the janitor deletes the half uploaded temp file before the client resumes
+        TempFileJanitor(self.temp_storage, max_age=60).reap(now=time.time() + 3600)
+        status, reply = self.post_chunk('B' * 100000, 100000, 200000)
+        self.assertFalse(reply.get('files', [{}])[0].get('size'))
+        self.assertEqual(self.saved_contents(), [])
+
+    def assert_resume_after_reap_expires(self, **view_kwargs):
+        self.post_chunk('A' * 100000, 0, 200000, upload_id='reaped', **view_kwargs)
+        # a janitor in another process deletes the temp file, but the upload's progress is kept
+        janitor = TempFileJanitor(self.make_temp_storage(), max_age=60, reap_upload_progress=False)
+        self.assertEqual(janitor.reap(now=time.time() + 3600)['files_reclaimed'], 1)
+        status, reply = self.post_chunk('B' * 100000, 100000, 200000, upload_id='reaped', **view_kwargs)
+        self.assertEqual(reply, {'files': [{'name': 'same.jpg', 'error': 'UPLOAD EXPIRED'}]})
+
+        # started again, it finishes
+        self.post_chunk('A' * 100000, 0, 200000, upload_id='reaped', **view_kwargs)
+        status, reply = self.post_chunk('B' * 100000, 100000, 200000, upload_id='reaped', **view_kwargs)
+        self.assertEqual(reply['files'][0]['size'], 200000)
+        self.assertEqual(self.saved_contents(), ['A' * 100000 + 'B' * 100000])
+
+    def test_resume_after_reap_expires(self):
+        self.assert_resume_after_reap_expires()
+
+    def test_positional_resume_after_reap_expires(self):
+        self.assert_resume_after_reap_expires(positional_writes=True)
+
+    def test_preallocated_positional_resume_after_reap_expires(self):
+        self.make_temp_storage = self.make_preallocated_temp_storage
+        self.temp_storage = self.make_temp_storage()
+        self.assert_resume_after_reap_expires(positional_writes=True)
+
+    def make_preallocated_temp_storage(self):
+        return UploadTempStoragePreallocated('uploads', temp_roots=[os.path.join(self.folder, 'temp')])
+
+
+class CacheAbandonedUploadTest(AbandonedUploadTestMixin, TestCase):
+    view_class = CacheDocumentUploadView
+
+
+class DatabaseAbandonedUploadTest(AbandonedUploadTestMixin, TestCase):
+    view_class = DatabaseDocumentUploadView
+
+
+class HashedKeyDocumentUploadView(CacheDocumentUploadView):
+    def _key_sanitise(self, key):
+        return hashlib.md5(key).hexdigest()
+
+
+class ProgressKeyTest(UploadTestMixin, TestCase):
+    view_class = CacheDocumentUploadView
+
+    def test_subclass_sanitises_its_own_keys(self):
+        parts = ('UploadedDocument', 'a b.jpg', 'file_id')
+        self.assertEqual(self.make_view()._progress_key(*parts),
+                         '%s::UploadedDocument::a:b.jpg::file_id' % self.session_key)
+        self.assertEqual(self.make_view(HashedKeyDocumentUploadView)._progress_key(*parts),
+                         hashlib.md5('%s::UploadedDocument::a b.jpg::file_id' % self.session_key).hexdigest())
+
+
+class BatchUploadTest(UploadTestMixin, TestCase):
+    """
+    Several whole files in one request get the same checksums and deduplication as a single upload.
+    """
+    view_class = DocumentUploadView
+
+    def test_batch_files_are_checksummed(self):
+        status, reply = self.post_files([('a.txt', 'aaa'), ('b.txt', 'bb')], checksum_algorithm='md5')
+        self.assertEqual([f['checksum'] for f in reply['files']],
+                         [hashlib.md5('aaa').hexdigest(), hashlib.md5('bb').hexdigest()])
+        self.assertEqual(self.saved_contents(), ['aaa', 'bb'])
+
+    def test_batch_files_are_deduplicated(self):
+        self.post_files([('a.txt', 'aaa'), ('b.txt', 'bb')], checksum_algorithm='sha256', deduplicate_uploads=True)
+        status, reply = self.post_files([('c.txt', 'bb'), ('d.txt', 'dddd')], checksum_algorithm='sha256',
+                                        deduplicate_uploads=True)
+        self.assertEqual([f['size'] for f in reply['files']], [2, 4])
+        self.assertEqual(self.saved_contents(), ['aaa', 'bb', 'bb', 'dddd'])
+        self.assertEqual(StoredContent.objects.count(), 3)
+
+    def stored_files(self):
+        folder = os.path.join(test_storage.location, 'documents')
+        return sorted(os.listdir(folder)) if os.path.exists(folder) else []
+
+    def bulk_create(self, objs):
+        self.bulk_created.append(objs)
+        for o in objs:
+            o.save()
+
+    def failed_bulk_create(self, objs):
+        raise IOError('database has gone away')
+
+    def test_batch_saved_with_bulk_create(self):
+        # managers only have bulk_create from Django 1.4
+        self.bulk_created = []
+        UploadedDocument._default_manager.bulk_create = self.bulk_create
+        try:
+            status, reply = self.post_files([('a.txt', 'aaa'), ('b.txt', 'bb')])
+        finally:
+            del UploadedDocument._default_manager.bulk_create
+        self.assertEqual([len(objs) for objs in self.bulk_created], [2])
+        self.assertEqual([(f['name'], f['size']) for f in reply['files']], [('a.txt', 3), ('b.txt', 2)])
+        self.assertEqual(self.saved_contents(), ['aaa', 'bb'])
+
+    def test_failed_bulk_create_leaves_no_files(self):
+        UploadedDocument._default_manager.bulk_create = self.failed_bulk_create
+        try:
+            status, reply = self.post_files([('a.txt', 'aaa'), ('b.txt', 'bb')])
+        finally:
+            del UploadedDocument._default_manager.bulk_create
+        self.assertEqual([f.get('error') for f in reply['files']], ['ERROR SAVING FILE'] * 2)
+        self.assertEqual(self.saved_contents(), [])
+        self.assertEqual(self.stored_files(), [])
+
+
+class KnownContentTest(UploadTestMixin, TestCase):
+    """
+    Content we already have can be asked after, and saved, by its checksum, but only with accept_known_content.
+    """
+    view_class = DocumentUploadView
+
+    def setUp(self):
+        super(KnownContentTest, self).setUp()
+        self.post_files([('a.txt', 'aaa'), ('b.txt', 'bb')], checksum_algorithm='sha256', deduplicate_uploads=True)
+        self.known = {'checksum': hashlib.sha256('aaa').hexdigest(), 'size': '3', 'file': 'copy.txt'}
+
+    def post_params(self, params, **view_kwargs):
+        request = self.factory.post('/', params)
+        request.session = FakeSession(self.session_key)
+        view_kwargs.setdefault('temp_storage', self.temp_storage)
+        response = self.view_class.as_view(checksum_algorithm='sha256', deduplicate_uploads=True,
+                                           **view_kwargs)(request)
+        return response.status_code, json.loads(response.content)
+
+    def ask_after(self, params, **view_kwargs):
+        response = self.get(params, checksum_algorithm='sha256', deduplicate_uploads=True, **view_kwargs)
+        return response.status_code, json.loads(response.content)
+
+    def test_off_by_default(self):
+        self.assertEqual(self.ask_after(self.known), (400, {'error': 'NO FILE OR JOB GIVEN'}))
+        self.assertEqual(self.post_params(self.known), (400, {'error': 'NO FILE GIVEN'}))
+        self.assertEqual(self.saved_contents(), ['aaa', 'bb'])
+
+    def test_known_content_saved_without_upload(self):
+        self.assertEqual(self.ask_after(self.known, accept_known_content=True),
+                         (200, {'checksum': self.known['checksum'], 'known': True}))
+        status, reply = self.post_params(self.known, accept_known_content=True)
+        self.assertEqual(reply['files'][0]['name'], 'copy.txt')
+        self.assertEqual(self.saved_contents(), ['aaa', 'bb', 'aaa'])
+
+    def test_unknown_content(self):
+        unknown = dict(self.known, checksum=hashlib.sha256('ccc').hexdigest())
+        self.assertEqual(self.ask_after(unknown, accept_known_content=True),
+                         (200, {'checksum': unknown['checksum'], 'known': False}))
+        self.assertEqual(self.post_params(unknown, accept_known_content=True)[0], 404)
+
+    def test_no_file_or_checksum(self):
+        self.assertEqual(self.post_params({}, accept_known_content=True), (400, {'error': 'NO FILE GIVEN'}))
+
+
+class RawBodyUploadTest(UploadTestMixin, TestCase):
+    """
+    Files sent as the whole request body are written straight from the request when raw_body_uploads is set.
+    """
+    view_class = CacheDocumentUploadView
+
+    def post_body(self, data, read_post_first=False, content_length=True, **view_kwargs):
+        request = self.factory.post('/', data, content_type='application/octet-stream',
+                                    HTTP_CONTENT_DISPOSITION='attachment; filename="body.txt"')
+        if not content_length:
+            # as with a chunked transfer encoding
+            del request.META['CONTENT_LENGTH']
+        request.session = FakeSession(self.session_key)
+        if read_post_first:
+            # as CsrfViewMiddleware does
+            request.POST
+        view_kwargs.setdefault('temp_storage', self.temp_storage)
+        response = self.view_class.as_view(**view_kwargs)(request)
+        return request, response.status_code, json.loads(response.content)
+
+    def test_body_isnt_read_into_memory(self):
+        request, status, reply = self.post_body('body' * 1000, raw_body_uploads=True)
+        self.assertEqual(reply['files'][0]['size'], 4000)
+        self.assertFalse(hasattr(request, '_raw_post_data'))
+        self.assertEqual(self.saved_contents(), ['body' * 1000])
+
+    def test_body_already_read(self):
+        request, status, reply = self.post_body('body' * 1000, read_post_first=True, raw_body_uploads=True)
+        self.assertEqual(reply['files'][0]['size'], 4000)
+        self.assertEqual(self.saved_contents(), ['body' * 1000])
+
+    def test_body_needs_content_length(self):
+        request, status, reply = self.post_body('body' * 1000, content_length=False, raw_body_uploads=True)
+        self.assertEqual((status, reply), (411, {'error': 'LENGTH REQUIRED'}))
+        request, status, reply = self.post_body('', raw_body_uploads=True)
+        self.assertEqual((status, reply), (400, {'error': 'NO FILE GIVEN'}))
+        self.assertEqual(self.saved_contents(), [])
+
+    def test_raw_body_uploads_are_off_by_default(self):
+        request, status, reply = self.post_body('body' * 1000)
+        self.assertEqual((status, reply), (400, {'error': 'NO FILE GIVEN'}))
+
+    def test_body_is_read_on_request_thread(self):
+        # the request's socket can't be read from the blocking_threadpool's threads
+        self.view_class = CooperativeDocumentUploadView
+        threadpool = RecordingThreadPool()
+        request, status, reply = self.post_body('body' * 1000, raw_body_uploads=True, blocking_threadpool=threadpool)
+        self.assertEqual(reply['files'][0]['size'], 4000)
+        self.assertEqual(threadpool.calls, ['finalise_upload'])
+
+        threadpool = RecordingThreadPool()
+        self.post_chunk('form', 0, 8, name='form.txt', blocking_threadpool=threadpool)
+        self.assertEqual(threadpool.calls, ['append_uploaded_file_to_temp_file'])
+
+
+class AsyncFinalisationTest(UploadTestMixin, TransactionTestCase):
+    """
+    With finalise_asynchronously, the last chunk gets a job ID, which can be polled until the file is saved.
+    """
+    view_class = CacheDocumentUploadView
+
+    def test_job_status_polled_until_done(self):
+        executor = ManualExecutor()
+        self.post_chunk('A' * 100, 0, 200, finalise_asynchronously=True, finalisation_executor=executor)
+        status, reply = self.post_chunk('B' * 100, 100, 200, finalise_asynchronously=True,
+                                        finalisation_executor=executor)
+        job_id = reply['files'][0]['job']
+        self.assertEqual(reply['files'][0]['status'], 'pending')
+        self.assertEqual(self.saved_contents(), [])
+        self.assertEqual(json.loads(self.get({'job': job_id}).content), {'job': job_id, 'status': 'pending'})
+
+        executor.run_all()
+        self.assertEqual(json.loads(self.get({'job': job_id}).content),
+                         {'job': job_id, 'status': 'done', 'files': [{'name': 'same.jpg', 'size': 200}]})
+        self.assertEqual(self.saved_contents(), ['A' * 100 + 'B' * 100])
+
+    def test_failed_job_reports_error(self):
+        self.view_class = UnsaveableDocumentUploadView
+        executor = ManualExecutor()
+        status, reply = self.post_chunk('A' * 100, 0, 100, finalise_asynchronously=True,
+                                        finalisation_executor=executor)
+        job_id = reply['files'][0]['job']
+        executor.run_all()
+        self.assertEqual(json.loads(self.get({'job': job_id}).content)['files'],
+                         [{'name': 'same.jpg', 'error': 'ERROR SAVING FILE'}])
+
+    def test_unknown_job(self):
+        response = self.get({'job': 'nonsense'})
+        self.assertEqual((response.status_code, json.loads(response.content)),
+                         (404, {'job': 'nonsense', 'error': 'UNKNOWN JOB'}))
+
+
+class ResumeTestMixin(UploadTestMixin):
+    """
+    A GET or HEAD for a file says how much of it we have, so the client can resume the upload from there.
+    """
+
+    def test_get_reports_bytes_so_far(self):
+        self.post_chunk('A' * 100, 0, 300, upload_id='resumed')
+        response = self.get({'file': 'same.jpg'}, upload_id='resumed')
+        self.assertEqual(json.loads(response.content), {'file': {'name': 'same.jpg', 'size': 100}})
+        self.assertEqual(response['X-Uploaded-Bytes'], '100')
+
+        # resumed from there, it finishes
+        status, reply = self.post_chunk('B' * 200, 100, 300, upload_id='resumed')
+        self.assertEqual(reply['files'][0]['size'], 300)
+        self.assertEqual(self.saved_contents(), ['A' * 100 + 'B' * 200])
+
+    def test_head_has_no_body(self):
+        self.post_chunk('A' * 100, 0, 300, upload_id='resumed')
+        response = self.get({'file': 'same.jpg'}, upload_id='resumed', method='head')
+        self.assertEqual((response.content, response['X-Uploaded-Bytes']), ('', '100'))
+
+    def test_positional_ranges(self):
+        self.post_chunk('C' * 100, 200, 300, upload_id='resumed', positional_writes=True)
+        response = self.get({'file': 'same.jpg'}, upload_id='resumed', positional_writes=True)
+        self.assertEqual(json.loads(response.content),
+                         {'file': {'name': 'same.jpg', 'size': 0, 'ranges': [[200, 300]]}})
+        self.post_chunk('A' * 100, 0, 300, upload_id='resumed', positional_writes=True)
+        response = self.get({'file': 'same.jpg'}, upload_id='resumed', positional_writes=True)
+        self.assertEqual(json.loads(response.content)['file']['size'], 100)
+
+    def test_unknown_file_and_other_upload_id(self):
+        self.post_chunk('A' * 100, 0, 300, upload_id='resumed')
+        for params, upload_id in [({'file': 'other.jpg'}, 'resumed'), ({'file': 'same.jpg'}, 'another')]:
+            response = self.get(params, upload_id=upload_id)
+            self.assertEqual(json.loads(response.content)['file']['size'], 0)
+
+    def test_nothing_asked(self):
+        response = self.get({})
+        self.assertEqual((response.status_code, json.loads(response.content)), (400, {'error': 'NO FILE OR JOB GIVEN'}))
+
+
+class CacheResumeTest(ResumeTestMixin, TestCase):
+    view_class = CacheDocumentUploadView
+
+
+class DatabaseResumeTest(ResumeTestMixin, TestCase):
+    view_class = DatabaseDocumentUploadView
+
+
+class HeaderParsingTest(UploadTestMixin, TestCase):
+    """
+    The headers of each chunk are parsed strictly enough that a bad one is refused with a 400, and a file name can't
+    lead out of the upload's folder.
+    """
+    view_class = CacheDocumentUploadView
+
+    def test_content_range(self):
+        self.assertEqual(parse_content_range('bytes 0-99/200'), (0, 99, 200))
+        self.assertEqual(parse_content_range(' BYTES 100 - 199 / 200 '), (100, 199, 200))
+        self.assertEqual(parse_content_range(None), (None, None, None))
+        for value in ('bytes 100-99/200', 'bytes 0-200/200', 'bytes 0-99/*', 'items 0-99/200', 'bytes=0-99/200'):
+            self.assertRaises(ValueError, parse_content_range, value)
+
+    def test_bad_content_range_refused(self):
+        request = self.factory.post('/', {'files': SimpleUploadedFile('blob', 'A' * 100)},
+                                    HTTP_CONTENT_RANGE='bytes 100-0/200',
+                                    HTTP_CONTENT_DISPOSITION='attachment; filename="same.jpg"')
+        request.session = FakeSession(self.session_key)
+        response = self.view_class.as_view(temp_storage=self.temp_storage)(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {'error': 'BAD CONTENT RANGE'})
+
+    def test_filename(self):
+        self.assertEqual(parse_content_disposition_filename('attachment; filename="photo.jpg"'), 'photo.jpg')
+        self.assertEqual(parse_content_disposition_filename('attachment; filename=photo.jpg; size=10'), 'photo.jpg')
+        self.assertEqual(parse_content_disposition_filename('filename="x"'), 'x')
+        self.assertEqual(parse_content_disposition_filename(r'attachment; filename="say \"cheese\".jpg"'),
+                         'say "cheese".jpg')
+        self.assertEqual(parse_content_disposition_filename('attachment'), None)
+        self.assertEqual(parse_content_disposition_filename(None), None)
+
+    def test_filename_folders_dropped(self):
+        self.assertEqual(parse_content_disposition_filename(r'attachment; filename="..\..\evil.txt"'), 'evil.txt')
+        self.assertEqual(parse_content_disposition_filename('attachment; filename="../../evil.txt"'), 'evil.txt')
+        self.assertEqual(parse_content_disposition_filename("attachment; filename*=UTF-8''..%2F..%5Cevil.txt"),
+                         'evil.txt')
+        self.assertEqual(parse_content_disposition_filename('attachment; filename="uploads/"'), None)
+
+    def test_extended_filename(self):
+        self.assertEqual(parse_content_disposition_filename("attachment; filename*=UTF-8''na%C3%AFve.txt"),
+                         u'na\xefve.txt')
+        self.assertEqual(parse_content_disposition_filename(
+            "attachment; filename=\"naive.txt\"; filename*=UTF-8''na%C3%AFve.txt"), u'na\xefve.txt')
+        self.assertEqual(parse_content_disposition_filename("attachment; filename*=iso-8859-1'en'caf%E9.txt"),
+                         u'caf\xe9.txt')
+        # a filename* that can't be decoded falls back on the plain filename
+        self.assertEqual(parse_content_disposition_filename(
+            "attachment; filename=\"naive.txt\"; filename*=nonsense''na%C3%AFve.txt"), 'naive.txt')
+        self.assertEqual(parse_content_disposition_filename("attachment; filename*=na%C3%AFve.txt"), None)
+
+
+class UploadStagesTest(UploadTestMixin, TestCase):
+    """
+    Streaming stages' results are stored with the upload, and a pipeline dropped before its upload finishes lets go of
+    its temporary file.
+    """
+    view_class = StagedDocumentUploadView
+
+    def test_results_stored(self):
+        self.post_chunk('A' * 100, 0, 200, name='notes.txt')
+        self.assertEqual(self.post_chunk('B' * 100, 100, 200, name='notes.txt')[0], 200)
+
+        document = StagedDocument.objects.get()
+        self.assertEqual(document.byte_count, 200)
+        self.assertEqual(document.gzipped.name, 'gzipped/notes.txt.gz')
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(document.gzipped.read())).read(), 'A' * 100 + 'B' * 100)
+
+    def test_dropped_pipeline_is_closed(self):
+        original_pipelines = pipeline._running_pipelines
+        pipeline._running_pipelines = RunningStreams(1, on_drop=RunningPipeline.close)
+        try:
+            first = RunningPipeline([GzipStage])
+            pipeline.keep_running_pipeline('first', first)
+            second = RunningPipeline([GzipStage])
+            second.lock.acquire()
+            pipeline.keep_running_pipeline('second', second)
+            # kept again while it's still in use
+            pipeline.keep_running_pipeline('first', RunningPipeline([GzipStage]))
+        finally:
+            pipeline._running_pipelines = original_pipelines
+
+        self.assertTrue(first.stages[0]._output.closed)
+        self.assertFalse(second.stages[0]._output.closed)
+        second.close()
+
+
+class MetricsTest(UploadTestMixin, TestCase):
+    """
+    Each sink gets the phases and counts of an upload's requests.
+    """
+    view_class = CacheDocumentUploadView
+
+    def post_upload(self, metrics_sink):
+        self.post_chunk('A' * 100, 0, 200, metrics_sink=metrics_sink)
+        self.post_chunk('B' * 100, 100, 200, metrics_sink=metrics_sink)
+
+    def test_memory_sink(self):
+        sink = MemoryMetricsSink()
+        self.post_upload(sink)
+        stats = sink.get_stats()
+        counts = stats['counts']
+        self.assertEqual((counts['uploads.started'], counts['uploads.finished'], counts['chunk.bytes']), (1, 1, 200))
+        self.assertEqual(stats['gauges']['requests_in_flight'], 0)
+        self.assertEqual(stats['histograms']['chunk.size']['mean'], 100)
+        self.assertEqual(stats['timings']['phase.request']['count'], 2)
+        self.assertEqual(stats['timings']['phase.finalise']['count'], 1)
+        for phase in ('parse_meta', 'temp_write', 'render', 'cache'):
+            self.assertTrue('phase.%s' % phase in stats['timings'], phase)
+
+    def test_statsd_sink(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        try:
+            self.post_upload(StatsdMetricsSink(port=server.getsockname()[1], prefix='uploads'))
+            packets = []
+            while 'uploads.uploads.finished:1|c' not in packets:
+                packets.append(server.recv(1024))
+        finally:
+            server.close()
+        self.assertTrue('uploads.uploads.started:1|c' in packets)
+        self.assertTrue('uploads.chunk.size:100|h' in packets)
+        self.assertTrue([packet for packet in packets if packet.startswith('uploads.phase.temp_write:') and
+                         packet.endswith('|ms')])
+
+    def test_signal_sink(self):
+        metrics = []
+
+        def receiver(sender, kind, name, value, **kwargs):
+            metrics.append((kind, name, value))
+        upload_metric.connect(receiver)
+        try:
+            self.post_upload(SignalMetricsSink())
+        finally:
+            upload_metric.disconnect(receiver)
+        self.assertTrue(('count', 'uploads.finished', 1) in metrics)
+        self.assertTrue(('histogram', 'chunk.size', 100) in metrics)
+        self.assertEqual([value for kind, name, value in metrics if name == 'requests_in_flight'], [1, 0, 1, 0])
+        self.assertEqual(len([name for kind, name, value in metrics if name == 'phase.request']), 2)
+
+
+class BenchmarkTest(TestCase):
+    def test_failed_uploaders_count_as_errors(self):
+        # a temp folder that can't be made fails every uploader outright
+        benchmark = UploadBenchmark(UploadedDocument, 'content', temp_roots=['/proc/nonexistent'])
+        result = benchmark.run(10000, 4000, uploaders=2)
+        self.assertEqual((result['errors'], result['requests'], result['peak_rss_bytes']), (2, 0, None))
+
+
+class MemoryTempStorage(BaseUploadTempStorage):
+    """
+    Just enough of a temp storage built on BaseUploadTempStorage for a janitor to clean up: the last write time of
+    each temp file, and its contents.
+    """
+
+    def __init__(self, temp_files):
+        self.temp_files = temp_files
+
+    def get_activity_times(self):
+        return sorted(set(written for written, contents in self.temp_files.values()))
+
+    def reap_abandoned_temp_files(self, last_active_before, batch_size=500, batch_pause=0, reaped_file_ids=None):
+        abandoned = [file_id for file_id, (written, contents) in self.temp_files.items()
+                     if written < last_active_before]
+        freed = sum(len(self.temp_files.pop(file_id)[1]) for file_id in abandoned)
+        if reaped_file_ids is not None:
+            reaped_file_ids.extend(abandoned)
+        return len(abandoned), freed
+
+
+class JanitorTest(TestCase):
+    def test_janitor_reaps_custom_temp_storage(self):
+        temp_storage = MemoryTempStorage({'old': (1000, 'abc'), 'new': (9000, 'defg')})
+        janitor = TempFileJanitor(temp_storage, max_age=5000, min_free_bytes=10 ** 6)
+        result = janitor.reap(now=10000)
+        self.assertEqual((result['files_reclaimed'], result['bytes_reclaimed']), (1, 3))
+        self.assertEqual(temp_storage.temp_files.keys(), ['new'])
+
+    def test_janitor_reaps_upload_progress_of_reaped_files(self):
+        for file_id, file_name in [('1', 'old.jpg'), ('2', 'new.jpg'), ('3', 'elsewhere.jpg')]:
+            UploadProgress.objects.create(session_key='a', model_name='UploadedDocument', file_name=file_name,
+                                          file_id=file_id)
+        # as old as the first, but its temp file is in another temp storage
+        UploadProgress.objects.filter(file_id__in=['1', '3']).update(updated=datetime.now() - timedelta(days=2))
+        temp_storage = MemoryTempStorage({'1': (1000, 'abc'), '2': (time.time(), 'defg')})
+        result = TempFileJanitor(temp_storage, reap_upload_progress=True).reap()
+        self.assertEqual(result['progress_reclaimed'], 1)
+        self.assertEqual(sorted(progress.file_name for progress in UploadProgress.objects.all()),
+                         ['elsewhere.jpg', 'new.jpg'])
+
+
+class PreallocatedTempStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.temp_storage = UploadTempStoragePreallocated('uploads', temp_roots=[self.folder])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_file_deleted_by_another_process_is_reopened(self):
+        self.temp_storage.write_uploaded_file_to_temp_file('deleted', SimpleUploadedFile('blob', 'abc'), 0, 6)
+        # as by a janitor in another process, which can't close this one's file descriptor
+        os.remove(self.temp_storage._temp_file_path('deleted'))
+        self.temp_storage.write_uploaded_file_to_temp_file('deleted', SimpleUploadedFile('blob', 'def'), 3, 6)
+        self.assertTrue(self.temp_storage.temp_file_exists('deleted'))
+        self.assertEqual(self.temp_storage.open_temp_file('deleted').read(), '\0\0\0def')
+
+
+def _test_database_in_memory():
+    # threads can't see the tables of an in-memory sqlite database, which is what tests get unless TEST_NAME is set
+    settings_dict = connection.settings_dict
+    return 'sqlite3' in settings_dict['ENGINE'] and settings_dict.get('TEST_NAME') in (None, '', ':memory:')
+
+
+class UnsavedCacheDocumentUploadView(CacheDocumentUploadView):
+    """
+    Keeps the documents it finalises in finalised_documents instead of saving them, so the threads of a concurrency
+    test don't need the test database, which is in memory by default.
+    """
+    finalised_documents = []
+
+    def create_and_save_object(self, expected_file_name, chunked_file):
+        o = self.create_new_instance()
+        self.get_file_field(o).save(expected_file_name, chunked_file, save=False)
+        chunked_file.close()
+        self.finalised_documents.append(o)
+        return o
+
+
+class UnsavedDocumentTestMixin(object):
+    view_class = UnsavedCacheDocumentUploadView
+
+    def setUp(self):
+        super(UnsavedDocumentTestMixin, self).setUp()
+        del self.view_class.finalised_documents[:]
+
+    def saved_contents(self):
+        return [document.content.read() for document in self.view_class.finalised_documents]
+
+
+class ConcurrentChunksTestMixin(UploadTestMixin):
+    """
+    Many chunks of one file posted at once from several threads, in a shuffled order, with positional writes. Each
+    chunk is sent twice, as by a client retrying. Exactly one of them must finalise the upload, and the saved file must
+    be the one that was sent.
+    """
+    thread_count = 8
+    chunk_size = 1000
+    chunk_count = 64
+
+    def test_concurrent_chunks_finalise_once(self):
+        data = os.urandom(self.chunk_size * self.chunk_count)
+        starts = range(0, len(data), self.chunk_size) * 2
+        random.shuffle(starts)
+        replies = []
+        errors = []
+
+        def post_chunks():
+            try:
+                while True:
+                    try:
+                        start = starts.pop()
+                    except IndexError:
+                        return
+                    replies.append(self.post_chunk(data[start:start + self.chunk_size], start, len(data),
+                                                   name='stress.bin', upload_id='stress', positional_writes=True))
+            except Exception, e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=post_chunks) for i in range(self.thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(replies), self.chunk_count * 2)
+        self.assertEqual([status for status, reply in replies if status != 200], [])
+        finished = [reply for status, reply in replies if 'files' in reply]
+        self.assertEqual(len(finished), 1)
+        self.assertEqual(finished[0]['files'][0]['size'], len(data))
+        self.assertTrue(self.saved_contents() == [data])
+
+
+class CacheConcurrentChunksTest(UnsavedDocumentTestMixin, ConcurrentChunksTestMixin, TransactionTestCase):
+    pass
+
+
+class CachePreallocatedConcurrentChunksTest(UnsavedDocumentTestMixin, ConcurrentChunksTestMixin, TransactionTestCase):
+    def make_temp_storage(self):
+        return UploadTempStoragePreallocated('uploads', temp_roots=[os.path.join(self.folder, 'temp')])
+
+
+@unittest.skipIf(_test_database_in_memory(), 'Needs a test database the threads can share (set TEST_NAME)')
+class DatabaseConcurrentChunksTest(ConcurrentChunksTestMixin, TransactionTestCase):
+    view_class = DatabaseDocumentUploadView
+
+
+@unittest.skipIf(_test_database_in_memory(), 'Needs a test database the threads can share (set TEST_NAME)')
+class DatabasePreallocatedConcurrentChunksTest(ConcurrentChunksTestMixin, TransactionTestCase):
+    view_class = DatabaseDocumentUploadView
+
+    def make_temp_storage(self):
+        return UploadTempStoragePreallocated('uploads', temp_roots=[os.path.join(self.folder, 'temp')])
+
+
+class AtomicIncrCache(LocMemCache):
+    """
+    A local memory cache with its own atomic incr, like memcached's, so views take the fast path instead of locking.
+    """
+
+    def __init__(self):
+        super(AtomicIncrCache, self).__init__('atomic-incr', {})
+        self.incr_lock = threading.Lock()
+        self.incr_calls = 0
+
+    def incr(self, key, delta=1, version=None):
+        with self.incr_lock:
+            self.incr_calls += 1
+            value = self.get(key, version=version)
+            if value is None:
+                raise ValueError("Key '%s' not found" % key)
+            self.set(key, value + delta, version=version)
+            return value + delta
+
+
+class ConcurrentIncrementTestMixin(UploadTestMixin):
+    """
+    Many chunks of one file counted at once from several threads, as for uploads without positional writes. However
+    the cache does it, no chunk's bytes may be lost, and each chunk must see a different running total.
+    """
+    view_class = CacheDocumentUploadView
+    thread_count = 8
+    chunk_size = 1000
+    chunk_count = 200
+
+    def make_cache(self):
+        return LocMemCache('concurrent-increments', {})
+
+    def setUp(self):
+        super(ConcurrentIncrementTestMixin, self).setUp()
+        self.original_cache = views.cache
+        views.cache = self.cache = self.make_cache()
+
+    def tearDown(self):
+        views.cache = self.original_cache
+        super(ConcurrentIncrementTestMixin, self).tearDown()
+
+    def test_concurrent_increments_add_up(self):
+        file_id = self.make_view().generate_file_id('counted.bin', self.chunk_size * self.chunk_count)
+        remaining = range(self.chunk_count)
+        totals = []
+        errors = []
+
+        def count_chunks():
+            view = self.make_view()
+            try:
+                while True:
+                    try:
+                        remaining.pop()
+                    except IndexError:
+                        return
+                    totals.append(view.increment_uploaded_bytes(file_id, self.chunk_size))
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=count_chunks) for i in range(self.thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total = self.chunk_size * self.chunk_count
+        self.assertEqual(sorted(totals), range(self.chunk_size, total + 1, self.chunk_size))
+        self.assertEqual(self.make_view().get_uploaded_bytes(file_id), total)
+
+
+class LockedIncrementTest(ConcurrentIncrementTestMixin, TestCase):
+    def test_increments_are_locked(self):
+        self.assertFalse(views._cache_has_atomic_incr())
+
+
+class AtomicIncrementTest(ConcurrentIncrementTestMixin, TestCase):
+    def make_cache(self):
+        return AtomicIncrCache()
+
+    def test_increments_use_incr(self):
+        self.assertTrue(views._cache_has_atomic_incr())
+        self.make_view().increment_uploaded_bytes('counted', 10)
+        self.assertEqual(self.cache.incr_calls, 1)
+
+
+class UploadLimiterTestMixin(UploadTestMixin):
+    """
+    Uploads over an UploadLimiter's limits are turned away before their bodies are read, with a 429 for the limits of
+    one session and a 503 for everyone's, and take nothing from the limits when they are.
+    """
+    view_class = CacheDocumentUploadView
+
+    def make_cache(self):
+        return LocMemCache('upload-limits', {})
+
+    def setUp(self):
+        super(UploadLimiterTestMixin, self).setUp()
+        self.original_cache = limits.cache
+        limits.cache = self.cache = self.make_cache()
+
+    def tearDown(self):
+        limits.cache = self.original_cache
+        super(UploadLimiterTestMixin, self).tearDown()
+
+    def post_limited(self, upload_limiter, data, name='limited.jpg'):
+        request = self.factory.post('/', {'files': SimpleUploadedFile(name, data)})
+        request.session = FakeSession(self.session_key)
+        return self.view_class.as_view(temp_storage=self.temp_storage, upload_limiter=upload_limiter)(request)
+
+    def test_session_bandwidth(self):
+        upload_limiter = UploadLimiter(bytes_per_second={'session': 10000}, store=CacheLimitStore())
+        self.assertEqual(self.post_limited(upload_limiter, 'a' * 6000).status_code, 200)
+
+        response = self.post_limited(upload_limiter, 'b' * 6000)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(json.loads(response.content), {'error': 'UPLOADING TOO FAST', 'limit': 'session'})
+        self.assertEqual(self.saved_contents(), ['a' * 6000])
+
+        # a small upload still fits in what's left
+        self.assertEqual(self.post_limited(upload_limiter, 'c' * 3000).status_code, 200)
+
+    def test_global_concurrency(self):
+        store = CacheLimitStore()
+        upload_limiter = UploadLimiter(concurrent_uploads={'session': 1, 'global': 1}, store=store)
+        slot_id = store.take_slot('global', 1, upload_limiter.slot_timeout)
+
+        response = self.post_limited(upload_limiter, 'a')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(json.loads(response.content), {'error': 'TOO MANY UPLOADS', 'limit': 'global'})
+
+        # the session's slot was given back when the global one couldn't be had, and each upload gives its slots back
+        store.give_back_slot('global', slot_id)
+        self.assertEqual(self.post_limited(upload_limiter, 'b').status_code, 200)
+        self.assertEqual(self.post_limited(upload_limiter, 'c').status_code, 200)
+        self.assertEqual(self.saved_contents(), ['b', 'c'])
+
+    def test_refused_upload_returns_tokens(self):
+        upload_limiter = UploadLimiter(bytes_per_second={'session': 100000, 'global': 10000}, store=CacheLimitStore())
+        self.assertEqual(self.post_limited(upload_limiter, 'a' * 6000).status_code, 200)
+        self.assertEqual(self.post_limited(upload_limiter, 'b' * 6000).status_code, 503)
+        # the session's tokens for the second upload were put back when the global bucket turned it away
+        session_key = 'session::%s' % self.session_key
+        self.assertEqual(upload_limiter.store.take_tokens(session_key, 93000, 100000, 100000), 0)
+
+
+class LockedUploadLimiterTest(UploadLimiterTestMixin, TestCase):
+    pass
+
+
+class CountedUploadLimiterTest(UploadLimiterTestMixin, TestCase):
+    def make_cache(self):
+        return AtomicIncrCache()
+
+    def test_limits_use_incr(self):
+        upload_limiter = UploadLimiter(bytes_per_second={'session': 10000}, concurrent_uploads={'global': 4},
+                                       store=CacheLimitStore())
+        self.assertEqual(self.post_limited(upload_limiter, 'a').status_code, 200)
+        # the bucket and the slot, then giving the slot back
+        self.assertEqual(self.cache.incr_calls, 3)
+        self.assertFalse([key for key in self.cache._cache if key.endswith('::lock')])
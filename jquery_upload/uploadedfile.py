@@ -0,0 +1,49 @@
+from django.core.files.uploadedfile import UploadedFile
+
+
+class RawBodyUploadedFile(UploadedFile):
+    """
+    A file (or chunk) sent as the whole body of a request, as jQuery file upload does with multipart: false.
+
+    It's read straight from the request as it's written to the temp file, rather than being spooled to memory or disk
+    by Django's upload handlers first, so each byte is only written once. It can only be read through once.
+    """
+    # written at its Content-Range offset even without positional writes, so if the body is cut short, sending the
+    # chunk again writes over the part that did arrive
+    write_at_offset = True
+    # read from the request as it's written, which has to happen on the request's own thread (or greenlet)
+    reads_from_request = True
+
+    def __init__(self, request, name, size, content_type=None):
+        """
+        @param request: The request, whose body is the file
+        @type request: HttpRequest
+        @param name: Name of the file
+        @type name: str
+        @param size: Length of the body, from its Content-Length
+        @type size: int
+        @param content_type: Content type of the body
+        @type content_type: str
+        """
+        super(RawBodyUploadedFile, self).__init__(request, name, content_type, size)
+
+    def chunks(self, chunk_size=None):
+        """
+        Read the body a piece at a time.
+
+        @raise IOError: If the body ends before size bytes, such as when the client goes away part way through.
+        """
+        remaining = self.size
+        while remaining > 0:
+            data = self.file.read(min(chunk_size or self.DEFAULT_CHUNK_SIZE, remaining))
+            if not data:
+                raise IOError('The request body ended %s bytes short' % remaining)
+            remaining -= len(data)
+            yield data
+
+    def multiple_chunks(self, chunk_size=None):
+        return True
+
+    def close(self):
+        # the request isn't ours to close
+        pass
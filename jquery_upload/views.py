@@ -1,17 +1,132 @@
 import json
 import logging
+import os
+import time
 import uuid
-from django.conf import settings
+from contextlib import contextmanager
+from datetime import datetime
 from django.core.cache import cache
-from django.core.files.storage import FileSystemStorage
+from django.core.files.base import File
+from django.db import connection
+from django.db.models import F, FileField
 from django.http import HttpResponse
-from django.utils._os import safe_join
 from django.views.generic import View
+from jquery_upload.checksums import ZLIB_CHECKSUMS, RunningChecksum, forget_running_checksum, get_running_checksum, \
+    keep_running_checksum
+from jquery_upload.executors import get_default_executor
+from jquery_upload.headers import parse_content_disposition_filename, parse_content_range, parse_upload_id
+from jquery_upload.instrumentation import NULL_TIMER, InFlightCounter, PhaseTimer
+from jquery_upload.limits import cache_has_atomic_incr
+from jquery_upload.models import StoredContent, UploadProgress
+from jquery_upload.pipeline import RunningPipeline, forget_running_pipeline, get_running_pipeline, keep_running_pipeline
+# the temp storages used to be defined here, so they can still be imported from here
+from jquery_upload.storage import BaseUploadTempStorage, UploadTempFile, UploadTempStorageFileSystem, \
+    UploadTempStoragePreallocated
+from jquery_upload.uploadedfile import RawBodyUploadedFile
+
+__all__ = [
+    'UploadExpired', 'merge_byte_range', 'byte_ranges_cover', 'SIZE_REPLY_TEMPLATE', 'MAX_PROGRESS_KEYS',
+    'JSONResponseMixin', 'BaseUploadContentView', 'CooperativeUploadMixin', 'PartialUploadCacheMixin',
+    'PartialUploadDatabaseMixin',
+    'BaseUploadTempStorage', 'UploadTempFile', 'UploadTempStorageFileSystem', 'UploadTempStoragePreallocated',
+]
 
 # Get an instance of a logger
 logger = logging.getLogger()
 
 
+class UploadExpired(Exception):
+    """
+    Raised by handle_upload when an upload is resumed after its temp file has been deleted.
+    """
+
+
+def merge_byte_range(ranges, start, end):
+    """
+    Merge a half-open byte range [start, end) into a list of the ranges received so far.
+
+    @param ranges: Non-overlapping (start, end) pairs
+    @type ranges: list
+    @param start: First byte of the new range
+    @type start: int
+    @param end: One past the last byte of the new range
+    @type end: int
+    @return: Sorted, non-overlapping (start, end) pairs, with touching ranges joined together
+    @rtype: list
+    """
+    merged = []
+    for range_start, range_end in sorted([tuple(r) for r in ranges] + [(start, end)]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+        else:
+            merged.append((range_start, range_end))
+    return merged
+
+
+def byte_ranges_cover(ranges, byte_count):
+    """
+    Check whether merged byte ranges cover the whole of [0, byte_count).
+
+    @param ranges: Sorted, non-overlapping (start, end) pairs, as from merge_byte_range
+    @type ranges: list
+    @param byte_count: Size of the complete file
+    @type byte_count: int
+    @rtype: bool
+    """
+    return len(ranges) == 1 and ranges[0][0] == 0 and ranges[0][1] >= byte_count
+
+
+def _lock_stream_at(stream, offset):
+    """
+    Lock a running checksum or pipeline if it's got to exactly offset, for a chunk starting there to be added to it.
+
+    @return: The stream, locked, or None if it's somewhere else or another request has it.
+    """
+    if stream.offset != offset or not stream.lock.acquire(False):
+        return None
+    if stream.offset != offset:
+        # another chunk was added while we were getting the lock
+        stream.lock.release()
+        return None
+    return stream
+
+
+def _call(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+def _chain_callbacks(callbacks):
+    """
+    Combine chunk callbacks into one, or None if there aren't any.
+    """
+    if not callbacks:
+        return None
+    if len(callbacks) == 1:
+        return callbacks[0]
+
+    def chunk_callback(data):
+        for callback in callbacks:
+            callback(data)
+    return chunk_callback
+
+
+def _cache_has_atomic_incr():
+    """
+    Check whether the default cache implements incr itself (like memcached), rather than emulating it.
+    """
+    return cache_has_atomic_incr(cache)
+
+
+# requests being handled by upload views in this process, when their metrics are on
+_requests_in_flight = InFlightCounter()
+# the reply to each chunk that doesn't finish its upload, the same as json.dumps({'size': n}) gives
+SIZE_REPLY_TEMPLATE = '{"size": %d}'
+# cache keys for uploads' progress, which each chunk of an upload needs again, by (view class, session key, parts of
+# the key), as subclasses can sanitise keys differently
+_progress_keys = {}
+MAX_PROGRESS_KEYS = 4096
+
+
 class JSONResponseMixin(object):
     """
     A mixin that can be used to render a JSON response.
@@ -22,110 +137,544 @@ class JSONResponseMixin(object):
         """
         Returns a JSON response, transforming 'context' to make the payload.
         """
+        return self.render_json_to_response(self.convert_context_to_json(context), **response_kwargs)
+
+    def render_json_to_response(self, content, **response_kwargs):
+        """
+        Returns a JSON response of content that's already been converted to JSON.
+        """
         response_kwargs['content_type'] = 'application/json'
-        return self.response_class(
-            self.convert_context_to_json(context),
-            **response_kwargs
-        )
+        return self.response_class(content, **response_kwargs)
 
     def convert_context_to_json(self, context):
         # Convert the context dictionary into a JSON object
         return json.dumps(context)
 
 
-class UploadTempStorageFileSystem(object):
-    def __init__(self, temp_file_folder):
+class BaseUploadContentView(JSONResponseMixin, View):
+    model = None
+    temp_storage = None
+    file_field_name = None
+    uploaded_files_parameter = u'files'
+    # Write each chunk at its Content-Range offset, so chunks can be sent in parallel and out of order. Needs partial
+    # upload support, and a client upload ID with each chunk.
+    positional_writes = False
+    # request.META key for a header with the client's ID for an upload (letters, digits, '-' and '_'). It keeps the
+    # upload apart from any other upload of a file with the same name, such as an abandoned one.
+    upload_id_meta_key = 'HTTP_X_UPLOAD_ID'
+    upload_id = None
+    # Save completed uploads in the background, handing back a job ID that can be polled with a GET
+    finalise_asynchronously = False
+    # Anything with the submit() method of concurrent.futures executors. Defaults to a thread pool in this process.
+    finalisation_executor = None
+    job_parameter = u'job'
+    # Query parameter naming a file when asking how much of it we've received, to resume an upload
+    file_parameter = u'file'
+    # Seconds to remember the status of a background job for
+    job_status_timeout = 60 * 60
+    # Save the instances for a batch of files with one bulk_create, where the model's manager has it
+    bulk_create_batches = True
+    # Checksum each file as it's uploaded: 'crc32', 'adler32', or a hashlib algorithm such as 'md5' or 'sha256'
+    checksum_algorithm = None
+    # request.META key for a header with the client's checksum of the whole file, in hex, to check ours against
+    checksum_meta_key = 'HTTP_X_FILE_CHECKSUM'
+    # Field on the model to keep the checksum in, if any
+    checksum_field_name = None
+    upload_checksum = None
+    # Streaming stages (BaseUploadStage classes) fed each file's bytes as they're written to the temp file. Their
+    # results are stored on the model by store_stage_results.
+    upload_stages = ()
+    # Stages that need the whole file (BaseFileStage classes), run on the finalisation executor once it's saved. Their
+    # results are stored by store_file_stage_results.
+    file_stages = ()
+    upload_stage_results = None
+    # A BaseMetricsSink to send timings of each phase of a request to. Metrics are off while this is None.
+    metrics_sink = None
+    # Store each distinct file once, recognising repeats by their checksum. Needs a hashlib checksum_algorithm.
+    deduplicate_uploads = False
+    # Give repeated content its own name, hard linked to the first copy, where the storage is on the local disk.
+    # Otherwise the instances share the one stored file.
+    deduplicate_with_hard_links = True
+    # Let clients skip uploading content we already have: a GET asks after it by its checksum, and a POST of just the
+    # checksum saves it. Needs deduplicate_uploads. The content we have is shared by everyone using the view, so
+    # anyone who knows a file's checksum and size can get a copy of it. Only turn this on where every user may see
+    # every upload.
+    accept_known_content = False
+    # Parameters of a GET or POST asking after content by its checksum, before uploading it
+    checksum_parameter = u'checksum'
+    size_parameter = u'size'
+    # Accept files sent as the whole request body (jQuery file upload's multipart: false), writing them straight from
+    # the request to the temp file. The view must be CSRF exempt, and nothing may read request.POST before it does, or
+    # Django reads the whole body into memory first.
+    raw_body_uploads = False
+    # An UploadLimiter to turn away uploads over its bandwidth and concurrency limits, or None for no limits
+    upload_limiter = None
+
+    def dispatch(self, request, *args, **kwargs):
+        admission = None
+        if self.upload_limiter is not None and request.method == 'POST':
+            # before anything reads the body
+            admission = self.upload_limiter.admit(request)
+            if not admission.admitted:
+                return self.upload_rejected_response(admission)
+
+        try:
+            if self.metrics_sink is None:
+                return super(BaseUploadContentView, self).dispatch(request, *args, **kwargs)
+
+            _requests_in_flight.add(self.metrics_sink, 'requests_in_flight', 1)
+            try:
+                with self.time_phase('request'):
+                    return super(BaseUploadContentView, self).dispatch(request, *args, **kwargs)
+            finally:
+                _requests_in_flight.add(self.metrics_sink, 'requests_in_flight', -1)
+        finally:
+            if admission is not None:
+                admission.release()
+
+    def upload_rejected_response(self, admission):
         """
-        Basic file system manager for handling uploaded files up until they're 'complete'
+        Make the response for an upload turned away by the upload_limiter: a 429 for the limits of one session or
+        user, or a 503 when everyone's uploads together are over the limit, with a Retry-After header either way.
 
-        @param temp_file_folder: A folder (within MEDIA_ROOT) where the uploads will be saved.
-        @type temp_file_folder: str
+        @param admission: The Admission that turned the upload away
+        @type admission: Admission
+        @rtype: HttpResponse
         """
-        self.temp_file_folder = temp_file_folder
+        if self.metrics_sink is not None:
+            self.metrics_sink.count('uploads.rejected')
+        error = 'TOO MANY UPLOADS' if admission.reason == 'concurrency' else 'UPLOADING TOO FAST'
+        response = self.render_to_response({'error': error, 'limit': admission.scope},
+                                           status=503 if admission.scope == 'global' else 429)
+        response['Retry-After'] = str(admission.retry_after)
+        return response
+
+    def render_to_response(self, context, **response_kwargs):
+        with self.time_phase('render'):
+            return super(BaseUploadContentView, self).render_to_response(context, **response_kwargs)
 
-    def open_temp_file(self, file_id):
+    def render_size_response(self, uploaded_bytes_count):
         """
-        Open the temp uploaded file.
+        Reply to a chunk that didn't finish its upload with how much of the file we have, as {"size": n}. With small
+        chunks it's the reply to nearly every request, so it's filled into a template rather than going through
+        convert_context_to_json.
 
-        @param file_id: Unique ID of the uploaded file.
-        @type file_id: str
-        @return: Opened (as binary) File instance
-        @rtype: File
+        @param uploaded_bytes_count: Bytes of the file uploaded so far
+        @type uploaded_bytes_count: int
         """
-        fs = self._temp_file_storage()
-        return fs.open(self._file_path(file_id), 'rb')
+        with self.time_phase('render'):
+            return self.render_json_to_response(SIZE_REPLY_TEMPLATE % uploaded_bytes_count)
 
-    def remove_temp_file(self, file_id):
+    def time_phase(self, phase):
         """
-        Delete the temp uploaded file.
+        Time a phase of handling a request into metrics_sink, as 'phase.<phase>'. Use it as a 'with' block; when
+        metrics are off, it does nothing.
 
-        @param file_id: Unique ID of the uploaded file
-        @type file_id: str
+        @param phase: Name of the phase, such as 'temp_write' or 'finalise'
+        @type phase: str
+        """
+        if self.metrics_sink is None:
+            return NULL_TIMER
+        return PhaseTimer(self.metrics_sink, 'phase.%s' % phase)
+
+    def post(self, request, **kwargs):
+        raw_body_file = self.get_raw_body_file(request)
+        if raw_body_file is not None:
+            if raw_body_file.size is None:
+                # such as a chunked transfer encoding, which we'd take for an empty file
+                return self.render_to_response({'error': 'LENGTH REQUIRED'}, status=411)
+            if not raw_body_file.size:
+                return self.render_to_response({'error': 'NO FILE GIVEN'}, status=400)
+            uploaded_files = [raw_body_file]
+        else:
+            uploaded_files = request.FILES.getlist(self.uploaded_files_parameter)
+        if not uploaded_files and self.known_content_supported() and request.POST.get(self.checksum_parameter):
+            # no bytes sent, just the checksum of content we might already have
+            return self.handle_known_content(request.POST)
+        if not uploaded_files:
+            return self.render_to_response({'error': 'NO FILE GIVEN'}, status=400)
+        if len(uploaded_files) > 1:
+            # several whole files in one request (singleFileUploads: false), which are never chunked
+            return self.render_to_response({'files': self.handle_batch_upload(uploaded_files)})
+
+        with self.time_phase('parse_meta'):
+            blob_file = uploaded_files[0] if uploaded_files else None
+            blob_size = blob_file._get_size()
+            blob_name = blob_file.name
+
+            if self.partial_upload_supported():
+                #If files are chunked, the original file metadata is stored in extra META headers and the
+                #POSTed file is called 'blob'. For files that aren't chunked, use the POSTed file directly.
+                try:
+                    starting, ending, expected_byte_count = self._get_filesize_from_request_meta(request.META)
+                except ValueError:
+                    return self.render_to_response({'error': 'BAD CONTENT RANGE'}, status=400)
+                try:
+                    self.upload_id = self._get_upload_id_from_request_meta(request.META)
+                except ValueError:
+                    return self.render_to_response({'error': 'BAD UPLOAD ID'}, status=400)
+                if self.upload_id is None and self.positional_writes and starting is not None:
+                    # chunks arrive in any order, so without an ID they can't be told from an abandoned upload's
+                    return self.render_to_response({'error': 'NO UPLOAD ID'}, status=400)
+                if not expected_byte_count:
+                    expected_byte_count = blob_size
+                expected_file_name = self._get_filename_from_request_meta(request.META) or blob_name
+            else:
+                starting = 0
+                expected_byte_count = blob_size
+                expected_file_name = blob_name
+
+        try:
+            chunked_file, file_finalised, file_id, uploaded_bytes_count = \
+                self.handle_upload(blob_file, expected_file_name, expected_byte_count, starting)
+        except UploadExpired:
+            return self.render_to_response({'files': [{'name': expected_file_name, 'error': 'UPLOAD EXPIRED'}]})
+
+        if not file_finalised:
+            return self.render_size_response(uploaded_bytes_count)
+
+        if chunked_file.size != int(expected_byte_count):
+            # the temp file doesn't have the bytes we counted, such as when it was reaped before the upload was resumed
+            logger.warning('Temp file for %s has %s bytes, not %s', expected_file_name, chunked_file.size,
+                           expected_byte_count)
+            chunked_file.close()
+            self._remove_temporary_file(file_id)
+            return self.render_to_response({'files': [
+                {'name': expected_file_name, 'error': 'INCOMPLETE UPLOAD'}
+            ]})
+
+        if not self.checksum_matches(request.META):
+            chunked_file.close()
+            self._remove_temporary_file(file_id)
+            return self.render_to_response({'files': [
+                {'name': expected_file_name, 'error': 'CHECKSUM MISMATCH'}
+            ]})
+
+        if self.finalise_asynchronously:
+            job_id = str(uuid.uuid4())
+            self.set_job_status(job_id, {'status': 'pending'})
+            self.get_finalisation_executor().submit(
+                self._finalise_in_background, job_id, expected_file_name, chunked_file, file_id)
+            return self.render_to_response({'files': [
+                {'name': expected_file_name, 'size': expected_byte_count, 'job': job_id, 'status': 'pending'}
+            ]})
+
+        try:
+            with self.time_phase('finalise'):
+                files = [self.run_blocking(self.finalise_upload, expected_file_name, chunked_file, file_id)]
+            return self.render_to_response({'files': files})
+        except Exception, e:
+            return self.render_to_response([{'name': expected_file_name, 'error': 'ERROR SAVING FILE'}])
+
+    def get_raw_body_file(self, request):
+        """
+        Get the file sent as the body of a request, when it's not a form. jQuery file upload sends files this way with
+        multipart: false, naming the file in a Content-Disposition header.
+
+        If something read request.POST before the view (such as CsrfViewMiddleware), Django has already read the whole
+        body into memory. The file is read from there, and a warning is logged, as each chunk is then held in memory.
+
+        @param request: The request
+        @type request: HttpRequest
+        @return: The body as a file, to be read as it's written, or None if the file isn't the body of the request. Its
+        size is None if the request has no Content-Length.
+        @rtype: RawBodyUploadedFile or None
+        """
+        content_type = request.META.get('CONTENT_TYPE', '')
+        if not self.raw_body_uploads or content_type.startswith('multipart/') or \
+                content_type.startswith('application/x-www-form-urlencoded'):
+            return None
+        expected_file_name = self._get_filename_from_request_meta(request.META)
+        if not expected_file_name:
+            return None
+        content_length = request.META.get('CONTENT_LENGTH')
+        try:
+            size = int(content_length) if content_length not in (None, '') else None
+        except ValueError:
+            return None
+        if hasattr(request, '_raw_post_data'):
+            logger.warning('The body of %s was read into memory before the view; make it CSRF exempt, and don\'t read '
+                           'request.POST, to write raw body uploads straight to the temp file', request.path)
+        elif getattr(request, '_read_started', False):
+            # part of the body has been read, and it's gone
+            return None
+        return RawBodyUploadedFile(request, expected_file_name, size, content_type.split(';')[0] or None)
+
+    def get(self, request, **kwargs):
+        """
+        Report on an upload. Either:
+        * with ?file=<name>, how much of a partial upload we already have, so the client can resume it. The response is
+          {'file': {'name': ..., 'size': ...}}, as jQuery file upload's resume examples expect. Send the same upload ID
+          header as the upload's chunks.
+        * with ?job=<id>, the status of a background job started by finalise_asynchronously. The response has the job's
+          status, which is one of 'pending', 'done' or 'error', and once it's done, the same 'files' as a synchronous
+          upload would have had.
+        * with ?checksum=<hex>&size=<bytes>, when accept_known_content is set, whether we already have that content, as
+          {'checksum': ..., 'known': true/false}. If we do, POST the same parameters (and the file's name) instead of
+          uploading it.
+        """
+        job_id = request.GET.get(self.job_parameter, None)
+        if job_id:
+            return self._job_status_response(job_id)
+
+        checksum = request.GET.get(self.checksum_parameter, None)
+        if checksum and self.known_content_supported():
+            stored_name = self.find_stored_content(checksum, request.GET.get(self.size_parameter, None))
+            return self.render_to_response({'checksum': checksum, 'known': stored_name is not None})
+
+        expected_file_name = request.GET.get(self.file_parameter, None)
+        if expected_file_name and self.partial_upload_supported():
+            try:
+                self.upload_id = self._get_upload_id_from_request_meta(request.META)
+            except ValueError:
+                return self.render_to_response({'error': 'BAD UPLOAD ID'}, status=400)
+            upload_status = self.get_upload_status(expected_file_name)
+            response = self.render_to_response({'file': upload_status})
+            response['X-Uploaded-Bytes'] = str(upload_status['size'])
+            return response
+
+        return self.render_to_response({'error': 'NO FILE OR JOB GIVEN'}, status=400)
+
+    def head(self, request, **kwargs):
+        """
+        The same as a GET, without the body. For a file, the X-Uploaded-Bytes header says how much we already have.
+        """
+        response = self.get(request, **kwargs)
+        response.content = ''
+        return response
+
+    def get_upload_status(self, expected_file_name):
+        """
+        Describe how much of a file we've received so far.
+
+        The size is the number of bytes from the start of the file that we have, so the client can carry on from there.
+        With positional writes, the byte ranges we've received are included too, so a client sending chunks in parallel
+        can skip any chunk it's already sent.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @return: Dictionary with the name and size of the file so far, and its ranges for positional writes.
+        @rtype: dict
+        """
+        upload_status = {'name': expected_file_name, 'size': 0}
+        file_id = self.get_file_id(expected_file_name)
+        if file_id is None:
+            return upload_status
+
+        if self.positional_writes:
+            ranges = self.get_uploaded_ranges(file_id)
+            upload_status['ranges'] = [list(r) for r in ranges]
+            if ranges and ranges[0][0] == 0:
+                upload_status['size'] = ranges[0][1]
+        else:
+            upload_status['size'] = self.get_uploaded_bytes(file_id)
+        return upload_status
+
+    def _job_status_response(self, job_id):
+        job_status = self.get_job_status(job_id)
+        if job_status is None:
+            return self.render_to_response({'job': job_id, 'error': 'UNKNOWN JOB'}, status=404)
+
+        job_status['job'] = job_id
+        return self.render_to_response(job_status)
+
+    def handle_batch_upload(self, uploaded_files):
+        """
+        Handles several complete files uploaded in the same request, creating an instance of the model for each.
+
+        Each file is checksummed and run through the upload_stages on its way in, deduplicated, and has its file_stages
+        run once it's saved, as a single upload would. The checksum_meta_key header isn't checked, as one header can't
+        vouch for several files.
+
+        The instances are saved with a single bulk_create when bulk_create_batches_supported() says so. Otherwise
+        they're saved one at a time, as for a single upload.
+
+        @param uploaded_files: The files being uploaded.
+        @type uploaded_files: list
+        @return: For each file, in order, the dictionary from make_upload_response, or the error saving that file.
+        @rtype: list
+        """
+        if self.metrics_sink is not None:
+            self.metrics_sink.count('batch.files', len(uploaded_files))
+        bulk = self.bulk_create_batches_supported()
+        responses = []
+        saving = []
+        for uploaded_file in uploaded_files:
+            # each file is already complete, so it goes straight to the model's storage without a temp file
+            try:
+                self._scan_whole_file(uploaded_file)
+                if bulk:
+                    o = self.create_new_instance()
+                    self.decorate_instance(o)
+                    if self.upload_checksum is not None:
+                        self.store_checksum(o, self.upload_checksum)
+                    if self.upload_stage_results is not None:
+                        self.store_stage_results(o, uploaded_file.name, self.upload_stage_results)
+                    # the instance is saved by bulk_create, so the content goes straight onto the field
+                    self.get_file_field(o).save(uploaded_file.name, uploaded_file, save=False)
+                    uploaded_file.close()
+                    self.pre_save(o)
+                else:
+                    o = self.create_and_save_object(uploaded_file.name, uploaded_file)
+            except Exception:
+                logger.exception('Saving %s failed' % uploaded_file.name)
+                responses.append({'name': uploaded_file.name, 'error': 'ERROR SAVING FILE'})
+                continue
+            responses.append(None)
+            saving.append((len(responses) - 1, uploaded_file.name, o, self.upload_checksum))
+
+        if bulk and saving:
+            try:
+                with self.time_phase('finalise'):
+                    self.model._default_manager.bulk_create([saved for index, name, saved, checksum in saving])
+            except Exception:
+                logger.exception('Saving a batch of %s files failed' % len(saving))
+                for index, expected_file_name, o, checksum in saving:
+                    # the content was stored before the instances, so it's orphaned now
+                    try:
+                        self.get_file_field(o).delete(save=False)
+                    except Exception:
+                        logger.exception('Deleting the content of %s failed' % expected_file_name)
+                    responses[index] = {'name': expected_file_name, 'error': 'ERROR SAVING FILE'}
+                return responses
+
+        for index, expected_file_name, o, checksum in saving:
+            if bulk:
+                self.post_save(o)
+            if self.file_stages:
+                self.get_finalisation_executor().submit(self._run_file_stages, o, expected_file_name)
+            self.object = o
+            self.upload_checksum = checksum
+            responses[index] = self.make_upload_response(expected_file_name)
+        return responses
+
+    def _scan_whole_file(self, uploaded_file):
+        """
+        Work out upload_checksum and upload_stage_results for a file uploaded whole as part of a batch, reading it once
+        for both.
         """
-        fs = self._temp_file_storage()
-        fs.delete(self._file_path(file_id))
+        self.upload_checksum = self.upload_stage_results = None
+        checksum = RunningChecksum(self.checksum_algorithm) if self.checksum_algorithm else None
+        pipeline = RunningPipeline(self.upload_stages) if self.upload_stages else None
+        streams = [stream for stream in (checksum, pipeline) if stream is not None]
+        if not streams:
+            return
+
+        for data in uploaded_file.chunks():
+            for stream in streams:
+                stream.update(data)
+        uploaded_file.seek(0)
+        if checksum is not None:
+            self.upload_checksum = checksum.hexdigest()
+        if pipeline is not None:
+            self.upload_stage_results = pipeline.finish()
+
+    def bulk_create_batches_supported(self):
+        """
+        Check whether the instances for a batch of files can be saved with bulk_create. It needs Django 1.4 or later,
+        and a model without multi-table inheritance. Saving this way doesn't call the model's save() method or send
+        its save signals, and on some databases the instances won't have their primary keys set afterwards, so it isn't
+        used when deduplicating or with file_stages, which need the saved instances.
+
+        @rtype: bool
+        """
+        return self.bulk_create_batches and hasattr(self.model._default_manager, 'bulk_create') and \
+            not self.model._meta.parents and not self.deduplication_supported() and not self.file_stages
 
-    def append_content_to_temp_file(self, file_id, file_contents):
+    def finalise_upload(self, expected_file_name, chunked_file, file_id):
         """
-        Append additional content to a temporary upload file (or create the file if it doesn't exist).
+        Turn a completely uploaded file into a saved instance of the model for this view, and tidy up after it.
 
+        @param expected_file_name: The name of the file that's been uploaded
+        @type expected_file_name: str
+        @param chunked_file: The content to save onto the object
+        @type chunked_file: File
         @param file_id: Unique ID of the uploaded file.
         @type file_id: str
-        @param file_contents: Contents to append to the temp file. If this is unicode, it's encoded in UTF-8.
-        @type file_contents: str or unicode
+        @return: Dictionary of useful information to return to the file upload widget, from make_upload_response
+        @rtype: dict
         """
-        if isinstance(file_contents, unicode):
-            file_contents = file_contents.encode('utf-8')
+        self.object = self.create_and_save_object(expected_file_name, chunked_file)
+        self._remove_temporary_file(file_id)
+        if self.file_stages:
+            self.get_finalisation_executor().submit(self._run_file_stages, self.object, expected_file_name)
+        return self.make_upload_response(expected_file_name)
 
-        fs = self._temp_file_storage()
-        with fs.open(self._file_path(file_id), 'ab+') as f:
-            f.write(file_contents)
+    def get_finalisation_executor(self):
+        """
+        Get the executor used to finalise uploads when finalise_asynchronously is set.
 
-    def _file_path(self, file_id):
-        return file_id
+        @return: finalisation_executor, or the thread pool shared across this process if that's not set.
+        """
+        if self.finalisation_executor is not None:
+            return self.finalisation_executor
+        return get_default_executor()
 
-    def _temp_file_storage(self):
-        location = safe_join(settings.MEDIA_ROOT, self.temp_file_folder)
-        return FileSystemStorage(location)
+    def get_job_status(self, job_id):
+        """
+        Get the status of a background finalisation job, kept in the default cache.
 
+        @param job_id: ID of the job, as returned when the upload was completed.
+        @type job_id: str
+        @return: Dictionary with the 'status' of the job (and 'files', once it's finished), or None if it's unknown.
+        @rtype: dict or None
+        """
+        return cache.get(self._job_status_key(job_id))
 
-class BaseUploadContentView(JSONResponseMixin, View):
-    model = None
-    temp_storage = None
-    file_field_name = None
-    uploaded_files_parameter = u'files'
+    def set_job_status(self, job_id, job_status):
+        """
+        Remember the status of a background finalisation job.
 
-    def post(self, request, **kwargs):
-        blob_file = request.FILES.get(self.uploaded_files_parameter, None)
-        blob_size = blob_file._get_size()
-        blob_name = blob_file.name
+        @param job_id: ID of the job
+        @type job_id: str
+        @param job_status: Dictionary with the 'status' of the job, and 'files' once it's finished.
+        @type job_status: dict
+        """
+        cache.set(self._job_status_key(job_id), job_status, self.job_status_timeout)
 
-        if self.partial_upload_supported():
-            #If files are chunked, the original file metadata is stored in extra META headers and the
-            #POSTed file is called 'blob'. For files that aren't chunked, use the POSTed file directly.
-            starting, ending, expected_byte_count = self._get_filesize_from_request_meta(request.META)
-            if not expected_byte_count:
-                expected_byte_count = blob_size
-            expected_file_name = self._get_filename_from_request_meta(request.META) or blob_name
-        else:
-            starting = 0
-            expected_byte_count = blob_size
-            expected_file_name = blob_name
+    def _finalise_in_background(self, job_id, expected_file_name, chunked_file, file_id):
+        try:
+            with self.time_phase('finalise'):
+                files = [self.finalise_upload(expected_file_name, chunked_file, file_id)]
+            self.set_job_status(job_id, {'status': 'done', 'files': files})
+        except Exception:
+            logger.exception('Background save of %s failed' % expected_file_name)
+            self.set_job_status(job_id, {'status': 'error', 'files': [
+                {'name': expected_file_name, 'error': 'ERROR SAVING FILE'}
+            ]})
+        finally:
+            # this thread's database connection isn't closed at the end of a request, so do it here
+            connection.close()
 
-        chunked_file, file_finalised, file_id, uploaded_bytes_count = \
-            self.handle_upload(blob_file, expected_file_name, expected_byte_count, starting)
+    def run_blocking(self, fn, *args, **kwargs):
+        """
+        Make a call that blocks on the disk or the database: writing a chunk to the temp storage, or finalising an
+        upload. Here it's just called, but CooperativeUploadMixin runs it on another thread.
 
-        if not file_finalised:
-            return self.render_to_response({'size': uploaded_bytes_count})
+        @param fn: The callable to run
+        @type fn: callable
+        @return: Whatever fn returns
+        """
+        return fn(*args, **kwargs)
 
+    def _run_file_stages(self, instance, expected_file_name):
         try:
-            self.object = self.create_and_save_object(expected_file_name, chunked_file)
-            self._remove_temporary_file(file_id)
-            return self.render_to_response({'files': [
-                self.make_upload_response(expected_file_name)
-            ]})
-        except Exception, e:
-            return self.render_to_response([{'name': expected_file_name, 'error': 'ERROR SAVING FILE'}])
+            file_field = self.get_file_field(instance)
+            results = {}
+            for stage_class in self.file_stages:
+                stage = stage_class()
+                try:
+                    results[stage.name] = stage.process(instance, file_field)
+                except Exception:
+                    logger.exception('File stage %s failed for %s' % (stage.name, expected_file_name))
+            if results:
+                self.store_file_stage_results(instance, expected_file_name, results)
+        finally:
+            # this thread's database connection isn't closed at the end of a request, so do it here
+            connection.close()
+
+    def _job_status_key(self, job_id):
+        return 'jquery_upload::job::%s' % job_id
 
     def handle_upload(self, uploaded_file, expected_file_name, expected_byte_count, starting_byte_index=None):
         """
@@ -144,28 +693,73 @@ class BaseUploadContentView(JSONResponseMixin, View):
         @return: An opened copy of the file if we're finished uploading it, a boolean to show if its been finished or
         not, the unique ID of the file, and a count of how much of the file has been uploaded so far
         @rtype: (File, bool, str, int)
+        @raise UploadExpired: If the upload is being resumed, but its temp file has been deleted.
         """
         # the file should be saved with a GUID name
         # we remember the guid name and size for a given uploaded file in the session
-
-        # we should check the request here - if the content-range is starting at zero, kill the old stored name
-        if (starting_byte_index == 0 or starting_byte_index is None) and self.partial_upload_supported():
-            self.forget_about_upload(expected_file_name)
-
-        existing_file_id = self.get_file_id(expected_file_name) if self.partial_upload_supported() else None
+        existing_file_id = None
+        if self.partial_upload_supported():
+            # we should check the request here - if the content-range is starting at zero, start again with a new ID
+            # (not for positional writes, where the first chunk can turn up after any of the others)
+            if (starting_byte_index == 0 or starting_byte_index is None) and not self.positional_writes:
+                existing_file_id = self.generate_file_id(expected_file_name, expected_byte_count)
+                self.restart_upload(expected_file_name, existing_file_id, expected_byte_count)
+                started = True
+            else:
+                existing_file_id = self.get_file_id(expected_file_name)
+                started = existing_file_id is None
+                if existing_file_id is None:
+                    # claim an ID before writing anything, so concurrent chunks of a new file agree on where it goes
+                    new_file_id = self.generate_file_id(expected_file_name, expected_byte_count)
+                    existing_file_id = self.claim_file_id(expected_file_name, new_file_id, expected_byte_count)
+                    started = existing_file_id == new_file_id
+                elif not self._same_byte_count(self.get_expected_byte_count(expected_file_name), expected_byte_count):
+                    # what we have is from an earlier upload of a file with this name, which the client has given up on
+                    stale_file_id = existing_file_id
+                    new_file_id = self.generate_file_id(expected_file_name, expected_byte_count)
+                    existing_file_id = self.replace_upload(expected_file_name, stale_file_id, new_file_id,
+                                                           expected_byte_count)
+                    started = existing_file_id == new_file_id
+                    if started:
+                        self._remove_temporary_file(stale_file_id)
+                elif self._temp_file_lost(existing_file_id, expected_byte_count):
+                    # reaped while the client was away, but we kept its progress, so it can't be carried on
+                    self.forget_about_upload(expected_file_name, existing_file_id)
+                    raise UploadExpired('The temp file for %s has gone' % expected_file_name)
+        else:
+            started = True
+        if started and self.metrics_sink is not None:
+            self.metrics_sink.count('uploads.started')
 
         chunked_file, file_id, file_finalised, uploaded_bytes_count = \
-            self._write_upload(uploaded_file, expected_file_name, expected_byte_count, existing_file_id)
-
-        if (not existing_file_id and file_id) and self.partial_upload_supported():
-            self.set_file_id(expected_file_name, file_id)
+            self._write_upload(uploaded_file, expected_file_name, expected_byte_count, existing_file_id,
+                               starting_byte_index)
 
         if file_finalised and self.partial_upload_supported():
             # Remove these bits from the session
             self.forget_about_upload(expected_file_name, file_id)
+        if file_finalised and self.metrics_sink is not None:
+            self.metrics_sink.count('uploads.finished')
 
         return chunked_file, file_finalised, file_id, uploaded_bytes_count
 
+    def _temp_file_lost(self, file_id, expected_byte_count):
+        """
+        Check whether an upload's temp file has gone though some of it was written, such as when the janitor reaped it.
+        Only if it's missing is the upload's progress looked at: concurrent chunks of a new file can arrive before it's
+        made, and once an upload has been finalised, its temp file has moved (and a late retry of one of its chunks may
+        have been counted since).
+        """
+        if self.temp_storage.temp_file_exists(file_id):
+            return False
+        if self.positional_writes:
+            ranges = self.get_uploaded_ranges(file_id)
+            return bool(ranges) and not (expected_byte_count and byte_ranges_cover(ranges, int(expected_byte_count))) \
+                and not self.finalisation_claimed(file_id)
+        uploaded_bytes_count = self.get_uploaded_bytes(file_id)
+        return bool(uploaded_bytes_count) and not (expected_byte_count and
+                                                   uploaded_bytes_count >= int(expected_byte_count))
+
     def make_upload_response(self, expected_file_name):
         """
         Get the data to be returned to the file uploaded, as a dictionary.
@@ -179,10 +773,13 @@ class BaseUploadContentView(JSONResponseMixin, View):
         @rtype: dict
         """
         file_field = self.get_file_field(self.object)
-        return {
+        upload_response = {
             'name': expected_file_name,
             'size': file_field.size,
         }
+        if self.upload_checksum is not None:
+            upload_response['checksum'] = self.upload_checksum
+        return upload_response
 
     def create_and_save_object(self, expected_file_name, chunked_file):
         """
@@ -197,16 +794,156 @@ class BaseUploadContentView(JSONResponseMixin, View):
         """
         o = self.create_new_instance()
         self.decorate_instance(o)
-
-        self.save_in_content(o, chunked_file, expected_file_name)
+        if self.upload_checksum is not None:
+            self.store_checksum(o, self.upload_checksum)
+        if self.upload_stage_results is not None:
+            self.store_stage_results(o, expected_file_name, self.upload_stage_results)
+
+        stored_name = None
+        if self.deduplication_supported():
+            stored_name = self.find_stored_content(self.upload_checksum, chunked_file.size)
+        if stored_name is not None:
+            self.save_stored_content(o, stored_name, expected_file_name)
+        else:
+            self.save_in_content(o, chunked_file, expected_file_name)
         chunked_file.close()
 
         self.pre_save(o)
         o.save()
         self.post_save(o)
 
+        if stored_name is None and self.deduplication_supported():
+            self.remember_stored_content(o, self.upload_checksum, chunked_file.size)
         return o
 
+    def handle_known_content(self, params):
+        """
+        Save a new instance of the model for a file that's already been uploaded, given only its checksum, size and
+        name, so the client doesn't have to send it again.
+
+        @param params: The request's POST, with the file's checksum, size, and name (in the file_parameter)
+        @type params: QueryDict
+        @return: The same response as for uploading the file, or a 404 if we don't have its content.
+        @rtype: HttpResponse
+        """
+        checksum = params.get(self.checksum_parameter, '').strip().lower()
+        expected_file_name = params.get(self.file_parameter, None)
+        stored_name = self.find_stored_content(checksum, params.get(self.size_parameter, None)) \
+            if checksum and expected_file_name else None
+        if stored_name is None:
+            return self.render_to_response({'checksum': checksum, 'error': 'UNKNOWN CONTENT'}, status=404)
+
+        self.upload_checksum = checksum
+        o = self.create_new_instance()
+        self.decorate_instance(o)
+        self.store_checksum(o, checksum)
+        self.save_stored_content(o, stored_name, expected_file_name)
+        self.pre_save(o)
+        o.save()
+        self.post_save(o)
+
+        self.object = o
+        return self.render_to_response({'files': [self.make_upload_response(expected_file_name)]})
+
+    def deduplication_supported(self):
+        """
+        Check whether repeated uploads are being deduplicated. It needs deduplicate_uploads, and a checksum_algorithm
+        from hashlib: crc32 and adler32 are too easily fooled to trust two files with the same one are the same.
+
+        @rtype: bool
+        """
+        return self.deduplicate_uploads and bool(self.checksum_algorithm) and \
+            self.checksum_algorithm not in ZLIB_CHECKSUMS
+
+    def known_content_supported(self):
+        """
+        Check whether clients may ask after content by its checksum, and save it without uploading it again. It needs
+        accept_known_content, and deduplication.
+
+        @rtype: bool
+        """
+        return self.accept_known_content and self.deduplication_supported()
+
+    def find_stored_content(self, checksum, byte_count):
+        """
+        Look for content we've already stored in this view's file field.
+
+        @param checksum: Checksum of the content, in checksum_algorithm, as lower case hex.
+        @type checksum: str
+        @param byte_count: Size of the content
+        @type byte_count: int or str
+        @return: The name of the content in the field's storage, or None if we haven't got it.
+        @rtype: str or None
+        """
+        try:
+            byte_count = int(byte_count)
+        except (TypeError, ValueError):
+            return None
+        stored = list(StoredContent.objects.filter(
+            checksum=checksum.strip().lower(), byte_count=byte_count, algorithm=self.checksum_algorithm,
+            model_name=self.model.__name__, field_name=self.file_field_name)[:1])
+        if not stored:
+            return None
+
+        storage = self.model._meta.get_field(self.file_field_name).storage
+        if not storage.exists(stored[0].storage_name):
+            # it's been deleted since, so the next upload of it gets stored again
+            stored[0].delete()
+            return None
+        return stored[0].storage_name
+
+    def remember_stored_content(self, instance, checksum, byte_count):
+        """
+        Add newly stored content to the index of content we have.
+
+        @param instance: A saved instance of the model for this view, with the content in its file field.
+        @type instance: Model
+        @param checksum: Checksum of the content, in checksum_algorithm, as lower case hex.
+        @type checksum: str
+        @param byte_count: Size of the content
+        @type byte_count: int
+        """
+        StoredContent.objects.get_or_create(
+            checksum=checksum, byte_count=byte_count, algorithm=self.checksum_algorithm,
+            model_name=self.model.__name__, field_name=self.file_field_name,
+            defaults={'storage_name': self.get_file_field(instance).name})
+
+    def save_stored_content(self, instance, stored_name, expected_file_name):
+        """
+        Put content we've already stored onto an instance of your model, without writing it again. With
+        deduplicate_with_hard_links and a storage on the local disk, it gets a name of its own, hard linked to the
+        stored file. Otherwise it shares the stored file's name.
+
+        @param instance: An instance of the model for this view
+        @type instance: Model
+        @param stored_name: Name of the content in the file field's storage, from find_stored_content
+        @type stored_name: str
+        @param expected_file_name: The name of the file we're attaching
+        @type expected_file_name: str
+        """
+        file_field = self.get_file_field(instance)
+        name = stored_name
+        link = getattr(os, 'link', None)
+        if self.deduplicate_with_hard_links and link is not None:
+            try:
+                source_path = file_field.storage.path(stored_name)
+            except NotImplementedError:
+                # not on the local disk
+                source_path = None
+            if source_path is not None:
+                link_name = file_field.storage.get_available_name(
+                    file_field.field.generate_filename(instance, expected_file_name))
+                link_path = file_field.storage.path(link_name)
+                try:
+                    if not os.path.isdir(os.path.dirname(link_path)):
+                        os.makedirs(os.path.dirname(link_path))
+                    link(source_path, link_path)
+                    name = link_name
+                except OSError, e:
+                    # another file took the name, or it's on a different device; share the stored file instead
+                    logger.debug('Hard linking %s to %s failed: %s', source_path, link_path, e)
+        setattr(instance, file_field.field.name, name)
+
     def create_new_instance(self):
         """
         Create a new initial instance of the model for this view.
@@ -225,6 +962,80 @@ class BaseUploadContentView(JSONResponseMixin, View):
         """
         pass
 
+    def store_checksum(self, instance, checksum):
+        """
+        Keep the checksum of the uploaded file on the model instance, before it is saved. By default it goes in the
+        checksum_field_name field, if there is one.
+
+        @param instance: An instance of the model for this view, not yet saved and with no attached file.
+        @type instance: Model
+        @param checksum: The checksum of the whole file, in lower case hex.
+        @type checksum: str
+        """
+        if self.checksum_field_name:
+            setattr(instance, self.checksum_field_name, checksum)
+
+    def store_stage_results(self, instance, expected_file_name, results):
+        """
+        Keep the results of the streaming upload_stages on the model instance, before it is saved. By default each goes
+        in the model field with the same name as its stage, if there is one. Files are saved into FileFields under the
+        upload's name plus the stage's file_suffix, and closed whether they're stored or not.
+
+        @param instance: An instance of the model for this view
+        @type instance: Model
+        @param expected_file_name: The name of the file that's been uploaded
+        @type expected_file_name: str
+        @param results: Each stage's result, by its name
+        @type results: dict
+        @return: Whether any of the results were stored
+        @rtype: bool
+        """
+        field_names = set(field.name for field in instance._meta.fields)
+        stages = dict((stage.name, stage) for stage in tuple(self.upload_stages) + tuple(self.file_stages))
+        stored = False
+        for name, result in results.items():
+            if name not in field_names:
+                if isinstance(result, File):
+                    result.close()
+                continue
+            if isinstance(instance._meta.get_field(name), FileField):
+                file_suffix = getattr(stages.get(name), 'file_suffix', '')
+                getattr(instance, name).save(expected_file_name + file_suffix, result, save=False)
+                result.close()
+            else:
+                setattr(instance, name, result)
+            stored = True
+        return stored
+
+    def store_file_stage_results(self, instance, expected_file_name, results):
+        """
+        Keep the results of the file_stages on the saved model instance. This runs on the finalisation executor. By
+        default they're stored as store_stage_results does, and the instance is saved again if any were.
+
+        @param instance: The saved instance of the model for the upload
+        @type instance: Model
+        @param expected_file_name: The name of the file that's been uploaded
+        @type expected_file_name: str
+        @param results: Each stage's result, by its name
+        @type results: dict
+        """
+        if self.store_stage_results(instance, expected_file_name, results):
+            instance.save()
+
+    def checksum_matches(self, meta):
+        """
+        Check the checksum of a completed upload against the one the client sent, if it sent one.
+
+        @param meta: request.META for the request that completed the upload
+        @type meta: dict
+        @return: False if the client's checksum doesn't match ours, otherwise True.
+        @rtype: bool
+        """
+        client_checksum = meta.get(self.checksum_meta_key, None)
+        if self.upload_checksum is None or not client_checksum:
+            return True
+        return client_checksum.strip().lower() == self.upload_checksum
+
     def get_file_field(self, instance):
         """
         Access the file field for the model being worked on.
@@ -284,48 +1095,52 @@ class BaseUploadContentView(JSONResponseMixin, View):
 
     def _get_filename_from_request_meta(self, meta):
         """
-        Shortcut method for splitting out the file name from request.META
+        Shortcut method for getting the file name from request.META
 
         @return: The name of the file being uploaded, taken from the Content-Disposition property, or None
         @rtype: str or None
         """
-        http_content_disposition = meta.get('HTTP_CONTENT_DISPOSITION', None)
-        if http_content_disposition:
-            filename = http_content_disposition.split("filename=")[1].replace('\"', '')
-            return filename
-        return None
+        return parse_content_disposition_filename(meta.get('HTTP_CONTENT_DISPOSITION', None))
+
+    def _get_upload_id_from_request_meta(self, meta):
+        """
+        Shortcut method for getting the client's upload ID from request.META
+
+        @return: The upload ID, or None if the client didn't send one
+        @rtype: str or None
+        @raise ValueError: If the upload ID is malformed
+        """
+        return parse_upload_id(meta.get(self.upload_id_meta_key, None))
 
     def _get_filesize_from_request_meta(self, meta):
         """
-        Shortcut method for splitting out the file size from request.META
+        Shortcut method for getting the file size from request.META
 
         @return: Tuple of the number of position in the byte stream we're starting at, ending at, and the total size
         @rtype: (int, int, int)
+        @raise ValueError: If the Content-Range is malformed
         """
-        http_content_range = meta.get('HTTP_CONTENT_RANGE', None)
-        if http_content_range:
-            preamble, expected_file_size = http_content_range.split('/')
-            starting, ending = preamble.lstrip('bytes ').split('-')
-            return int(starting), int(ending), int(expected_file_size)
-        return None, None, None
+        return parse_content_range(meta.get('HTTP_CONTENT_RANGE', None))
 
-    def _write_upload(self, uploaded_file, expected_file_name, expected_byte_count, file_id=None):
-        logger.warning('%s, size: %s, id:%s' % (expected_file_name, expected_byte_count, file_id))
+    def _write_upload(self, uploaded_file, expected_file_name, expected_byte_count, file_id=None,
+                      starting_byte_index=None):
+        logger.debug('%s, size: %s, id:%s', expected_file_name, expected_byte_count, file_id)
         if file_id is None:
             file_id = self.generate_file_id(expected_file_name, expected_byte_count)
-            logging.warning('Id for %s: %s' % (expected_file_name, file_id))
+            logger.debug('Id for %s: %s', expected_file_name, file_id)
 
-        self.temp_storage.append_content_to_temp_file(file_id, uploaded_file.read())
+        if self.positional_writes and self.partial_upload_supported():
+            return self._write_upload_at_offset(uploaded_file, expected_byte_count, file_id, starting_byte_index or 0)
+
+        checksum, pipeline = self._write_chunk(uploaded_file, file_id, starting_byte_index or 0)
 
         # How many bytes stored?
         these_bytes = uploaded_file.size
-        uploaded_bytes_count = self.get_uploaded_bytes(file_id) if self.partial_upload_supported() else 0
-        logger.warning('Uploaded so far for %s: %s' % (file_id, uploaded_bytes_count))
-        uploaded_bytes_count += these_bytes
-        logger.warning('Upload vs Expectation for %s: %s v %s' % (file_id, uploaded_bytes_count, expected_byte_count))
-
         if self.partial_upload_supported():
-            self.update_uploaded_bytes(file_id, uploaded_bytes_count)
+            uploaded_bytes_count = self.increment_uploaded_bytes(file_id, these_bytes)
+        else:
+            uploaded_bytes_count = these_bytes
+        logger.debug('Upload vs Expectation for %s: %s v %s', file_id, uploaded_bytes_count, expected_byte_count)
 
         if self.partial_upload_supported():
             finalised = False
@@ -335,13 +1150,150 @@ class BaseUploadContentView(JSONResponseMixin, View):
             finalised = True
 
         if finalised:
+            self._finish_streams(file_id, uploaded_bytes_count, checksum, pipeline)
+            return self.temp_storage.open_temp_file(file_id), file_id, finalised, uploaded_bytes_count
+
+        return None, file_id, finalised, uploaded_bytes_count
+
+    def _write_upload_at_offset(self, uploaded_file, expected_byte_count, file_id, starting_byte_index):
+        checksum, pipeline = self._write_chunk(uploaded_file, file_id, starting_byte_index, expected_byte_count)
+
+        ranges = self.add_uploaded_range(file_id, starting_byte_index, starting_byte_index + uploaded_file.size)
+        uploaded_bytes_count = sum(end - start for start, end in ranges)
+        logger.debug('Upload vs Expectation for %s: %s v %s', file_id, ranges, expected_byte_count)
+
+        finalised = expected_byte_count is not None and byte_ranges_cover(ranges, int(expected_byte_count)) \
+            and self.claim_finalisation(file_id)
+        if finalised:
+            self._finish_streams(file_id, int(expected_byte_count), checksum, pipeline)
             return self.temp_storage.open_temp_file(file_id), file_id, finalised, uploaded_bytes_count
 
         return None, file_id, finalised, uploaded_bytes_count
 
+    def _write_chunk(self, uploaded_file, file_id, starting_byte_index, expected_byte_count=None):
+        """
+        Write a chunk to the temp storage, at its offset for positional writes or on the end of the file otherwise.
+        If the chunk follows on from where the running checksum or the upload_stages have got to, it's added to them on
+        its way through.
+
+        @return: The running checksum and pipeline, each if this chunk was added to it.
+        @rtype: (RunningChecksum or None, RunningPipeline or None)
+        """
+        checksum = self._get_checksum_for_chunk(file_id, starting_byte_index)
+        pipeline = self._get_pipeline_for_chunk(file_id, starting_byte_index)
+        chunk_callback = _chain_callbacks([stream.update for stream in (checksum, pipeline) if stream is not None])
+        # a file read from the request as it's written can't be handed to another thread, as the request's socket can
+        # only be read where it belongs
+        run = _call if getattr(uploaded_file, 'reads_from_request', False) else self.run_blocking
+        try:
+            with self.time_phase('temp_write') as timer:
+                if self.positional_writes and self.partial_upload_supported() or \
+                        getattr(uploaded_file, 'write_at_offset', False):
+                    run(self.temp_storage.write_uploaded_file_to_temp_file, file_id, uploaded_file,
+                        starting_byte_index, expected_byte_count, chunk_callback=chunk_callback)
+                else:
+                    run(self.temp_storage.append_uploaded_file_to_temp_file, file_id, uploaded_file,
+                        chunk_callback=chunk_callback)
+        except Exception:
+            # they may have seen part of the chunk, so they can't be trusted any more
+            if checksum is not None:
+                forget_running_checksum(file_id)
+                checksum.lock.release()
+            if pipeline is not None:
+                forget_running_pipeline(file_id)
+                pipeline.close()
+                pipeline.lock.release()
+            raise
+
+        if checksum is not None:
+            keep_running_checksum(file_id, checksum)
+            checksum.lock.release()
+            if self._checksum_state_is_shared():
+                self.set_checksum_state(file_id, checksum.get_state())
+        if pipeline is not None:
+            keep_running_pipeline(file_id, pipeline)
+            pipeline.lock.release()
+
+        if self.metrics_sink is not None:
+            self.metrics_sink.count('chunk.bytes', uploaded_file.size)
+            self.metrics_sink.histogram('chunk.size', uploaded_file.size)
+            if timer.seconds:
+                self.metrics_sink.gauge('chunk.bytes_per_second', int(uploaded_file.size / timer.seconds))
+        return checksum, pipeline
+
+    def _get_checksum_for_chunk(self, file_id, starting_byte_index):
+        """
+        Get the running checksum for a file, locked, if a chunk starting at starting_byte_index follows on from it. If
+        it doesn't, the chunk is left out and read back from the temp file when the upload is finished.
+        """
+        if not self.checksum_algorithm:
+            return None
+        state = self.get_checksum_state(file_id) if self._checksum_state_is_shared() else None
+        return _lock_stream_at(get_running_checksum(self.checksum_algorithm, file_id, state), starting_byte_index)
+
+    def _get_pipeline_for_chunk(self, file_id, starting_byte_index):
+        """
+        Get the running upload_stages for a file, locked, if a chunk starting at starting_byte_index follows on from
+        them. If it doesn't, the chunk is left out and read back from the temp file when the upload is finished.
+        """
+        if not self.upload_stages:
+            return None
+        return _lock_stream_at(get_running_pipeline(self.upload_stages, file_id), starting_byte_index)
+
+    def _finish_streams(self, file_id, byte_count, checksum=None, pipeline=None):
+        """
+        Work out the checksum of a completed upload into upload_checksum, and the results of the upload_stages into
+        upload_stage_results. Only the bytes they didn't see as they were uploaded are read back from the temp file, in
+        one pass for both.
+        """
+        streams = []
+        if self.checksum_algorithm:
+            if checksum is None:
+                state = self.get_checksum_state(file_id) if self._checksum_state_is_shared() else None
+                checksum = get_running_checksum(self.checksum_algorithm, file_id, state)
+            streams.append(checksum)
+        if self.upload_stages:
+            if pipeline is None:
+                pipeline = get_running_pipeline(self.upload_stages, file_id)
+            streams.append(pipeline)
+        if not streams:
+            return
+
+        offset = min(stream.offset for stream in streams)
+        if offset < byte_count:
+            temp_file = self.temp_storage.open_temp_file(file_id)
+            try:
+                temp_file.seek(offset)
+                while offset < byte_count:
+                    data = temp_file.read(min(64 * 2 ** 10, byte_count - offset))
+                    if not data:
+                        break
+                    for stream in streams:
+                        if offset <= stream.offset < offset + len(data):
+                            stream.update(data[stream.offset - offset:])
+                    offset += len(data)
+            finally:
+                temp_file.close()
+
+        if checksum is not None:
+            forget_running_checksum(file_id)
+            self.upload_checksum = checksum.hexdigest()
+        if pipeline is not None:
+            forget_running_pipeline(file_id)
+            self.upload_stage_results = pipeline.finish()
+
+    def _checksum_state_is_shared(self):
+        # only zlib checksums can be carried between requests by the progress backend
+        return self.partial_upload_supported() and self.checksum_algorithm in ZLIB_CHECKSUMS
+
     def _remove_temporary_file(self, file_id):
         self.temp_storage.remove_temp_file(file_id)
 
+    def _same_byte_count(self, stored_byte_count, expected_byte_count):
+        if stored_byte_count is None or expected_byte_count is None:
+            return True
+        return int(stored_byte_count) == int(expected_byte_count)
+
     def partial_upload_supported(self):
         return False
 
@@ -368,26 +1320,93 @@ class BaseUploadContentView(JSONResponseMixin, View):
         """
         raise NotImplementedError()
 
-    def forget_about_upload(self, expected_file_name, file_id=None):
+    def claim_file_id(self, expected_file_name, file_id, expected_byte_count=None):
         """
-        Forget about what has been uploaded so far for a particular file. This is used when we're either finished
-        uploading a file, or when we're starting from scratch with a file we tried to upload earlier.
+        Remember the unique file ID for a new file being uploaded, unless another request got there first.
+
+        The default just calls set_file_id, so it's only safe for one request at a time. Override it with an atomic
+        version when chunks for the same file can arrive concurrently.
 
         @param expected_file_name: The name of the file being uploaded.
         @type expected_file_name: str
-        @param file_id: Optional, unique ID of the file being uploaded. If you don't provide this, we try to fetch it.
+        @param file_id: Unique ID we'd like to use for the file
         @type file_id: str
+        @param expected_byte_count: Optional, the final size of the file.
+        @type expected_byte_count: int
+        @return: The unique ID that won, which is the one to write the upload to.
+        @rtype: str
         """
-        raise NotImplementedError()
+        self.set_file_id(expected_file_name, file_id)
+        return file_id
 
-    def get_uploaded_bytes(self, file_id):
+    def restart_upload(self, expected_file_name, file_id, expected_byte_count=None):
         """
-        For the given file ID, tell us how many bytes have been uploaded so far. If we don't know, the answer is zero.
+        Start remembering an upload from scratch under a new file ID, forgetting anything we remembered about an earlier
+        upload with the same name.
 
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
         @param file_id: Unique ID of the file being uploaded
         @type file_id: str
-        @return: Number of bytes uploaded so far, or zero if we don't know.
-        @rtype: int
+        @param expected_byte_count: Optional, the final size of the file.
+        @type expected_byte_count: int
+        """
+        self.forget_about_upload(expected_file_name)
+        self.set_file_id(expected_file_name, file_id)
+
+    def replace_upload(self, expected_file_name, stale_file_id, file_id, expected_byte_count=None):
+        """
+        Start an upload from scratch under a new file ID in place of an earlier, abandoned upload of a file with the
+        same name, unless another request already has.
+
+        The default just calls restart_upload, so it's only safe for one request at a time. Override it with an atomic
+        version when chunks for the same file can arrive concurrently.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @param stale_file_id: Unique ID of the abandoned upload
+        @type stale_file_id: str
+        @param file_id: Unique ID we'd like to use for the file
+        @type file_id: str
+        @param expected_byte_count: Optional, the final size of the file.
+        @type expected_byte_count: int
+        @return: The unique ID that won, which is the one to write the upload to.
+        @rtype: str
+        """
+        self.restart_upload(expected_file_name, file_id, expected_byte_count)
+        return file_id
+
+    def get_expected_byte_count(self, expected_file_name):
+        """
+        Get the final size of a file we were uploading earlier, as given when its upload started.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @return: Final size of the file, or None if we don't know it.
+        @rtype: int or None
+        """
+        return None
+
+    def forget_about_upload(self, expected_file_name, file_id=None):
+        """
+        Forget about what has been uploaded so far for a particular file. This is used when we're either finished
+        uploading a file, or when we're starting from scratch with a file we tried to upload earlier.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @param file_id: Optional, unique ID of the file being uploaded. If you don't provide this, we try to fetch it.
+        @type file_id: str
+        """
+        raise NotImplementedError()
+
+    def get_uploaded_bytes(self, file_id):
+        """
+        For the given file ID, tell us how many bytes have been uploaded so far. If we don't know, the answer is zero.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @return: Number of bytes uploaded so far, or zero if we don't know.
+        @rtype: int
         """
         raise NotImplementedError()
 
@@ -402,15 +1421,191 @@ class BaseUploadContentView(JSONResponseMixin, View):
         """
         raise NotImplementedError()
 
+    def increment_uploaded_bytes(self, file_id, count):
+        """
+        Add to the number of bytes uploaded so far for a given file ID.
+
+        The default reads and then updates the total, so it's only safe for one request at a time. Override it with an
+        atomic version when chunks for the same file can arrive concurrently.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param count: Number of bytes just uploaded.
+        @type count: int
+        @return: Number of bytes uploaded so far, including these.
+        @rtype: int
+        """
+        uploaded_bytes_count = self.get_uploaded_bytes(file_id) + count
+        self.update_uploaded_bytes(file_id, uploaded_bytes_count)
+        return uploaded_bytes_count
+
+    def claim_finalisation(self, file_id):
+        """
+        Claim the job of finalising a file whose byte ranges are all written, when using positional writes. Only one
+        request should get True for each file ID.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @rtype: bool
+        """
+        return True
+
+    def finalisation_claimed(self, file_id):
+        """
+        Check whether a request has claimed the job of finalising a file, when using positional writes.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @rtype: bool
+        """
+        return False
+
+    def get_uploaded_ranges(self, file_id):
+        """
+        For the given file ID, tell us which byte ranges have been written so far, when using positional writes. If we
+        don't know, the answer is no ranges.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @return: Sorted, non-overlapping (start, end) pairs of the bytes written so far.
+        @rtype: list
+        """
+        raise NotImplementedError()
+
+    def get_checksum_state(self, file_id):
+        """
+        For the given file ID, get the saved state of its running checksum, when checksumming with crc32 or adler32.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @return: The state from RunningChecksum.get_state, or None if we don't have one.
+        @rtype: tuple or None
+        """
+        raise NotImplementedError()
+
+    def set_checksum_state(self, file_id, state):
+        """
+        Remember the state of the running checksum for a given file ID.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param state: The state from RunningChecksum.get_state
+        @type state: tuple
+        """
+        raise NotImplementedError()
+
+    def add_uploaded_range(self, file_id, start, end):
+        """
+        Remember that another byte range of a given file ID has been written, when using positional writes.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param start: First byte written
+        @type start: int
+        @param end: One past the last byte written
+        @type end: int
+        @return: Sorted, non-overlapping (start, end) pairs of the bytes written so far, including this range.
+        @rtype: list
+        """
+        raise NotImplementedError()
+
+
+class CooperativeUploadMixin(object):
+    """
+    Mixin for BaseUploadView when it's served by gevent (such as with gunicorn -k gevent), so thousands of slow clients
+    can upload at once on a few processes, rather than each holding a worker thread for the whole of its upload.
+
+    Each request is then a greenlet. Reading the request body already gives way to other requests while it waits on the
+    client, as Django reads and parses it a piece at a time, and so do cache calls over monkey patched sockets. Writing
+    to the disk and saving to the database don't, so this mixin runs those on the gevent hub's pool of real threads.
+    The exception is a file sent as the whole request body (raw_body_uploads): it's read from the request's socket as
+    it's written, and a gevent socket can only be used on its own hub's thread, so its temp file writes stay on the
+    request's greenlet.
+    Anything they lock must use real locks, not gevent's monkey patched ones, which don't work across threads:
+    UploadTempStorageFileSystem is fine, UploadTempStoragePreallocated isn't.
+    """
+
+    # Anything with the apply(func, args, kwds) method of gevent's ThreadPool. Defaults to the gevent hub's threadpool.
+    blocking_threadpool = None
+
+    def run_blocking(self, fn, *args, **kwargs):
+        """
+        Make a call that blocks on the disk or the database on the blocking_threadpool, letting other requests carry on
+        until it's done. Without gevent, it's just called.
+
+        @param fn: The callable to run
+        @type fn: callable
+        @return: Whatever fn returns
+        """
+        threadpool = self.get_blocking_threadpool()
+        if threadpool is None:
+            return fn(*args, **kwargs)
+        return threadpool.apply(self._run_on_thread, (fn, args, kwargs))
+
+    def get_blocking_threadpool(self):
+        """
+        @return: blocking_threadpool, or the gevent hub's threadpool if that's not set, or None without gevent.
+        """
+        if self.blocking_threadpool is not None:
+            return self.blocking_threadpool
+        try:
+            import gevent
+        except ImportError:
+            return None
+        return gevent.get_hub().threadpool
+
+    def _run_on_thread(self, fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # the pool's threads don't close their database connections at the end of a request, so do it here
+            connection.close()
+
 
 class PartialUploadCacheMixin(object):
     """
     Mixin for BaseUploadView to support partial uploads with Django cache and session key.
+
+    Everything we know about an upload (its file_id, name and expected_byte_count) is kept as one record under a single
+    key, fetched at most once per request, with the byte count alongside it under a key that can be incremented. A
+    chunk in the middle of an upload costs one cache read and one write. The number of cache operations a request made
+    is kept in cache_round_trips.
     """
 
+    # Seconds before a lock on an upload's progress is given up as abandoned
+    progress_lock_timeout = 10
+    # Seconds to remember an upload's progress for, or None for the cache's default timeout. Temp files shouldn't be
+    # cleaned up (see TempFileJanitor) until this long after they were last written to.
+    progress_timeout = None
+    cache_round_trips = 0
+    # seconds spent waiting on the cache, only added up when the view's metrics_sink is set
+    cache_seconds = 0
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super(PartialUploadCacheMixin, self).dispatch(request, *args, **kwargs)
+        logger.debug('Cache round trips for %s: %s', request.path, self.cache_round_trips)
+        if self.metrics_sink is not None:
+            self.metrics_sink.timing('phase.cache', self.cache_seconds)
+            self.metrics_sink.count('cache.round_trips', self.cache_round_trips)
+        return response
+
     def partial_upload_supported(self):
         return True
 
+    def get_upload_record(self, expected_file_name):
+        """
+        Get everything we know about a file being uploaded.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @return: Dictionary with the file_id, name and expected_byte_count of the upload, or None if we don't know it.
+        @rtype: dict or None
+        """
+        records = self._upload_records()
+        if expected_file_name not in records:
+            records[expected_file_name] = self._get_key(self._stored_name_key(expected_file_name))
+        return records[expected_file_name]
+
     def get_file_id(self, expected_file_name):
         """
         Get the unique file ID for a file we were uploading earlier. If we don't know the ID (such as when this is a new
@@ -421,10 +1616,8 @@ class PartialUploadCacheMixin(object):
         @return: Unique ID of the file being uploaded, or None if we don't have an ID for it yet.
         @rtype: str or None
         """
-        stored_name_key = self._stored_name_key(expected_file_name)
-        stored_id = self._get_key(stored_name_key)
-        logger.warning('ID for %s is %s' % (stored_name_key, stored_id))
-        return stored_id
+        record = self.get_upload_record(expected_file_name)
+        return record['file_id'] if record else None
 
     def set_file_id(self, expected_file_name, file_id):
         """
@@ -435,7 +1628,93 @@ class PartialUploadCacheMixin(object):
         @param file_id: Unique ID of the file being uploaded
         @type file_id: str
         """
-        return self._store_key(self._stored_name_key(expected_file_name), file_id)
+        record = self._make_upload_record(expected_file_name, file_id)
+        self._store_key(self._stored_name_key(expected_file_name), record)
+
+    def claim_file_id(self, expected_file_name, file_id, expected_byte_count=None):
+        """
+        Remember the unique file ID for a new file being uploaded, unless another request got there first.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @param file_id: Unique ID we'd like to use for the file
+        @type file_id: str
+        @param expected_byte_count: Optional, the final size of the file.
+        @type expected_byte_count: int
+        @return: The unique ID that won, which is the one to write the upload to.
+        @rtype: str
+        """
+        stored_name_key = self._stored_name_key(expected_file_name)
+        record = self._make_upload_record(expected_file_name, file_id, expected_byte_count)
+        while True:
+            if self._add_key(stored_name_key, record):
+                return file_id
+            self._upload_records().pop(expected_file_name, None)
+            stored_id = self.get_file_id(expected_file_name)
+            if stored_id is not None:
+                return stored_id
+            # the other claim was forgotten before we could read it, so try again
+
+    def restart_upload(self, expected_file_name, file_id, expected_byte_count=None):
+        """
+        Start remembering an upload from scratch under a new file ID, replacing anything we remembered about an earlier
+        upload with the same name. The record and a zeroed byte count are written together; the old file ID's byte
+        count is left to expire.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param expected_byte_count: Optional, the final size of the file.
+        @type expected_byte_count: int
+        """
+        record = self._make_upload_record(expected_file_name, file_id, expected_byte_count)
+        self._store_keys({
+            self._stored_name_key(expected_file_name): record,
+            self._byte_count_key(file_id): 0,
+        })
+
+    def replace_upload(self, expected_file_name, stale_file_id, file_id, expected_byte_count=None):
+        """
+        Start an upload from scratch under a new file ID in place of an earlier, abandoned upload of a file with the
+        same name, unless another request already has. The record is checked and replaced under the abandoned upload's
+        progress lock, so concurrent chunks agree on the new file ID.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @param stale_file_id: Unique ID of the abandoned upload
+        @type stale_file_id: str
+        @param file_id: Unique ID we'd like to use for the file
+        @type file_id: str
+        @param expected_byte_count: Optional, the final size of the file.
+        @type expected_byte_count: int
+        @return: The unique ID that won, which is the one to write the upload to.
+        @rtype: str
+        """
+        with self._progress_lock(stale_file_id):
+            self._upload_records().pop(expected_file_name, None)
+            stored_id = self.get_file_id(expected_file_name)
+            if stored_id is None:
+                return self.claim_file_id(expected_file_name, file_id, expected_byte_count)
+            if stored_id != stale_file_id:
+                # another chunk of this upload replaced it first
+                return stored_id
+            self.restart_upload(expected_file_name, file_id, expected_byte_count)
+        self._drop_keys([self._byte_count_key(stale_file_id), self._byte_ranges_key(stale_file_id),
+                         self._checksum_key(stale_file_id)])
+        return file_id
+
+    def get_expected_byte_count(self, expected_file_name):
+        """
+        Get the final size of a file we were uploading earlier, as given when its upload started.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @return: Final size of the file, or None if we don't know it.
+        @rtype: int or None
+        """
+        record = self.get_upload_record(expected_file_name)
+        return record.get('expected_byte_count') if record else None
 
     def forget_about_upload(self, expected_file_name, file_id=None):
         """
@@ -450,9 +1729,12 @@ class PartialUploadCacheMixin(object):
         if file_id is None:
             # try and get id so we can delete byte count
             file_id = self.get_file_id(expected_file_name)
-        self._drop_key(self._stored_name_key(expected_file_name))
+        keys = [self._stored_name_key(expected_file_name)]
         if file_id is not None:
-            self._drop_key(self._byte_count_key(file_id))
+            # the finalised key is left to expire, so a late retry of a chunk can't claim finalisation a second time
+            keys += [self._byte_count_key(file_id), self._byte_ranges_key(file_id), self._checksum_key(file_id)]
+        self._drop_keys(keys)
+        self._upload_records()[expected_file_name] = None
 
     def get_uploaded_bytes(self, file_id):
         """
@@ -476,24 +1758,206 @@ class PartialUploadCacheMixin(object):
         """
         self._store_key(self._byte_count_key(file_id), count)
 
+    def increment_uploaded_bytes(self, file_id, count):
+        """
+        Add to the number of bytes uploaded so far for a given file ID.
+
+        Caches with a native incr (like memcached) do this without locking. Other backends only emulate incr with a
+        get and a set, so the total is updated under a lock instead.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param count: Number of bytes just uploaded.
+        @type count: int
+        @return: Number of bytes uploaded so far, including these.
+        @rtype: int
+        """
+        byte_count_key = self._byte_count_key(file_id)
+        if not _cache_has_atomic_incr():
+            with self._progress_lock(file_id):
+                uploaded_bytes_count = self.get_uploaded_bytes(file_id) + count
+                self.update_uploaded_bytes(file_id, uploaded_bytes_count)
+                return uploaded_bytes_count
+
+        while True:
+            try:
+                return self._incr_key(byte_count_key, count)
+            except ValueError:
+                # first chunk for this file
+                if self._add_key(byte_count_key, count):
+                    return count
+
+    def claim_finalisation(self, file_id):
+        """
+        Claim the job of finalising a file whose byte ranges are all written, when using positional writes. Only one
+        request should get True for each file ID.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @rtype: bool
+        """
+        return self._add_key(self._finalised_key(file_id), True)
+
+    def finalisation_claimed(self, file_id):
+        """
+        Check whether a request has claimed the job of finalising a file, when using positional writes.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @rtype: bool
+        """
+        return bool(self._get_key(self._finalised_key(file_id)))
+
+    def get_uploaded_ranges(self, file_id):
+        """
+        For the given file ID, tell us which byte ranges have been written so far, when using positional writes. If we
+        don't know, the answer is no ranges.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @return: Sorted, non-overlapping (start, end) pairs of the bytes written so far.
+        @rtype: list
+        """
+        return self._get_key(self._byte_ranges_key(file_id), [])
+
+    def add_uploaded_range(self, file_id, start, end):
+        """
+        Remember that another byte range of a given file ID has been written, when using positional writes.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param start: First byte written
+        @type start: int
+        @param end: One past the last byte written
+        @type end: int
+        @return: Sorted, non-overlapping (start, end) pairs of the bytes written so far, including this range.
+        @rtype: list
+        """
+        with self._progress_lock(file_id):
+            ranges = merge_byte_range(self.get_uploaded_ranges(file_id), start, end)
+            self._store_key(self._byte_ranges_key(file_id), ranges)
+        return ranges
+
+    def get_checksum_state(self, file_id):
+        """
+        For the given file ID, get the saved state of its running checksum, when checksumming with crc32 or adler32.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @return: The state from RunningChecksum.get_state, or None if we don't have one.
+        @rtype: tuple or None
+        """
+        return self._get_key(self._checksum_key(file_id))
+
+    def set_checksum_state(self, file_id, state):
+        """
+        Remember the state of the running checksum for a given file ID.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param state: The state from RunningChecksum.get_state
+        @type state: tuple
+        """
+        self._store_key(self._checksum_key(file_id), state)
+
     def _stored_name_key(self, expected_file_name):
-        return self._key_sanitise('%s::%s::%s::file_id' % (self.request.session.session_key, self.model.__name__, expected_file_name))
+        if self.upload_id:
+            return self._progress_key(self.model.__name__, expected_file_name, self.upload_id, 'file_id')
+        return self._progress_key(self.model.__name__, expected_file_name, 'file_id')
+
+    def _make_upload_record(self, expected_file_name, file_id, expected_byte_count=None):
+        record = {'file_id': file_id, 'name': expected_file_name, 'expected_byte_count': expected_byte_count}
+        self._upload_records()[expected_file_name] = record
+        return record
+
+    def _upload_records(self):
+        # upload records we've already read or written during this request
+        if not hasattr(self, '_upload_record_cache'):
+            self._upload_record_cache = {}
+        return self._upload_record_cache
+
+    def _cache(self, operation, *args):
+        self.cache_round_trips += 1
+        if self.metrics_sink is None:
+            return getattr(cache, operation)(*args)
+        started = time.time()
+        try:
+            return getattr(cache, operation)(*args)
+        finally:
+            self.cache_seconds += time.time() - started
 
     def _store_key(self, key, value):
-        cache.set(key, value)
+        self._cache('set', key, value, self.progress_timeout)
+
+    def _store_keys(self, data):
+        self._cache('set_many', data, self.progress_timeout)
+
+    def _add_key(self, key, value, timeout=None):
+        return self._cache('add', key, value, timeout or self.progress_timeout)
+
+    def _incr_key(self, key, delta):
+        return self._cache('incr', key, delta)
 
     def _get_key(self, key, default=None):
-        return cache.get(key, default)
+        return self._cache('get', key, default)
 
     def _drop_key(self, key):
+        self._drop_keys([key])
+
+    def _drop_keys(self, keys):
         try:
-            cache.delete(key)
+            self._cache('delete_many', keys)
         except KeyError:
             # ignore, key was never there
             pass
 
     def _byte_count_key(self, file_id):
-        return self._key_sanitise('%s::%s::uploaded_byte_count' % (self.request.session.session_key, file_id))
+        return self._progress_key(file_id, 'uploaded_byte_count')
+
+    def _byte_ranges_key(self, file_id):
+        return self._progress_key(file_id, 'uploaded_byte_ranges')
+
+    def _checksum_key(self, file_id):
+        return self._progress_key(file_id, 'checksum')
+
+    def _finalised_key(self, file_id):
+        return self._progress_key(file_id, 'finalised')
+
+    def _lock_key(self, file_id):
+        return self._progress_key(file_id, 'lock')
+
+    @contextmanager
+    def _progress_lock(self, file_id):
+        """
+        Hold a lock on the progress of a file ID while we read and update it. It's held with cache.add, so the lock
+        works across processes, and expires after progress_lock_timeout seconds in case the holder dies.
+        """
+        lock_key = self._lock_key(file_id)
+        delay = 0.001
+        while not self._add_key(lock_key, True, self.progress_lock_timeout):
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        try:
+            yield
+        finally:
+            self._drop_key(lock_key)
+
+    def _progress_key(self, *parts):
+        """
+        Build the cache key for part of an upload's progress, in this session. Keys are remembered, as every chunk of an
+        upload needs the same ones.
+        """
+        key_parts = (self.request.session.session_key,) + parts
+        memo_key = (type(self),) + key_parts
+        try:
+            return _progress_keys[memo_key]
+        except KeyError:
+            pass
+        key = self._key_sanitise('::'.join(['%s' % part for part in key_parts]))
+        if len(_progress_keys) >= MAX_PROGRESS_KEYS:
+            _progress_keys.clear()
+        _progress_keys[memo_key] = key
+        return key
 
     def _key_sanitise(self, key):
         """
@@ -504,4 +1968,433 @@ class PartialUploadCacheMixin(object):
         @return: Corrected key string
         @rtype: str
         """
-        return key.replace(' ', ':')
\ No newline at end of file
+        return key.replace(' ', ':')
+
+
+class PartialUploadDatabaseMixin(object):
+    """
+    Mixin for BaseUploadView to support partial uploads, keeping their progress in the database rather than the cache,
+    so it survives cache evictions, flushes and restarts. Add jquery_upload to INSTALLED_APPS for its UploadProgress
+    table.
+
+    Each upload is one row, looked up by session key, model and file name, which are indexed together. The row is read
+    at most once per request. Changes to it are buffered and written back in a single UPDATE at the end of the request,
+    so a chunk in the middle of an upload costs one SELECT and one UPDATE. Claiming a file ID, merging positional byte
+    ranges and claiming finalisation can't wait, so they're written straight away, and are atomic. The number of
+    queries a request made is kept in progress_queries.
+    """
+
+    progress_queries = 0
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super(PartialUploadDatabaseMixin, self).dispatch(request, *args, **kwargs)
+        finally:
+            self.flush_upload_progress()
+            logger.debug('Progress queries for %s: %s', request.path, self.progress_queries)
+            if self.metrics_sink is not None:
+                self.metrics_sink.count('progress.queries', self.progress_queries)
+
+    def partial_upload_supported(self):
+        return True
+
+    def get_upload_record(self, expected_file_name):
+        """
+        Get everything we know about a file being uploaded, including any changes not yet written back.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @return: Dictionary of the UploadProgress fields for the upload, or None if we don't know it.
+        @rtype: dict or None
+        """
+        records = self._progress_records()
+        if expected_file_name not in records:
+            records[expected_file_name] = self._fetch_progress(file_name=expected_file_name)
+        return records[expected_file_name]
+
+    def get_file_id(self, expected_file_name):
+        """
+        Get the unique file ID for a file we were uploading earlier. If we don't know the ID (such as when this is a new
+        file), then return None.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @return: Unique ID of the file being uploaded, or None if we don't have an ID for it yet.
+        @rtype: str or None
+        """
+        record = self.get_upload_record(expected_file_name)
+        return record['file_id'] if record else None
+
+    def set_file_id(self, expected_file_name, file_id):
+        """
+        Remember the unique file ID for a file being/been uploaded. A new file ID starts its progress from scratch.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        """
+        record = self.get_upload_record(expected_file_name)
+        if record is None or record['file_id'] != file_id:
+            self.restart_upload(expected_file_name, file_id)
+
+    def claim_file_id(self, expected_file_name, file_id, expected_byte_count=None):
+        """
+        Remember the unique file ID for a new file being uploaded, unless another request got there first.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @param file_id: Unique ID we'd like to use for the file
+        @type file_id: str
+        @param expected_byte_count: Optional, the final size of the file.
+        @type expected_byte_count: int
+        @return: The unique ID that won, which is the one to write the upload to.
+        @rtype: str
+        """
+        self.progress_queries += 1
+        progress, created = UploadProgress.objects.get_or_create(
+            defaults={'file_id': file_id, 'expected_byte_count': expected_byte_count},
+            **self._progress_lookup(file_name=expected_file_name))
+        self._progress_records()[expected_file_name] = self._make_progress_record(progress)
+        return progress.file_id
+
+    def restart_upload(self, expected_file_name, file_id, expected_byte_count=None):
+        """
+        Start remembering an upload from scratch under a new file ID, replacing anything we remembered about an earlier
+        upload with the same name. This is written back at the end of the request.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param expected_byte_count: Optional, the final size of the file.
+        @type expected_byte_count: int
+        """
+        self._make_new_progress_record(expected_file_name, file_id, expected_byte_count)
+        self._pending_progress()[expected_file_name] = {'restart': True}
+
+    def replace_upload(self, expected_file_name, stale_file_id, file_id, expected_byte_count=None):
+        """
+        Start an upload from scratch under a new file ID in place of an earlier, abandoned upload of a file with the
+        same name, unless another request already has. The row is replaced with an UPDATE conditional on it still
+        having the abandoned upload's file ID, so concurrent chunks agree on the new file ID.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @param stale_file_id: Unique ID of the abandoned upload
+        @type stale_file_id: str
+        @param file_id: Unique ID we'd like to use for the file
+        @type file_id: str
+        @param expected_byte_count: Optional, the final size of the file.
+        @type expected_byte_count: int
+        @return: The unique ID that won, which is the one to write the upload to.
+        @rtype: str
+        """
+        self._pending_progress().pop(expected_file_name, None)
+        record = self._make_new_progress_record(expected_file_name, file_id, expected_byte_count)
+        self.progress_queries += 1
+        replaced = UploadProgress.objects.filter(**self._progress_lookup(
+            file_name=expected_file_name, file_id=stale_file_id)).update(**self._progress_fields(record))
+        if not replaced:
+            # another chunk of this upload replaced it first, or it was forgotten
+            self._progress_records().pop(expected_file_name, None)
+            stored_id = self.get_file_id(expected_file_name)
+            if stored_id is not None:
+                return stored_id
+            return self.claim_file_id(expected_file_name, file_id, expected_byte_count)
+        return file_id
+
+    def get_expected_byte_count(self, expected_file_name):
+        """
+        Get the final size of a file we were uploading earlier, as given when its upload started.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @return: Final size of the file, or None if we don't know it.
+        @rtype: int or None
+        """
+        record = self.get_upload_record(expected_file_name)
+        return record['expected_byte_count'] if record else None
+
+    def forget_about_upload(self, expected_file_name, file_id=None):
+        """
+        Forget about what has been uploaded so far for a particular file. This is used when we're either finished
+        uploading a file, or when we're starting from scratch with a file we tried to upload earlier.
+
+        @param expected_file_name: The name of the file being uploaded.
+        @type expected_file_name: str
+        @param file_id: Optional, unique ID of the file being uploaded. It isn't needed to find the upload.
+        @type file_id: str
+        """
+        self._pending_progress().pop(expected_file_name, None)
+        self._progress_records()[expected_file_name] = None
+        self.progress_queries += 1
+        UploadProgress.objects.filter(**self._progress_lookup(file_name=expected_file_name)).delete()
+
+    def get_uploaded_bytes(self, file_id):
+        """
+        For the given file ID, tell us how many bytes have been uploaded so far. If we don't know, the answer is zero.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @return: Number of bytes uploaded so far, or zero if we don't know.
+        @rtype: int
+        """
+        record = self._record_for_file_id(file_id)
+        return record['uploaded_byte_count'] if record else 0
+
+    def update_uploaded_bytes(self, file_id, count):
+        """
+        Remember how many bytes have been uploaded so far for a given file ID. This is written back at the end of the
+        request.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param count: Number of bytes uploaded so far.
+        @type count: int
+        """
+        record = self._record_for_file_id(file_id)
+        if record is not None:
+            record['uploaded_byte_count'] = count
+            pending = self._pending_for(record)
+            pending['uploaded_byte_count'] = True
+            pending.pop('increment', None)
+
+    def increment_uploaded_bytes(self, file_id, count):
+        """
+        Add to the number of bytes uploaded so far for a given file ID.
+
+        The addition is written back at the end of the request as an atomic F() update, so no count is ever lost. The
+        total returned is the one read at the start of the request plus this chunk, which is right as long as chunks
+        of a file come one at a time, as they do without positional writes.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param count: Number of bytes just uploaded.
+        @type count: int
+        @return: Number of bytes uploaded so far, including these.
+        @rtype: int
+        """
+        record = self._record_for_file_id(file_id)
+        if record is None:
+            return count
+        record['uploaded_byte_count'] += count
+        pending = self._pending_for(record)
+        if 'uploaded_byte_count' not in pending:
+            pending['increment'] = pending.get('increment', 0) + count
+        return record['uploaded_byte_count']
+
+    def claim_finalisation(self, file_id):
+        """
+        Claim the job of finalising a file whose byte ranges are all written, when using positional writes. Only one
+        request gets True for each file ID.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @rtype: bool
+        """
+        self.progress_queries += 1
+        return UploadProgress.objects.filter(finalised=False, **self._progress_lookup(file_id=file_id)).update(
+            finalised=True, updated=datetime.now()) == 1
+
+    def finalisation_claimed(self, file_id):
+        """
+        Check whether a request has claimed the job of finalising a file, when using positional writes.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @rtype: bool
+        """
+        self.progress_queries += 1
+        return UploadProgress.objects.filter(finalised=True, **self._progress_lookup(file_id=file_id)).exists()
+
+    def get_uploaded_ranges(self, file_id):
+        """
+        For the given file ID, tell us which byte ranges have been written so far, when using positional writes. If we
+        don't know, the answer is no ranges.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @return: Sorted, non-overlapping (start, end) pairs of the bytes written so far.
+        @rtype: list
+        """
+        record = self._record_for_file_id(file_id)
+        return [tuple(r) for r in record['uploaded_byte_ranges']] if record else []
+
+    def add_uploaded_range(self, file_id, start, end):
+        """
+        Remember that another byte range of a given file ID has been written, when using positional writes. The ranges
+        are updated with a compare-and-set on the row's version, trying again with fresh ranges if another chunk
+        changed them first.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param start: First byte written
+        @type start: int
+        @param end: One past the last byte written
+        @type end: int
+        @return: Sorted, non-overlapping (start, end) pairs of the bytes written so far, including this range.
+        @rtype: list
+        """
+        record = self._record_for_file_id(file_id)
+        if record is not None and self._pending_progress().get(record['file_name'], {}).get('restart'):
+            # the row isn't there to compare against until the restart is written
+            self.flush_upload_progress()
+        while record is not None:
+            ranges = merge_byte_range(record['uploaded_byte_ranges'], start, end)
+            self.progress_queries += 1
+            updated = UploadProgress.objects.filter(version=record['version'], **self._progress_lookup(
+                file_id=file_id)).update(uploaded_byte_ranges=json.dumps(ranges), version=F('version') + 1,
+                                         updated=datetime.now())
+            if updated:
+                record['uploaded_byte_ranges'] = ranges
+                record['version'] += 1
+                return ranges
+            record = self._fetch_progress(file_id=file_id)
+            if record is not None:
+                self._progress_records()[record['file_name']] = record
+        return merge_byte_range([], start, end)
+
+    def get_checksum_state(self, file_id):
+        """
+        For the given file ID, get the saved state of its running checksum, when checksumming with crc32 or adler32.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @return: The state from RunningChecksum.get_state, or None if we don't have one.
+        @rtype: tuple or None
+        """
+        record = self._record_for_file_id(file_id)
+        if record is None or record['checksum_state'] is None:
+            return None
+        return tuple(record['checksum_state'])
+
+    def set_checksum_state(self, file_id, state):
+        """
+        Remember the state of the running checksum for a given file ID. This is written back at the end of the request.
+
+        @param file_id: Unique ID of the file being uploaded
+        @type file_id: str
+        @param state: The state from RunningChecksum.get_state
+        @type state: tuple
+        """
+        record = self._record_for_file_id(file_id)
+        if record is not None:
+            record['checksum_state'] = state
+            self._pending_for(record)['checksum_state'] = True
+
+    def flush_upload_progress(self):
+        """
+        Write back the changes to upload progress buffered during this request. This is called at the end of every
+        request.
+        """
+        pending_progress = self._pending_progress()
+        records = self._progress_records()
+        while pending_progress:
+            expected_file_name, pending = pending_progress.popitem()
+            record = records.get(expected_file_name)
+            if record is None:
+                continue
+            if pending.get('restart'):
+                self._write_restarted_progress(record)
+                continue
+
+            changes = {'updated': datetime.now()}
+            if pending.get('uploaded_byte_count'):
+                changes['uploaded_byte_count'] = record['uploaded_byte_count']
+            elif pending.get('increment'):
+                changes['uploaded_byte_count'] = F('uploaded_byte_count') + pending['increment']
+            if pending.get('checksum_state'):
+                changes['checksum_state'] = self._dump_checksum_state(record['checksum_state'])
+            self.progress_queries += 1
+            UploadProgress.objects.filter(**self._progress_lookup(file_id=record['file_id'])).update(**changes)
+
+    def _write_restarted_progress(self, record):
+        fields = self._progress_fields(record)
+        lookup = self._progress_lookup(file_name=record['file_name'])
+        self.progress_queries += 1
+        if UploadProgress.objects.filter(**lookup).update(**fields):
+            return
+        self.progress_queries += 1
+        progress, created = UploadProgress.objects.get_or_create(defaults=fields, **lookup)
+        if not created:
+            # another request made the row after we looked
+            self.progress_queries += 1
+            UploadProgress.objects.filter(**lookup).update(**fields)
+
+    def _record_for_file_id(self, file_id):
+        for record in self._progress_records().values():
+            if record is not None and record['file_id'] == file_id:
+                return record
+        record = self._fetch_progress(file_id=file_id)
+        if record is not None:
+            self._progress_records()[record['file_name']] = record
+        return record
+
+    def _fetch_progress(self, **lookup):
+        self.progress_queries += 1
+        progress = list(UploadProgress.objects.filter(**self._progress_lookup(**lookup))[:1])
+        return self._make_progress_record(progress[0]) if progress else None
+
+    def _make_new_progress_record(self, expected_file_name, file_id, expected_byte_count=None):
+        record = {
+            'file_name': expected_file_name,
+            'file_id': file_id,
+            'expected_byte_count': expected_byte_count,
+            'uploaded_byte_count': 0,
+            'uploaded_byte_ranges': [],
+            'checksum_state': None,
+            'finalised': False,
+            'version': 0,
+        }
+        self._progress_records()[expected_file_name] = record
+        return record
+
+    def _progress_fields(self, record):
+        # the UploadProgress fields to write for a record, other than the ones it's looked up by
+        return {
+            'file_id': record['file_id'],
+            'expected_byte_count': record['expected_byte_count'],
+            'uploaded_byte_count': record['uploaded_byte_count'],
+            'uploaded_byte_ranges': json.dumps(record['uploaded_byte_ranges']),
+            'checksum_state': self._dump_checksum_state(record['checksum_state']),
+            'finalised': record['finalised'],
+            'version': record['version'],
+            'updated': datetime.now(),
+        }
+
+    def _make_progress_record(self, progress):
+        return {
+            'file_name': progress.file_name,
+            'file_id': progress.file_id,
+            'expected_byte_count': progress.expected_byte_count,
+            'uploaded_byte_count': progress.uploaded_byte_count,
+            'uploaded_byte_ranges': json.loads(progress.uploaded_byte_ranges),
+            'checksum_state': json.loads(progress.checksum_state) if progress.checksum_state else None,
+            'finalised': progress.finalised,
+            'version': progress.version,
+        }
+
+    def _dump_checksum_state(self, state):
+        return json.dumps(list(state)) if state is not None else None
+
+    def _progress_lookup(self, **lookup):
+        lookup['session_key'] = '%s' % self.request.session.session_key
+        lookup['model_name'] = self.model.__name__
+        lookup['upload_id'] = self.upload_id or ''
+        return lookup
+
+    def _pending_for(self, record):
+        return self._pending_progress().setdefault(record['file_name'], {})
+
+    def _progress_records(self):
+        # upload progress we've already read or changed during this request, by file name
+        if not hasattr(self, '_progress_record_cache'):
+            self._progress_record_cache = {}
+        return self._progress_record_cache
+
+    def _pending_progress(self):
+        # changes to upload progress still to be written back, by file name
+        if not hasattr(self, '_pending_progress_cache'):
+            self._pending_progress_cache = {}
+        return self._pending_progress_cache
@@ -9,7 +9,7 @@ os.chdir(os.path.normpath(os.path.join(os.path.abspath(__file__), os.pardir)))
 setup(
     name='django-jquery-upload',
     version='',
-    packages=['jquery_upload'],
+    packages=['jquery_upload', 'jquery_upload.management', 'jquery_upload.management.commands'],
     url='',
     license='MIT',
     author='Shaun Stanworth',